@@ -131,6 +131,12 @@ defs_kin_shaper = """
         , int shaper_type_x, int shaper_type_y
         , double shaper_freq_x, double shaper_freq_y
         , double damping_ratio_x, double damping_ratio_y);
+    double input_shaper_get_schedule_time(struct stepper_kinematics *sk
+        , double print_time, double window);
+    double input_shaper_schedule_shaper_params(struct stepper_kinematics *sk
+        , double print_time, int shaper_type_x, int shaper_type_y
+        , double shaper_freq_x, double shaper_freq_y
+        , double damping_ratio_x, double damping_ratio_y);
     int input_shaper_set_sk(struct stepper_kinematics *sk
         , struct stepper_kinematics *orig_sk);
     struct stepper_kinematics * input_shaper_alloc(void);
@@ -145,15 +151,25 @@ defs_serialqueue = """
         uint64_t notify_id;
     };
 
+    struct serialqueue_stats {
+        uint32_t bytes_write, bytes_read, bytes_retransmit, bytes_invalid;
+        uint32_t send_seq, receive_seq, retransmit_seq;
+        double srtt, rttvar, rto;
+        int ready_bytes, stalled_bytes;
+    };
+
     struct serialqueue *serialqueue_alloc(int serial_fd, char serial_fd_type
-        , int client_id);
+        , int client_id, char name[16]);
     void serialqueue_exit(struct serialqueue *sq);
     void serialqueue_free(struct serialqueue *sq);
+    void serialqueue_discard_pending(struct serialqueue *sq);
     struct command_queue *serialqueue_alloc_commandqueue(void);
     void serialqueue_free_commandqueue(struct command_queue *cq);
     void serialqueue_send(struct serialqueue *sq, struct command_queue *cq
         , uint8_t *msg, int len, uint64_t min_clock, uint64_t req_clock
         , uint64_t notify_id);
+    int serialqueue_pull_batch(struct serialqueue *sq
+        , struct pull_queue_message *q, int max);
     void serialqueue_pull(struct serialqueue *sq
         , struct pull_queue_message *pqm);
     void serialqueue_set_baud_adjust(struct serialqueue *sq
@@ -162,7 +178,8 @@ defs_serialqueue = """
         , int receive_window);
     void serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
         , double last_clock_time, uint64_t last_clock);
-    void serialqueue_get_stats(struct serialqueue *sq, char *buf, int len);
+    void serialqueue_get_stats(struct serialqueue *sq
+        , struct serialqueue_stats *stats);
     int serialqueue_extract_old(struct serialqueue *sq, int sentq
         , struct pull_queue_message *q, int max);
 """
@@ -11,6 +11,7 @@
 #include <string.h> // memset
 #include "compiler.h" // __visible
 #include "itersolve.h" // struct stepper_kinematics
+#include "list.h" // list_first_entry
 #include "trapq.h" // struct move
 
 
@@ -274,6 +275,35 @@ calc_position(struct move *m, int axis, double move_time
 }
 
 
+/****************************************************************
+ * Scheduled shaper parameter changes
+ ****************************************************************/
+
+// Shaper parameters in effect from 'time' (params[0] has no start time).
+// The position is blended from the previous parameters over 'ramp_t'.
+struct shaper_params {
+    double time, ramp_t;
+    struct shaper_pulses sx, sy;
+};
+
+#define MAX_SHAPER_PARAMS 8
+
+static inline double
+get_shaper_duration(struct shaper_pulses *sp)
+{
+    if (!sp->num_pulses)
+        return 0.;
+    return sp->pulses[sp->num_pulses-1].t - sp->pulses[0].t;
+}
+
+// Smoothly transition between two positions (zero velocity at both ends)
+static inline double
+blend_position(double prev_pos, double pos, double s)
+{
+    return prev_pos + (pos - prev_pos) * s * s * (3. - 2. * s);
+}
+
+
 /****************************************************************
  * Kinematics-related shaper code
  ****************************************************************/
@@ -284,18 +314,50 @@ struct input_shaper {
     struct stepper_kinematics sk;
     struct stepper_kinematics *orig_sk;
     struct move m;
-    struct shaper_pulses sx, sy;
+    int num_params, shape_x, shape_y;
+    struct shaper_params params[MAX_SHAPER_PARAMS];
 };
 
+static inline double
+calc_shaped_position(struct move *m, int axis, double move_time
+                     , struct shaper_pulses *sp)
+{
+    if (!sp->num_pulses)
+        return get_axis_position(m, axis, move_time);
+    return calc_position(m, axis, move_time, sp);
+}
+
+// Calculate the position of an axis using the shaper in effect at move_time
+static double
+calc_axis_position(struct input_shaper *is, struct move *m, int axis
+                   , double move_time)
+{
+    struct shaper_params *p = &is->params[is->num_params - 1];
+    if (likely(is->num_params == 1))
+        return calc_shaped_position(m, axis, move_time
+                                    , axis == 'x' ? &p->sx : &p->sy);
+    double time = m->print_time + move_time;
+    while (p > is->params && time < p->time)
+        p--;
+    double pos = calc_shaped_position(m, axis, move_time
+                                      , axis == 'x' ? &p->sx : &p->sy);
+    if (p == is->params || time >= p->time + p->ramp_t)
+        return pos;
+    struct shaper_params *pp = p - 1;
+    double prev_pos = calc_shaped_position(m, axis, move_time
+                                           , axis == 'x' ? &pp->sx : &pp->sy);
+    return blend_position(prev_pos, pos, (time - p->time) / p->ramp_t);
+}
+
 // Optimized calc_position when only x axis is needed
 static double
 shaper_x_calc_position(struct stepper_kinematics *sk, struct move *m
                        , double move_time)
 {
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
-    if (!is->sx.num_pulses)
+    if (!is->shape_x)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
-    is->m.start_pos.x = calc_position(m, 'x', move_time, &is->sx);
+    is->m.start_pos.x = calc_axis_position(is, m, 'x', move_time);
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
 
@@ -305,9 +367,9 @@ shaper_y_calc_position(struct stepper_kinematics *sk, struct move *m
                        , double move_time)
 {
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
-    if (!is->sy.num_pulses)
+    if (!is->shape_y)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
-    is->m.start_pos.y = calc_position(m, 'y', move_time, &is->sy);
+    is->m.start_pos.y = calc_axis_position(is, m, 'y', move_time);
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
 
@@ -317,13 +379,13 @@ shaper_xy_calc_position(struct stepper_kinematics *sk, struct move *m
                         , double move_time)
 {
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
-    if (!is->sx.num_pulses && !is->sy.num_pulses)
+    if (!is->shape_x && !is->shape_y)
         return is->orig_sk->calc_position_cb(is->orig_sk, m, move_time);
     is->m.start_pos = move_get_coord(m, move_time);
-    if (is->sx.num_pulses)
-        is->m.start_pos.x = calc_position(m, 'x', move_time, &is->sx);
-    if (is->sy.num_pulses)
-        is->m.start_pos.y = calc_position(m, 'y', move_time, &is->sy);
+    if (is->shape_x)
+        is->m.start_pos.x = calc_axis_position(is, m, 'x', move_time);
+    if (is->shape_y)
+        is->m.start_pos.y = calc_axis_position(is, m, 'y', move_time);
     return is->orig_sk->calc_position_cb(is->orig_sk, &is->m, DUMMY_T);
 }
 
@@ -349,20 +411,81 @@ static void
 shaper_note_generation_time(struct input_shaper *is)
 {
     double pre_active = 0., post_active = 0.;
-    if ((is->sk.active_flags & AF_X) && is->sx.num_pulses) {
-        pre_active = is->sx.pulses[is->sx.num_pulses-1].t;
-        post_active = -is->sx.pulses[0].t;
-    }
-    if ((is->sk.active_flags & AF_Y) && is->sy.num_pulses) {
-        pre_active = is->sy.pulses[is->sy.num_pulses-1].t > pre_active
-            ? is->sy.pulses[is->sy.num_pulses-1].t : pre_active;
-        post_active = -is->sy.pulses[0].t > post_active
-            ? -is->sy.pulses[0].t : post_active;
+    int i;
+    is->shape_x = is->shape_y = 0;
+    for (i = 0; i < is->num_params; i++) {
+        struct shaper_pulses *sx = &is->params[i].sx, *sy = &is->params[i].sy;
+        if ((is->sk.active_flags & AF_X) && sx->num_pulses) {
+            is->shape_x = 1;
+            if (sx->pulses[sx->num_pulses-1].t > pre_active)
+                pre_active = sx->pulses[sx->num_pulses-1].t;
+            if (-sx->pulses[0].t > post_active)
+                post_active = -sx->pulses[0].t;
+        }
+        if ((is->sk.active_flags & AF_Y) && sy->num_pulses) {
+            is->shape_y = 1;
+            if (sy->pulses[sy->num_pulses-1].t > pre_active)
+                pre_active = sy->pulses[sy->num_pulses-1].t;
+            if (-sy->pulses[0].t > post_active)
+                post_active = -sy->pulses[0].t;
+        }
     }
     is->sk.gen_steps_pre_active = pre_active;
     is->sk.gen_steps_post_active = post_active;
 }
 
+static void
+init_shaper_params(struct input_shaper *is, struct shaper_params *p
+                   , int shaper_type_x, int shaper_type_y
+                   , double shaper_freq_x, double shaper_freq_y
+                   , double damping_ratio_x, double damping_ratio_y)
+{
+    if (is->orig_sk->active_flags & AF_X)
+        init_shaper(shaper_type_x, shaper_freq_x, damping_ratio_x, &p->sx);
+    else
+        p->sx.num_pulses = 0;
+    if (is->orig_sk->active_flags & AF_Y)
+        init_shaper(shaper_type_y, shaper_freq_y, damping_ratio_y, &p->sy);
+    else
+        p->sy.num_pulses = 0;
+}
+
+// Blend over twice the longest shaper duration - shorter transitions
+// cause noticeable extra acceleration
+static double
+get_transition_time(struct shaper_params *p1, struct shaper_params *p2)
+{
+    double t = get_shaper_duration(&p1->sx), t2 = get_shaper_duration(&p1->sy);
+    if (t2 > t)
+        t = t2;
+    t2 = get_shaper_duration(&p2->sx);
+    if (t2 > t)
+        t = t2;
+    t2 = get_shaper_duration(&p2->sy);
+    if (t2 > t)
+        t = t2;
+    return 2. * t;
+}
+
+// Remove parameters that no longer apply to steps yet to be generated
+static void
+shaper_drop_params(struct input_shaper *is)
+{
+    int count = 0;
+    while (count + 1 < is->num_params) {
+        struct shaper_params *p = &is->params[count + 1];
+        if (p->time + p->ramp_t > is->sk.last_flush_time)
+            break;
+        count++;
+    }
+    if (!count)
+        return;
+    is->num_params -= count;
+    memmove(is->params, &is->params[count]
+            , is->num_params * sizeof(is->params[0]));
+}
+
+// Set shaper parameters (only valid when step generation is flushed)
 int __visible
 input_shaper_set_shaper_params(struct stepper_kinematics *sk
                                , int shaper_type_x
@@ -373,18 +496,74 @@ input_shaper_set_shaper_params(struct stepper_kinematics *sk
                                , double damping_ratio_y)
 {
     struct input_shaper *is = container_of(sk, struct input_shaper, sk);
-    if (is->orig_sk->active_flags & AF_X)
-        init_shaper(shaper_type_x, shaper_freq_x, damping_ratio_x, &is->sx);
-    else
-        is->sx.num_pulses = 0;
-    if (is->orig_sk->active_flags & AF_Y)
-        init_shaper(shaper_type_y, shaper_freq_y, damping_ratio_y, &is->sy);
-    else
-        is->sy.num_pulses = 0;
+    is->num_params = 1;
+    init_shaper_params(is, &is->params[0], shaper_type_x, shaper_type_y
+                       , shaper_freq_x, shaper_freq_y
+                       , damping_ratio_x, damping_ratio_y);
     shaper_note_generation_time(is);
     return 0;
 }
 
+// Return the earliest time (at or after print_time) that new shaper
+// parameters with the given step generation window could take effect
+double __visible
+input_shaper_get_schedule_time(struct stepper_kinematics *sk
+                               , double print_time, double window)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    shaper_drop_params(is);
+    // Steps that were already generated can not change
+    if (print_time < sk->last_flush_time)
+        print_time = sk->last_flush_time;
+    // Do not overlap with a previous transition (if there are too many
+    // pending changes then the last one is replaced)
+    int last_idx = is->num_params - 1;
+    if (is->num_params >= MAX_SHAPER_PARAMS)
+        last_idx--;
+    struct shaper_params *last = &is->params[last_idx];
+    if (last_idx > 0 && print_time < last->time + last->ramp_t)
+        print_time = last->time + last->ramp_t;
+    // The new shaper must not reference moves that were already freed
+    if (sk->tq) {
+        trapq_check_sentinels(sk->tq);
+        struct move *m = list_first_entry(&sk->tq->moves, struct move, node);
+        m = list_next_entry(m, node);
+        if (!list_is_last(&m->node, &sk->tq->moves)
+            && print_time < m->print_time + window)
+            print_time = m->print_time + window;
+    }
+    return print_time;
+}
+
+// Schedule new shaper parameters to take effect at print_time.  Returns
+// the time after which only the new parameters are in use.
+double __visible
+input_shaper_schedule_shaper_params(struct stepper_kinematics *sk
+                                    , double print_time
+                                    , int shaper_type_x
+                                    , int shaper_type_y
+                                    , double shaper_freq_x
+                                    , double shaper_freq_y
+                                    , double damping_ratio_x
+                                    , double damping_ratio_y)
+{
+    struct input_shaper *is = container_of(sk, struct input_shaper, sk);
+    print_time = input_shaper_get_schedule_time(sk, print_time, 0.);
+    // If there are too many pending changes then replace the last one.
+    // It is not in use yet - a transition in progress at the last flush
+    // would be the only pending change (the others are dropped).
+    if (is->num_params < MAX_SHAPER_PARAMS)
+        is->num_params++;
+    struct shaper_params *p = &is->params[is->num_params - 1];
+    init_shaper_params(is, p, shaper_type_x, shaper_type_y
+                       , shaper_freq_x, shaper_freq_y
+                       , damping_ratio_x, damping_ratio_y);
+    p->time = print_time;
+    p->ramp_t = get_transition_time(p - 1, p);
+    shaper_note_generation_time(is);
+    return p->time + p->ramp_t;
+}
+
 double __visible
 input_shaper_get_step_generation_window(int shaper_type, double shaper_freq
                                         , double damping_ratio)
@@ -405,5 +584,6 @@ input_shaper_alloc(void)
     struct input_shaper *is = malloc(sizeof(*is));
     memset(is, 0, sizeof(*is));
     is->m.move_t = 2. * DUMMY_T;
+    is->num_params = 1;
     return &is->sk;
 }
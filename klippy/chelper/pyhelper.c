@@ -9,6 +9,7 @@
 #include <stdint.h> // uint8_t
 #include <stdio.h> // fprintf
 #include <string.h> // strerror
+#include <sys/prctl.h> // prctl
 #include <time.h> // struct timespec
 #include "compiler.h" // __visible
 #include "pyhelper.h" // get_monotonic
@@ -26,6 +27,13 @@ get_monotonic(void)
     return (double)ts.tv_sec + (double)ts.tv_nsec * .000000001;
 }
 
+// Set the name of the calling thread (as reported in /proc)
+void
+set_thread_name(char name[16])
+{
+    prctl(PR_SET_NAME, name);
+}
+
 // Fill a 'struct timespec' with a system time stored in a double
 struct timespec
 fill_time(double time)
@@ -3,6 +3,7 @@
 
 double get_monotonic(void);
 struct timespec fill_time(double time);
+void set_thread_name(char name[16]);
 void set_python_logging_callback(void (*func)(const char *));
 void errorf(const char *fmt, ...) __attribute__ ((format (printf, 1, 2)));
 void report_errno(char *where, int rc);
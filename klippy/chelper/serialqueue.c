@@ -19,9 +19,8 @@
 #include <pthread.h> // pthread_mutex_lock
 #include <stddef.h> // offsetof
 #include <stdint.h> // uint64_t
-#include <stdio.h> // snprintf
 #include <stdlib.h> // malloc
-#include <string.h> // memset
+#include <string.h> // memset, strncpy
 #include <termios.h> // tcflush
 #include <unistd.h> // pipe
 #include "compiler.h" // __visible
@@ -357,6 +356,7 @@ struct serialqueue {
     struct pollreactor pr;
     int serial_fd, serial_fd_type, client_id;
     int pipe_fds[2];
+    char name[16];
     uint8_t input_buf[4096];
     uint8_t need_sync;
     int input_pos;
@@ -886,6 +886,7 @@ static void *
 background_thread(void *data)
 {
     struct serialqueue *sq = data;
+    set_thread_name(sq->name);
     pollreactor_run(&sq->pr);
 
     pthread_mutex_lock(&sq->lock);
@@ -897,13 +898,15 @@ background_thread(void *data)
 
 // Create a new 'struct serialqueue' object
 struct serialqueue * __visible
-serialqueue_alloc(int serial_fd, char serial_fd_type, int client_id)
+serialqueue_alloc(int serial_fd, char serial_fd_type, int client_id
+                  , char name[16])
 {
     struct serialqueue *sq = malloc(sizeof(*sq));
     memset(sq, 0, sizeof(*sq));
     sq->serial_fd = serial_fd;
     sq->serial_fd_type = serial_fd_type;
     sq->client_id = client_id;
+    strncpy(sq->name, name, sizeof(sq->name) - 1);
 
     int ret = pipe(sq->pipe_fds);
     if (ret)
@@ -999,6 +1002,22 @@ serialqueue_free(struct serialqueue *sq)
     free(sq);
 }
 
+// Discard all messages that are queued but not yet sent
+void __visible
+serialqueue_discard_pending(struct serialqueue *sq)
+{
+    pthread_mutex_lock(&sq->lock);
+    while (!list_empty(&sq->pending_queues)) {
+        struct command_queue *cq = list_first_entry(
+            &sq->pending_queues, struct command_queue, node);
+        list_del(&cq->node);
+        message_queue_free(&cq->ready_queue);
+        message_queue_free(&cq->stalled_queue);
+    }
+    sq->ready_bytes = sq->stalled_bytes = 0;
+    pthread_mutex_unlock(&sq->lock);
+}
+
 // Allocate a 'struct command_queue'
 struct command_queue * __visible
 serialqueue_alloc_commandqueue(void)
@@ -1077,44 +1096,56 @@ serialqueue_send(struct serialqueue *sq, struct command_queue *cq, uint8_t *msg
     serialqueue_send_batch(sq, cq, &msgs);
 }
 
-// Return a message read from the serial port (or wait for one if none
-// available)
-void __visible
-serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+// Return up to 'max' messages read from the serial port (or wait for
+// one if none available).  Returns the number of messages or -1 on exit.
+int __visible
+serialqueue_pull_batch(struct serialqueue *sq, struct pull_queue_message *q
+                       , int max)
 {
     pthread_mutex_lock(&sq->lock);
     // Wait for message to be available
     while (list_empty(&sq->receive_queue)) {
-        if (pollreactor_is_exit(&sq->pr))
-            goto exit;
+        if (pollreactor_is_exit(&sq->pr)) {
+            pthread_mutex_unlock(&sq->lock);
+            return -1;
+        }
         sq->receive_waiting = 1;
         int ret = pthread_cond_wait(&sq->cond, &sq->lock);
         if (ret)
             report_errno("pthread_cond_wait", ret);
     }
 
-    // Remove message from queue
-    struct queue_message *qm = list_first_entry(
-        &sq->receive_queue, struct queue_message, node);
-    list_del(&qm->node);
-
-    // Copy message
-    memcpy(pqm->msg, qm->msg, qm->len);
-    pqm->len = qm->len;
-    pqm->sent_time = qm->sent_time;
-    pqm->receive_time = qm->receive_time;
-    pqm->notify_id = qm->notify_id;
-    if (qm->len)
-        debug_queue_add(&sq->old_receive, qm);
-    else
-        message_free(qm);
+    // Remove messages from queue
+    int count = 0;
+    while (count < max && !list_empty(&sq->receive_queue)) {
+        struct queue_message *qm = list_first_entry(
+            &sq->receive_queue, struct queue_message, node);
+        list_del(&qm->node);
 
-    pthread_mutex_unlock(&sq->lock);
-    return;
+        // Copy message
+        struct pull_queue_message *pqm = &q[count++];
+        memcpy(pqm->msg, qm->msg, qm->len);
+        pqm->len = qm->len;
+        pqm->sent_time = qm->sent_time;
+        pqm->receive_time = qm->receive_time;
+        pqm->notify_id = qm->notify_id;
+        if (qm->len)
+            debug_queue_add(&sq->old_receive, qm);
+        else
+            message_free(qm);
+    }
 
-exit:
-    pqm->len = -1;
     pthread_mutex_unlock(&sq->lock);
+    return count;
+}
+
+// Return a message read from the serial port (or wait for one if none
+// available)
+void __visible
+serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
+{
+    if (serialqueue_pull_batch(sq, pqm, 1) < 0)
+        pqm->len = -1;
 }
 
 void __visible
@@ -1146,26 +1177,24 @@ serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
     pthread_mutex_unlock(&sq->lock);
 }
 
-// Return a string buffer containing statistics for the serial port
+// Fill a 'struct serialqueue_stats' with statistics for the serial port
 void __visible
-serialqueue_get_stats(struct serialqueue *sq, char *buf, int len)
+serialqueue_get_stats(struct serialqueue *sq, struct serialqueue_stats *stats)
 {
-    struct serialqueue stats;
     pthread_mutex_lock(&sq->lock);
-    memcpy(&stats, sq, sizeof(stats));
+    stats->bytes_write = sq->bytes_write;
+    stats->bytes_read = sq->bytes_read;
+    stats->bytes_retransmit = sq->bytes_retransmit;
+    stats->bytes_invalid = sq->bytes_invalid;
+    stats->send_seq = sq->send_seq;
+    stats->receive_seq = sq->receive_seq;
+    stats->retransmit_seq = sq->retransmit_seq;
+    stats->srtt = sq->srtt;
+    stats->rttvar = sq->rttvar;
+    stats->rto = sq->rto;
+    stats->ready_bytes = sq->ready_bytes;
+    stats->stalled_bytes = sq->stalled_bytes;
     pthread_mutex_unlock(&sq->lock);
-
-    snprintf(buf, len, "bytes_write=%u bytes_read=%u"
-             " bytes_retransmit=%u bytes_invalid=%u"
-             " send_seq=%u receive_seq=%u retransmit_seq=%u"
-             " srtt=%.3f rttvar=%.3f rto=%.3f"
-             " ready_bytes=%u stalled_bytes=%u"
-             , stats.bytes_write, stats.bytes_read
-             , stats.bytes_retransmit, stats.bytes_invalid
-             , (int)stats.send_seq, (int)stats.receive_seq
-             , (int)stats.retransmit_seq
-             , stats.srtt, stats.rttvar, stats.rto
-             , stats.ready_bytes, stats.stalled_bytes);
 }
 
 // Extract old messages stored in the debug queues
@@ -46,11 +46,19 @@ struct pull_queue_message {
     uint64_t notify_id;
 };
 
+struct serialqueue_stats {
+    uint32_t bytes_write, bytes_read, bytes_retransmit, bytes_invalid;
+    uint32_t send_seq, receive_seq, retransmit_seq;
+    double srtt, rttvar, rto;
+    int ready_bytes, stalled_bytes;
+};
+
 struct serialqueue;
 struct serialqueue *serialqueue_alloc(int serial_fd, char serial_fd_type
-                                      , int client_id);
+                                      , int client_id, char name[16]);
 void serialqueue_exit(struct serialqueue *sq);
 void serialqueue_free(struct serialqueue *sq);
+void serialqueue_discard_pending(struct serialqueue *sq);
 struct command_queue *serialqueue_alloc_commandqueue(void);
 void serialqueue_free_commandqueue(struct command_queue *cq);
 void serialqueue_send_batch(struct serialqueue *sq, struct command_queue *cq
@@ -58,12 +66,15 @@ void serialqueue_send_batch(struct serialqueue *sq, struct command_queue *cq
 void serialqueue_send(struct serialqueue *sq, struct command_queue *cq
                       , uint8_t *msg, int len, uint64_t min_clock
                       , uint64_t req_clock, uint64_t notify_id);
+int serialqueue_pull_batch(struct serialqueue *sq, struct pull_queue_message *q
+                           , int max);
 void serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm);
 void serialqueue_set_baud_adjust(struct serialqueue *sq, double baud_adjust);
 void serialqueue_set_receive_window(struct serialqueue *sq, int receive_window);
 void serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
                                , double last_clock_time, uint64_t last_clock);
-void serialqueue_get_stats(struct serialqueue *sq, char *buf, int len);
+void serialqueue_get_stats(struct serialqueue *sq
+                           , struct serialqueue_stats *stats);
 int serialqueue_extract_old(struct serialqueue *sq, int sentq
                             , struct pull_queue_message *q, int max);
 
@@ -30,13 +30,7 @@ class ClockSync:
     def connect(self, serial):
         self.serial = serial
         self.mcu_freq = serial.msgparser.get_constant_float('CLOCK_FREQ')
-        # Load initial clock and frequency
-        params = serial.send_with_response('get_uptime', 'uptime')
-        self.last_clock = (params['high'] << 32) | params['clock']
-        self.clock_avg = self.last_clock
-        self.time_avg = params['#sent_time']
-        self.clock_est = (self.time_avg, self.clock_avg, self.mcu_freq)
-        self.prediction_variance = (.001 * self.mcu_freq)**2
+        self._load_uptime()
         # Enable periodic get_clock timer
         for i in range(8):
             self.reactor.pause(self.reactor.monotonic() + 0.050)
@@ -47,6 +41,27 @@ class ClockSync:
         self.cmd_queue = serial.alloc_command_queue()
         serial.register_response(self._handle_clock, 'clock')
         self.reactor.update_timer(self.get_clock_timer, self.reactor.NOW)
+    def _load_uptime(self):
+        # Load initial clock and frequency
+        params = self.serial.send_with_response('get_uptime', 'uptime')
+        self.last_clock = (params['high'] << 32) | params['clock']
+        self.clock_avg = self.last_clock
+        self.time_avg = params['#sent_time']
+        self.clock_est = (self.time_avg, self.clock_avg, self.mcu_freq)
+        self.prediction_variance = (.001 * self.mcu_freq)**2
+    def attach(self, reactor):
+        # Take over a retained session with a new reactor (see resume())
+        self.reactor = reactor
+        self.get_clock_timer = reactor.register_timer(self._get_clock_event)
+    def resume(self):
+        # Resume clock tracking of a retained session.  No clock
+        # responses were tracked while the session was detached
+        # (possibly for longer than a 32bit clock rollover), so reload
+        # the 64bit clock before resuming the periodic queries.
+        self._load_uptime()
+        self.last_prediction_time = -9999.
+        self.serial.register_response(self._handle_clock, 'clock')
+        self.reactor.update_timer(self.get_clock_timer, self.reactor.NOW)
     def connect_file(self, serial, pace=False):
         self.serial = serial
         self.mcu_freq = serial.msgparser.get_constant_float('CLOCK_FREQ')
@@ -157,7 +172,7 @@ class ClockSync:
                     self.prediction_variance))
     def stats(self, eventtime):
         sample_time, clock, freq = self.clock_est
-        return "freq=%d" % (freq,)
+        return {'freq': int(freq)}
     def calibrate_clock(self, print_time, eventtime):
         return (0., self.mcu_freq)
 
@@ -194,7 +209,9 @@ class SecondarySync(ClockSync):
             ClockSync.dump_debug(self), adjusted_offset, adjusted_freq)
     def stats(self, eventtime):
         adjusted_offset, adjusted_freq = self.clock_adj
-        return "%s adj=%d" % (ClockSync.stats(self, eventtime), adjusted_freq)
+        out = ClockSync.stats(self, eventtime)
+        out['adj'] = int(adjusted_freq)
+        return out
     def calibrate_clock(self, print_time, eventtime):
         # Calculate: est_print_time = main_sync.estimatated_print_time()
         ser_time, ser_clock, ser_freq = self.main_sync.clock_est
@@ -143,8 +143,9 @@ class KeyboardReader:
         self.ser.register_response(self.handle_suppress, name, oid)
     def command_STATS(self, parts):
         curtime = self.reactor.monotonic()
-        self.output(' '.join([self.ser.stats(curtime),
-                              self.clocksync.stats(curtime)]))
+        stats = self.ser.stats(curtime)
+        stats.update(self.clocksync.stats(curtime))
+        self.output(util.format_stats(stats))
     def command_LIST(self, parts):
         self.update_evals(self.reactor.monotonic())
         mp = self.ser.get_msgparser()
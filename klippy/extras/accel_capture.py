@@ -0,0 +1,105 @@
+# Binary accelerometer capture files
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import json, struct
+
+# File layout (all values little endian):
+#   CAPTURE_MAGIC
+#   uint32 header length, followed by a json header (padded to 8 bytes)
+#   uint32[messages] sequence number of each message from the mcu
+#   uint8[messages] number of samples in each message (padded to 8 bytes)
+#   int16[samples][3] raw chip samples
+# The header contains the fields needed to convert the raw samples to
+# printer axes and sample times (see decode_raw() below).
+CAPTURE_MAGIC = b'KLACCEL1'
+
+def _pad8(data):
+    return data + b'\x00' * (-len(data) % 8)
+
+# Write a capture file (does not require numpy)
+def write_capture(filename, header, raw_samples):
+    raw_samples = [(seq, data[:len(data)//6*6]) for seq, data in raw_samples]
+    header = dict(header)
+    header['messages'] = len(raw_samples)
+    header['samples'] = sum([len(data)//6 for seq, data in raw_samples])
+    hdata = _pad8(json.dumps(header).encode())
+    counts = bytes(bytearray([len(data)//6 for seq, data in raw_samples]))
+    f = open(filename, "wb")
+    f.write(CAPTURE_MAGIC + struct.pack('<I', len(hdata)) + hdata)
+    f.write(struct.pack('<%dI' % (len(raw_samples),),
+                        *[seq for seq, data in raw_samples]))
+    f.write(_pad8(counts))
+    for seq, data in raw_samples:
+        f.write(data)
+    f.close()
+
+def is_capture_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+# Convert raw chip samples to an (N, 4) array of (time, x, y, z) rows
+def decode_raw(np, header, seqs, counts, raw):
+    counts = counts.astype(np.int64)
+    axes_matrix = np.zeros((3, 3))
+    for i, (pos, scale) in enumerate(header['axes_map']):
+        axes_matrix[pos, i] = scale
+    samples = np.empty((raw.shape[0], 4))
+    samples[:, 1:] = raw.dot(axes_matrix)
+    # Calculate sample times from the sequence of each message
+    seq_times = header['start_time'] + seqs * header['seq_to_time']
+    msg_starts = np.cumsum(counts) - counts
+    msg_index = np.arange(raw.shape[0]) - np.repeat(msg_starts, counts)
+    samples[:, 0] = (np.repeat(seq_times, counts)
+                     + msg_index * header['time_per_sample'])
+    return samples
+
+# Read the header of a capture file and the file offsets of its arrays
+def _read_layout(f):
+    f.seek(len(CAPTURE_MAGIC))
+    hlen, = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(hlen).rstrip(b'\x00'))
+    msg_count = header['messages']
+    seqs_pos = len(CAPTURE_MAGIC) + 4 + hlen
+    counts_pos = seqs_pos + 4 * msg_count
+    raw_pos = counts_pos + msg_count + (-msg_count % 8)
+    return header, seqs_pos, counts_pos, raw_pos
+
+# Memory map a capture file - returns the header and the raw arrays
+def map_capture(np, filename):
+    with open(filename, 'rb') as f:
+        header, seqs_pos, counts_pos, raw_pos = _read_layout(f)
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    msg_count = header['messages']
+    seqs = np.ndarray((msg_count,), dtype='<u4', buffer=data,
+                      offset=seqs_pos)
+    counts = np.ndarray((msg_count,), dtype=np.uint8, buffer=data,
+                        offset=counts_pos)
+    raw = np.ndarray((header['samples'], 3), dtype='<i2', buffer=data,
+                     offset=raw_pos)
+    return header, seqs, counts, raw
+
+# Decode a capture file in blocks of messages - yields (N, 4) arrays
+# without loading (or mapping) the whole file
+def read_capture_chunks(np, filename, chunk_messages):
+    with open(filename, 'rb') as f:
+        header, seqs_pos, counts_pos, raw_pos = _read_layout(f)
+        msg_count = header['messages']
+        sample_pos = 0
+        for i in range(0, msg_count, chunk_messages):
+            count = min(chunk_messages, msg_count - i)
+            f.seek(seqs_pos + 4 * i)
+            seqs = np.fromfile(f, dtype='<u4', count=count)
+            f.seek(counts_pos + i)
+            counts = np.fromfile(f, dtype=np.uint8, count=count)
+            sample_count = int(counts.sum(dtype=np.int64))
+            f.seek(raw_pos + 6 * sample_pos)
+            raw = np.fromfile(f, dtype='<i2', count=3 * sample_count)
+            sample_pos += sample_count
+            yield decode_raw(np, header, seqs, counts, raw.reshape(-1, 3))
+
+# Load a capture file as an (N, 4) array of (time, x, y, z) rows
+def load_capture(np, filename):
+    header, seqs, counts, raw = map_capture(np, filename)
+    return decode_raw(np, header, seqs, counts, raw)
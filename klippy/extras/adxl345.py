@@ -4,7 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import logging, time, collections, multiprocessing, os
-from . import bus
+from . import bus, accel_capture
 
 # ADXL345 registers
 REG_DEVID = 0x00
@@ -22,6 +22,8 @@ QUERY_RATES = {
 
 SCALE = 0.004 * 9.80665 * 1000. # 4mg/LSB * Earth gravity in mm/s**2
 
+MAX_STORED_MESSAGES = 300000
+
 Accel_Measurement = collections.namedtuple(
     'Accel_Measurement', ('time', 'accel_x', 'accel_y', 'accel_z'))
 
@@ -30,6 +32,8 @@ class ADXL345Results:
     def __init__(self):
         self.raw_samples = None
         self.samples = []
+        self.axes_map = [(0, SCALE), (1, SCALE), (2, SCALE)]
+        self.start2_time = self.seq_to_time = 0.
         self.drops = self.overflows = 0
         self.time_per_sample = self.start_range = self.end_range = 0.
     def get_stats(self):
@@ -37,9 +41,10 @@ class ADXL345Results:
                 ",time_per_sample=%.9f,start_range=%.6f,end_range=%.6f"
                 % (self.drops, self.overflows,
                    self.time_per_sample, self.start_range, self.end_range))
-    def setup_data(self, axes_map, raw_samples, end_sequence, overflows,
+    def setup_data(self, axes_map, raw_samples, sample_count, last_count,
+                   end_sequence, overflows,
                    start1_time, start2_time, end1_time, end2_time):
-        if not raw_samples or not end_sequence:
+        if not sample_count or not end_sequence:
             return
         self.axes_map = axes_map
         self.raw_samples = raw_samples
@@ -47,12 +52,11 @@ class ADXL345Results:
         self.start2_time = start2_time
         self.start_range = start2_time - start1_time
         self.end_range = end2_time - end1_time
-        self.total_count = (end_sequence - 1) * 8 + len(raw_samples[-1][1]) // 6
+        self.total_count = (end_sequence - 1) * 8 + last_count
         total_time = end2_time - start2_time
         self.time_per_sample = time_per_sample = total_time / self.total_count
         self.seq_to_time = time_per_sample * 8.
-        actual_count = sum([len(data)//6 for _, data in raw_samples])
-        self.drops = self.total_count - actual_count
+        self.drops = self.total_count - sample_count
     def decode_samples(self):
         if not self.raw_samples:
             return self.samples
@@ -74,13 +78,34 @@ class ADXL345Results:
                 actual_count += 1
         del samples[actual_count:]
         return self.samples
-    def write_to_file(self, filename):
+    def get_capture_header(self):
+        return {'stats': self.get_stats(), 'axes_map': self.axes_map,
+                'start_time': self.start2_time,
+                'seq_to_time': self.seq_to_time,
+                'time_per_sample': self.time_per_sample}
+    def decode_samples_array(self, np):
+        # Decode all samples at once into an (N, 4) numpy array of
+        # (time, accel_x, accel_y, accel_z) rows
+        if not self.raw_samples:
+            return np.zeros((0, 4))
+        seqs = np.array([seq for seq, data in self.raw_samples])
+        counts = np.array([len(data) // 6 for seq, data in self.raw_samples])
+        raw = b''.join([data if not len(data) % 6 else data[:len(data)//6*6]
+                        for seq, data in self.raw_samples])
+        raw = np.frombuffer(raw, dtype='<i2').reshape(-1, 3)
+        return accel_capture.decode_raw(np, self.get_capture_header(),
+                                        seqs, counts, raw)
+    def write_to_file(self, filename, binary=False):
         def write_impl():
             try:
                 # Try to re-nice writing process
                 os.nice(20)
             except:
                 pass
+            if binary:
+                accel_capture.write_capture(
+                    filename, self.get_capture_header(), self.raw_samples or [])
+                return
             f = open(filename, "w")
             f.write("##%s\n#time,accel_x,accel_y,accel_z\n" % (
                 self.get_stats(),))
@@ -110,6 +135,8 @@ class ADXL345:
             raise config.error("Invalid rate parameter: %d" % (self.data_rate,))
         # Measurement storage (accessed from background thread)
         self.raw_samples = []
+        self.stream = None
+        self.sample_count = self.last_count = self.discarded = 0
         self.last_sequence = 0
         self.samples_start1 = self.samples_start2 = 0.
         # Setup mcu sensor_adxl345 bulk query code
@@ -160,17 +187,26 @@ class ADXL345:
         if sequence < last_sequence:
             sequence += 0x10000
         self.last_sequence = sequence
-        raw_samples = self.raw_samples
-        if len(raw_samples) >= 300000:
+        data = params['data']
+        if self.stream is not None:
+            # Samples are consumed as they arrive - nothing is stored here
+            self.stream.add_data(data)
+        elif len(self.raw_samples) >= MAX_STORED_MESSAGES:
             # Avoid filling up memory with too many samples
+            self.discarded += 1
             return
-        raw_samples.append((sequence, params['data']))
+        else:
+            self.raw_samples.append((sequence, data))
+        self.last_count = len(data) // 6
+        self.sample_count += self.last_count
     def _convert_sequence(self, sequence):
         sequence = (self.last_sequence & ~0xffff) | sequence
         if sequence < self.last_sequence:
             sequence += 0x10000
         return sequence
-    def start_measurements(self, rate=None):
+    def start_measurements(self, rate=None, stream=None):
+        # If a stream is given, samples are passed to its add_data()
+        # method (from the serial thread) instead of being stored
         rate = rate or self.data_rate
         # Verify chip connectivity
         params = self.spi.spi_transfer([REG_DEVID | REG_MOD_READ, 0x00])
@@ -190,6 +226,8 @@ class ADXL345:
         # Setup samples
         print_time = self.printer.lookup_object('toolhead').get_last_move_time()
         self.raw_samples = []
+        self.stream = stream
+        self.sample_count = self.last_count = self.discarded = 0
         self.last_sequence = 0
         self.samples_start1 = self.samples_start2 = print_time
         # Start bulk reading
@@ -212,35 +250,44 @@ class ADXL345:
         self.query_rate = 0
         raw_samples = self.raw_samples
         self.raw_samples = []
+        self.stream = None
+        if self.discarded:
+            logging.warning("ADXL345 discarded %d messages (over %d stored)",
+                            self.discarded, MAX_STORED_MESSAGES)
         # Generate results
         end1_time = self._clock_to_print_time(params['end1_time'])
         end2_time = self._clock_to_print_time(params['end2_time'])
         end_sequence = self._convert_sequence(params['sequence'])
         overflows = params['limit_count']
         res = ADXL345Results()
-        res.setup_data(self.axes_map, raw_samples, end_sequence, overflows,
+        res.setup_data(self.axes_map, raw_samples, self.sample_count,
+                       self.last_count, end_sequence, overflows,
                        self.samples_start1, self.samples_start2,
                        end1_time, end2_time)
         logging.info("ADXL345 finished %d measurements: %s",
                      res.total_count, res.get_stats())
         return res
-    def end_query(self, name):
+    def end_query(self, name, binary=False):
         if not self.query_rate:
             return
         res = self.finish_measurements()
         # Write data to file
+        ext = ".bin" if binary else ".csv"
         if self.name == "default":
-            filename = "/tmp/adxl345-%s.csv" % (name,)
+            filename = "/tmp/adxl345-%s%s" % (name, ext)
         else:
-            filename = "/tmp/adxl345-%s-%s.csv" % (self.name, name,)
-        res.write_to_file(filename)
+            filename = "/tmp/adxl345-%s-%s%s" % (self.name, name, ext)
+        res.write_to_file(filename, binary)
     cmd_ACCELEROMETER_MEASURE_help = "Start/stop accelerometer"
     def cmd_ACCELEROMETER_MEASURE(self, gcmd):
         if self.query_rate:
             name = gcmd.get("NAME", time.strftime("%Y%m%d_%H%M%S"))
             if not name.replace('-', '').replace('_', '').isalnum():
                 raise gcmd.error("Invalid adxl345 NAME parameter")
-            self.end_query(name)
+            fmt = gcmd.get("FORMAT", "csv").lower()
+            if fmt not in ('csv', 'binary'):
+                raise gcmd.error("Invalid adxl345 FORMAT parameter")
+            self.end_query(name, fmt == 'binary')
             gcmd.respond_info("adxl345 measurements stopped")
         else:
             rate = gcmd.get_int("RATE", self.data_rate)
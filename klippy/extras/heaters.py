@@ -126,8 +126,9 @@ class Heater:
             last_temp = self.last_temp
             last_pwm_value = self.last_pwm_value
         is_active = target_temp or last_temp > 50.
-        return is_active, '%s: target=%.0f temp=%.1f pwm=%.3f' % (
-            self.name, target_temp, last_temp, last_pwm_value)
+        return is_active, {self.name: {'target': target_temp,
+                                       'temp': last_temp,
+                                       'pwm': last_pwm_value}}
     def get_status(self, eventtime):
         with self.lock:
             target_temp = self.target_temp
@@ -55,35 +55,60 @@ class InputShaper:
             self.orig_stepper_kinematics.append(orig_sk)
         # Configure initial values
         self.old_delay = 0.
-        self._set_input_shaper(self.shaper_type_x, self.shaper_type_y,
-                               self.shaper_freq_x, self.shaper_freq_y,
-                               self.damping_ratio_x, self.damping_ratio_y)
-    def _set_input_shaper(self, shaper_type_x, shaper_type_y
-                          , shaper_freq_x, shaper_freq_y
-                          , damping_ratio_x, damping_ratio_y):
-        if (shaper_type_x != self.shaper_type_x
-                or shaper_type_y != self.shaper_type_y):
-            self.toolhead.flush_step_generation()
+        self._update_input_shaper(self._get_shaper_params())
+    def _get_shaper_params(self):
+        return (self.shaper_type_x, self.shaper_type_y,
+                self.shaper_freq_x, self.shaper_freq_y,
+                self.damping_ratio_x, self.damping_ratio_y)
+    def _get_step_generation_window(self, params):
+        (shaper_type_x, shaper_type_y, shaper_freq_x, shaper_freq_y,
+         damping_ratio_x, damping_ratio_y) = params
         ffi_main, ffi_lib = chelper.get_ffi()
-        new_delay = max(
+        return max(
                 ffi_lib.input_shaper_get_step_generation_window(
                     shaper_type_x, shaper_freq_x, damping_ratio_x),
                 ffi_lib.input_shaper_get_step_generation_window(
                     shaper_type_y, shaper_freq_y, damping_ratio_y))
+    def _update_input_shaper(self, params):
+        # Apply new parameters immediately (flushes step generation)
+        ffi_main, ffi_lib = chelper.get_ffi()
+        new_delay = self._get_step_generation_window(params)
         self.toolhead.note_step_generation_scan_time(new_delay,
                                                      old_delay=self.old_delay)
         self.old_delay = new_delay
+        for sk in self.stepper_kinematics:
+            ffi_lib.input_shaper_set_shaper_params(sk, *params)
+    def _schedule_input_shaper(self, print_time, params):
+        # Apply new parameters from print_time on (without a flush)
+        ffi_main, ffi_lib = chelper.get_ffi()
+        new_delay = self._get_step_generation_window(params)
+        # All steppers must switch to the new parameters at the same time
+        for sk in self.stepper_kinematics:
+            print_time = max(print_time,
+                             ffi_lib.input_shaper_get_schedule_time(
+                                 sk, print_time, new_delay))
+        end_time = print_time
+        for sk in self.stepper_kinematics:
+            end_time = max(end_time,
+                           ffi_lib.input_shaper_schedule_shaper_params(
+                               sk, print_time, *params))
+        self.toolhead.schedule_step_generation_scan_time(
+            end_time, new_delay, old_delay=self.old_delay)
+        self.old_delay = new_delay
+    def _set_input_shaper(self, shaper_type_x, shaper_type_y
+                          , shaper_freq_x, shaper_freq_y
+                          , damping_ratio_x, damping_ratio_y):
         self.shaper_type_x = shaper_type_x
         self.shaper_type_y = shaper_type_y
         self.shaper_freq_x = shaper_freq_x
         self.shaper_freq_y = shaper_freq_y
         self.damping_ratio_x = damping_ratio_x
         self.damping_ratio_y = damping_ratio_y
-        for sk in self.stepper_kinematics:
-            ffi_lib.input_shaper_set_shaper_params(sk
-                    , shaper_type_x, shaper_type_y
-                    , shaper_freq_x, shaper_freq_y
-                    , damping_ratio_x, damping_ratio_y)
+        # Take effect once the currently queued moves complete
+        params = self._get_shaper_params()
+        self.toolhead.register_lookahead_callback(
+            (lambda print_time: self._schedule_input_shaper(print_time,
+                                                            params)))
     def disable_shaping(self):
         if (self.saved_shaper_freq_x or self.saved_shaper_freq_y) and not (
                 self.shaper_freq_x or self.shaper_freq_y):
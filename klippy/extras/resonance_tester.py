@@ -3,7 +3,7 @@
 # Copyright (C) 2020  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math, os, time
+import glob, logging, math, os, socket, time
 from . import shaper_calibrate
 
 def _parse_probe_points(config):
@@ -15,6 +15,13 @@ def _parse_probe_points(config):
         raise config.error("Unable to parse probe_points in %s" % (
             config.get_name()))
 
+def _parse_chip_names(config, option):
+    names = [name.strip() for name in config.get(option).split(',')]
+    if not all(names):
+        raise config.error("Unable to parse %s in %s" % (
+            option, config.get_name()))
+    return names
+
 class VibrationPulseTest:
     def __init__(self, config):
         printer = config.get_printer()
@@ -76,14 +83,24 @@ class ResonanceTester:
         self.move_speed = config.getfloat('move_speed', 50., above=0.)
         self.test = VibrationPulseTest(config)
         if not config.get('accel_chip_x', None):
-            self.accel_chip_names = [('xy', config.get('accel_chip').strip())]
+            self.accel_chip_names = [
+                ('xy', name) for name in _parse_chip_names(config,
+                                                           'accel_chip')]
         else:
+            x_names = _parse_chip_names(config, 'accel_chip_x')
+            y_names = _parse_chip_names(config, 'accel_chip_y')
             self.accel_chip_names = [
-                ('x', config.get('accel_chip_x').strip()),
-                ('y', config.get('accel_chip_y').strip())]
-            if self.accel_chip_names[0][1] == self.accel_chip_names[1][1]:
-                self.accel_chip_names = [('xy', self.accel_chip_names[0][1])]
+                ('xy' if name in y_names else 'x', name) for name in x_names]
+            self.accel_chip_names.extend([
+                ('y', name) for name in y_names if name not in x_names])
         self.max_smoothing = config.getfloat('max_smoothing', None, minval=0.05)
+        self.dataset_dir = config.get('dataset_dir', None)
+        if self.dataset_dir is not None:
+            self.dataset_dir = os.path.expanduser(self.dataset_dir)
+        self.printer_name = config.get('printer_name', socket.gethostname())
+        if not self.is_valid_name_suffix(self.printer_name):
+            raise config.error("Invalid printer_name in %s" % (
+                config.get_name(),))
 
         self.gcode = self.printer.lookup_object('gcode')
         self.gcode.register_command("MEASURE_AXES_NOISE",
@@ -92,6 +109,8 @@ class ResonanceTester:
                                     self.cmd_TEST_RESONANCES)
         self.gcode.register_command("SHAPER_CALIBRATE",
                                     self.cmd_SHAPER_CALIBRATE)
+        self.gcode.register_command("SHAPER_REFIT",
+                                    self.cmd_SHAPER_REFIT)
         self.printer.register_event_handler("klippy:connect", self.connect)
 
     def connect(self):
@@ -112,16 +131,22 @@ class ResonanceTester:
 
         outputs = gcmd.get("OUTPUT", "resonances").lower().split(',')
         for output in outputs:
-            if output not in ['resonances', 'raw_data']:
-                raise gcmd.error("Unsupported output '%s', only 'resonances'"
-                                 " and 'raw_data' are supported" % (output,))
+            if output not in ['resonances', 'point_resonances', 'raw_data']:
+                raise gcmd.error("Unsupported output '%s', only 'resonances',"
+                                 " 'point_resonances' and 'raw_data' are"
+                                 " supported" % (output,))
         if not outputs:
             raise gcmd.error("No output specified, at least one of 'resonances'"
                              " or 'raw_data' must be set in OUTPUT parameter")
         name_suffix = gcmd.get("NAME", time.strftime("%Y%m%d_%H%M%S"))
         if not self.is_valid_name_suffix(name_suffix):
             raise gcmd.error("Invalid NAME parameter")
-        csv_output = 'resonances' in outputs
+        raw_format = gcmd.get("FORMAT", "csv").lower()
+        if raw_format not in ('csv', 'binary'):
+            raise gcmd.error("Unsupported raw data format '%s', only 'csv'"
+                             " and 'binary' are supported" % (raw_format,))
+        point_output = 'point_resonances' in outputs
+        csv_output = 'resonances' in outputs or point_output
         raw_output = 'raw_data' in outputs
 
         # Setup calculation of resonances
@@ -140,49 +165,72 @@ class ResonanceTester:
         E = currentPos[3]
 
         calibration_points = self.test.get_start_test_points()
-        data = None
-        for point in calibration_points:
-            toolhead.manual_move(point, self.move_speed)
-            if len(calibration_points) > 1:
-                gcmd.respond_info(
-                        "Probing point (%.3f, %.3f, %.3f)" % tuple(point))
-            toolhead.wait_moves()
-            toolhead.dwell(0.500)
-            gcmd.respond_info("Testing axis %s" % axis.upper())
+        # The analysis of each point runs in the background while the
+        # next point is measured
+        pending = []
+        try:
+            for point in calibration_points:
+                toolhead.manual_move(point, self.move_speed)
+                if len(calibration_points) > 1:
+                    gcmd.respond_info(
+                            "Probing point (%.3f, %.3f, %.3f)" % tuple(point))
+                toolhead.wait_moves()
+                toolhead.dwell(0.500)
+                gcmd.respond_info("Testing axis %s" % axis.upper())
 
-            for chip_axis, chip in self.accel_chips:
-                if axis in chip_axis or chip_axis in axis:
-                    chip.start_measurements()
-            # Generate moves
-            self.test.run_test(toolhead, axis, gcmd)
-            raw_values = []
-            for chip_axis, chip in self.accel_chips:
-                if axis in chip_axis or chip_axis in axis:
-                    results = chip.finish_measurements()
+                # Raw data output needs all samples - otherwise the spectrum
+                # is calculated while the measurements are in progress
+                raw_values = self._run_measurements(
+                        axis, helper if csv_output and not raw_output else None,
+                        lambda: self.test.run_test(toolhead, axis, gcmd))
+                for chip_axis, chip, results, stream in raw_values:
                     if raw_output:
+                        binary = raw_format == 'binary'
+                        chip_name = None
+                        if len(raw_values) > 1:
+                            chip_name = chip.name
                         raw_name = self.get_filename(
                                 'raw_data', name_suffix, axis,
-                                point if len(calibration_points) > 1 else None)
-                        results.write_to_file(raw_name)
+                                point if len(calibration_points) > 1 else None,
+                                ".bin" if binary else ".csv", chip_name)
+                        results.write_to_file(raw_name, binary)
                         gcmd.respond_info(
                                 "Writing raw accelerometer data to %s file" % (
                                     raw_name,))
-                    raw_values.append((chip_axis, results))
-            if not csv_output:
-                continue
-            for chip_axis, chip_values in raw_values:
-                gcmd.respond_info("%s-axis accelerometer stats: %s" % (
-                    chip_axis, chip_values.get_stats(),))
-                if not chip_values:
-                    raise gcmd.error(
-                            "%s-axis accelerometer measured no data" % (
-                                chip_axis,))
-                new_data = helper.process_accelerometer_data(chip_values)
+                if not csv_output:
+                    continue
+                for chip_desc, chip_values in self._describe_chips(raw_values):
+                    gcmd.respond_info("%s stats: %s" % (
+                        chip_desc, chip_values.get_stats(),))
+                    if not chip_values:
+                        raise gcmd.error("%s measured no data" % (chip_desc,))
+                pending.append((point, self._start_processing(helper,
+                                                              raw_values)))
+            data = None
+            for point, point_pending in pending:
+                point_data = None
+                for new_data in self._wait_processing(helper, point_pending):
+                    if point_data is None:
+                        point_data = new_data
+                    else:
+                        point_data.add_data(new_data)
+                if point_output:
+                    csv_name = self.save_calibration_data(
+                            'resonances', name_suffix, helper, axis, point_data,
+                            point=point)
+                    gcmd.respond_info(
+                            "Point resonances data written to %s file" % (
+                                csv_name,))
                 if data is None:
-                    data = new_data
+                    data = point_data
                 else:
-                    data.add_data(new_data)
-        if csv_output:
+                    data.add_data(point_data)
+        except:
+            # Do not leave the calculations of the earlier points running
+            for point, point_pending in pending:
+                self._discard_processing(helper, point_pending)
+            raise
+        if 'resonances' in outputs:
             csv_name = self.save_calibration_data('resonances', name_suffix,
                                                   helper, axis, data)
             gcmd.respond_info(
@@ -235,22 +283,17 @@ class ResonanceTester:
                 toolhead.dwell(0.500)
                 gcmd.respond_info("Testing axis %s" % axis.upper())
 
-                for chip_axis, chip in self.accel_chips:
-                    if axis in chip_axis or chip_axis in axis:
-                        chip.start_measurements()
-                # Generate moves
-                self.test.run_test(toolhead, axis, gcmd)
-                raw_values = [(chip_axis, chip.finish_measurements())
-                              for chip_axis, chip in self.accel_chips
-                              if axis in chip_axis or chip_axis in axis]
-                for chip_axis, chip_values in raw_values:
-                    gcmd.respond_info("%s-axis accelerometer stats: %s" % (
-                        chip_axis, chip_values.get_stats(),))
+                raw_values = self._run_measurements(
+                        axis, helper,
+                        lambda: self.test.run_test(toolhead, axis, gcmd))
+                for chip_desc, chip_values in self._describe_chips(
+                        raw_values):
+                    gcmd.respond_info("%s stats: %s" % (
+                        chip_desc, chip_values.get_stats(),))
                     if not chip_values:
-                        raise gcmd.error(
-                                "%s-axis accelerometer measured no data" % (
-                                    chip_axis,))
-                    new_data = helper.process_accelerometer_data(chip_values)
+                        raise gcmd.error("%s measured no data" % (chip_desc,))
+                for new_data in self._process_measurements(helper,
+                                                           raw_values):
                     if calibration_data[axis] is None:
                         calibration_data[axis] = new_data
                     else:
@@ -259,22 +302,18 @@ class ResonanceTester:
         configfile = self.printer.lookup_object('configfile')
 
         for axis in calibrate_axes:
-            gcmd.respond_info(
-                    "Calculating the best input shaper parameters for %s axis"
-                    % (axis,))
             calibration_data[axis].normalize_to_frequencies()
-            best_shaper, all_shapers = helper.find_best_shaper(
-                    calibration_data[axis], max_smoothing, gcmd.respond_info)
-            gcmd.respond_info(
-                    "Recommended shaper_type_%s = %s, shaper_freq_%s = %.1f Hz"
-                    % (axis, best_shaper.name, axis, best_shaper.freq))
-            helper.save_params(configfile, axis,
-                               best_shaper.name, best_shaper.freq)
+            best_shaper, all_shapers = self._fit_shapers(
+                    gcmd, helper, configfile, axis, calibration_data[axis],
+                    max_smoothing)
             csv_name = self.save_calibration_data(
                     'calibration_data', name_suffix, helper, axis,
                     calibration_data[axis], all_shapers)
             gcmd.respond_info(
                     "Shaper calibration data written to %s file" % (csv_name,))
+            self._save_dataset(gcmd, helper, axis, name_suffix,
+                               calibration_data[axis], best_shaper,
+                               all_shapers, max_smoothing)
 
         gcmd.respond_info(
             "The SAVE_CONFIG command will update the printer config file\n"
@@ -283,38 +322,252 @@ class ResonanceTester:
             input_shaper.enable_shaping()
             gcmd.respond_info("Re-enabled [input_shaper] after calibration")
 
+    def cmd_SHAPER_REFIT(self, gcmd):
+        if self.dataset_dir is None:
+            raise gcmd.error("SHAPER_REFIT requires dataset_dir to be set"
+                             " in [resonance_tester]")
+        axis = gcmd.get("AXIS", None)
+        if not axis:
+            calibrate_axes = self.test.get_supported_axes()
+        elif axis.lower() not in self.test.get_supported_axes():
+            raise gcmd.error("Unsupported axis '%s'" % (axis,))
+        else:
+            calibrate_axes = [axis.lower()]
+        source = gcmd.get("SOURCE", None)
+        if source is not None and not self.is_valid_name_suffix(source):
+            raise gcmd.error("Invalid SOURCE parameter")
+        max_smoothing = gcmd.get_float(
+                "MAX_SMOOTHING", self.max_smoothing, minval=0.05)
+        name_suffix = gcmd.get("NAME", time.strftime("%Y%m%d_%H%M%S"))
+        if not self.is_valid_name_suffix(name_suffix):
+            raise gcmd.error("Invalid NAME parameter")
+
+        helper = shaper_calibrate.ShaperCalibrate(self.printer)
+        configfile = self.printer.lookup_object('configfile')
+        # Load all the datasets first to report any errors early
+        datasets = []
+        for axis in calibrate_axes:
+            if source is not None:
+                filename = self.get_dataset_filename(axis, source)
+            else:
+                filename = self.find_latest_dataset(axis)
+            if filename is None or not os.path.exists(filename):
+                raise gcmd.error("No stored calibration dataset for %s axis"
+                                 % (axis,))
+            datasets.append((axis, filename) + helper.load_dataset(filename))
+        for axis, filename, header, calibration_data, shapers in datasets:
+            gcmd.respond_info("Re-fitting input shapers for %s axis from %s"
+                              " (previously %s)" % (
+                                  axis, filename, header['selected']))
+            best_shaper, all_shapers = self._fit_shapers(
+                    gcmd, helper, configfile, axis, calibration_data,
+                    max_smoothing)
+            self._save_dataset(gcmd, helper, axis, name_suffix,
+                               calibration_data, best_shaper, all_shapers,
+                               max_smoothing, source=header['name'])
+        gcmd.respond_info(
+            "The SAVE_CONFIG command will update the printer config file\n"
+            "with these parameters and restart the printer.")
+
+    def _fit_shapers(self, gcmd, helper, configfile, axis, calibration_data,
+                     max_smoothing):
+        gcmd.respond_info(
+                "Calculating the best input shaper parameters for %s axis"
+                % (axis,))
+        best_shaper, all_shapers = helper.find_best_shaper(
+                calibration_data, max_smoothing, gcmd.respond_info)
+        gcmd.respond_info(
+                "Recommended shaper_type_%s = %s, shaper_freq_%s = %.1f Hz"
+                % (axis, best_shaper.name, axis, best_shaper.freq))
+        helper.save_params(configfile, axis,
+                           best_shaper.name, best_shaper.freq)
+        return best_shaper, all_shapers
+
+    def get_dataset_filename(self, axis, name_suffix):
+        return os.path.join(self.dataset_dir, "calibration_%s_%s_%s.npz" % (
+            self.printer_name, axis, name_suffix))
+
+    def find_latest_dataset(self, axis):
+        filenames = glob.glob(self.get_dataset_filename(axis, '*'))
+        if not filenames:
+            return None
+        return max(filenames, key=os.path.getmtime)
+
+    def _save_dataset(self, gcmd, helper, axis, name_suffix, calibration_data,
+                      best_shaper, all_shapers, max_smoothing, source=None):
+        if self.dataset_dir is None:
+            return
+        header = {'printer': self.printer_name, 'axis': axis,
+                  'name': name_suffix, 'time': time.time(),
+                  'max_smoothing': max_smoothing,
+                  'selected': best_shaper.name, 'source': source}
+        filename = self.get_dataset_filename(axis, name_suffix)
+        helper.save_dataset(filename, header, calibration_data, all_shapers)
+        gcmd.respond_info("Calibration dataset written to %s file" % (
+            filename,))
+
     def cmd_MEASURE_AXES_NOISE(self, gcmd):
         meas_time = gcmd.get_float("MEAS_TIME", 2.)
-        for _, chip in self.accel_chips:
-            chip.start_measurements()
-        self.printer.lookup_object('toolhead').dwell(meas_time)
-        raw_values = [(axis, chip.finish_measurements())
-                      for axis, chip in self.accel_chips]
         helper = shaper_calibrate.ShaperCalibrate(self.printer)
-        for axis, raw_data in raw_values:
-            data = helper.process_accelerometer_data(raw_data)
+        toolhead = self.printer.lookup_object('toolhead')
+        raw_values = self._run_measurements(
+                None, helper, lambda: toolhead.dwell(meas_time))
+        datas = self._process_measurements(helper, raw_values)
+        for (chip_desc, _), data in zip(self._describe_chips(raw_values),
+                                        datas):
             vx = data.psd_x.mean()
             vy = data.psd_y.mean()
             vz = data.psd_z.mean()
-            gcmd.respond_info("Axes noise for %s-axis accelerometer: "
+            gcmd.respond_info("Axes noise for %s: "
                               "%.6f (x), %.6f (y), %.6f (z)" % (
-                                  axis, vx, vy, vz))
+                                  chip_desc, vx, vy, vz))
+
+    def _run_concurrently(self, funcs):
+        # Run each function in its own reactor greenlet so that the chips
+        # wait for their mcu responses in parallel
+        reactor = self.printer.get_reactor()
+        def make_callback(func):
+            def callback(eventtime):
+                try:
+                    return False, func()
+                except Exception as e:
+                    return True, e
+            return callback
+        completions = [reactor.register_callback(make_callback(func))
+                       for func in funcs]
+        results = [completion.wait() for completion in completions]
+        for is_err, res in results:
+            if is_err:
+                raise res
+        return [res for is_err, res in results]
+
+    def _start_measurements(self, axis, helper=None):
+        # Start all the chips measuring the given axis (all chips if axis
+        # is None) at the same time. Sample times are reported in print
+        # time (via the clock sync of each chip's mcu), so the data of
+        # chips on different mcus is aligned. If a helper is given, each
+        # chip streams its samples into an incremental spectrum
+        # calculation (in a background process per chip).
+        measurements = []
+        try:
+            for chip_axis, chip in self.accel_chips:
+                if axis is not None and not (
+                        axis in chip_axis or chip_axis in axis):
+                    continue
+                stream = None
+                if helper is not None:
+                    stream = helper.start_streaming(chip.axes_map,
+                                                    chip.data_rate)
+                measurements.append((chip_axis, chip, stream))
+            self._run_concurrently([
+                (lambda chip=chip, stream=stream: chip.start_measurements(
+                    stream=stream)) for _, chip, stream in measurements])
+        except:
+            self._abort_measurements(measurements)
+            raise
+        return measurements
+
+    def _finish_measurements(self, measurements):
+        try:
+            results = self._run_concurrently([
+                chip.finish_measurements for _, chip, _ in measurements])
+        except:
+            self._abort_measurements(measurements)
+            raise
+        # Let the stream calculations complete in the background
+        for (_, _, stream), res in zip(measurements, results):
+            if stream is not None:
+                stream.end(res.time_per_sample)
+        return [(chip_axis, chip, res, stream)
+                for (chip_axis, chip, stream), res in zip(measurements,
+                                                          results)]
+
+    def _abort_measurements(self, measurements):
+        # Stop all the chips after an error (some may not have started)
+        for _, chip, stream in measurements:
+            try:
+                chip.finish_measurements()
+            except Exception:
+                logging.exception("Unable to stop accelerometer '%s'",
+                                  chip.name)
+        # Discard the stream calculations (once all the chips are stopped)
+        for _, chip, stream in measurements:
+            if stream is None:
+                continue
+            try:
+                stream.wait()
+            except Exception:
+                logging.exception("Error in accelerometer '%s' stream",
+                                  chip.name)
+
+    def _run_measurements(self, axis, helper, test_func):
+        # Measure the given axis while test_func() generates the moves
+        measurements = self._start_measurements(axis, helper)
+        try:
+            test_func()
+        except:
+            self._abort_measurements(measurements)
+            raise
+        return self._finish_measurements(measurements)
+
+    def _describe_chips(self, raw_values):
+        # Only name the chips if several of them measure the same axis
+        axes = [chip_axis for chip_axis, _, _, _ in raw_values]
+        out = []
+        for chip_axis, chip, results, _ in raw_values:
+            desc = "%s-axis accelerometer" % (chip_axis,)
+            if axes.count(chip_axis) > 1:
+                desc += " '%s'" % (chip.name,)
+            out.append((desc, results))
+        return out
+
+    def _start_processing(self, helper, raw_values):
+        # Calculate the spectrum of each chip's measurements. Streamed
+        # measurements are already processed, the rest are started in
+        # parallel background processes.
+        pending = []
+        for _, _, results, stream in raw_values:
+            if stream is not None:
+                pending.append((helper.finish_streaming(stream, results),
+                                None))
+            else:
+                pending.append((None, helper.process_accelerometer_data_start(
+                    results)))
+        return pending
+
+    def _wait_processing(self, helper, pending):
+        datas = iter(helper.process_accelerometer_data_wait(
+            [handle for data, handle in pending if handle is not None]))
+        return [data if handle is None else next(datas)
+                for data, handle in pending]
+
+    def _discard_processing(self, helper, pending):
+        helper.background_process_discard(
+            [handle for data, handle in pending if handle is not None])
+
+    def _process_measurements(self, helper, raw_values):
+        return self._wait_processing(
+                helper, self._start_processing(helper, raw_values))
 
     def is_valid_name_suffix(self, name_suffix):
         return name_suffix.replace('-', '').replace('_', '').isalnum()
 
-    def get_filename(self, base, name_suffix, axis=None, point=None):
+    def get_filename(self, base, name_suffix, axis=None, point=None,
+                     ext=".csv", chip_name=None):
         name = base
         if axis:
             name += '_' + axis
+        if chip_name:
+            name += '_' + chip_name
         if point:
             name += "_%.3f_%.3f_%.3f" % (point[0], point[1], point[2])
         name += '_' + name_suffix
-        return os.path.join("/tmp", name + ".csv")
+        return os.path.join("/tmp", name + ext)
 
     def save_calibration_data(self, base_name, name_suffix, shaper_calibrate,
-                              axis, calibration_data, all_shapers=None):
-        output = self.get_filename(base_name, name_suffix, axis)
+                              axis, calibration_data, all_shapers=None,
+                              point=None):
+        output = self.get_filename(base_name, name_suffix, axis, point)
         shaper_calibrate.save_calibration_data(output, calibration_data,
                                                all_shapers)
         return output
@@ -3,7 +3,8 @@
 # Copyright (C) 2020  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import collections, importlib, logging, math, multiprocessing
+import collections, importlib, json, logging, math, multiprocessing, os
+import queue, traceback
 
 MIN_FREQ = 5.
 MAX_FREQ = 200.
@@ -14,6 +15,12 @@ SHAPER_VIBRATION_REDUCTION=20.
 TEST_DAMPING_RATIOS=[0.075, 0.1, 0.15]
 SHAPER_DAMPING_RATIO = 0.1
 
+DATASET_VERSION = 1
+
+# Just some empirically chosen value which produces good projections
+# for max_accel without much smoothing
+TARGET_SMOOTHING = 0.12
+
 ######################################################################
 # Input shapers
 ######################################################################
@@ -118,6 +125,23 @@ def get_shaper_smoothing(shaper, accel=5000, scv=5.):
     offset_180 *= inv_D
     return max(offset_90, offset_180)
 
+# Both smoothing offsets above grow linearly with the acceleration, so
+# the maximum acceleration for a given smoothing can be solved directly
+def get_shaper_max_accel(shaper, target_smoothing=TARGET_SMOOTHING, scv=5.):
+    A, T = shaper
+    inv_D = 1. / sum(A)
+    n = len(T)
+    ts = sum([A[i] * T[i] for i in range(n)]) * inv_D
+    dt_90 = sum([A[i] * (T[i]-ts) for i in range(n) if T[i] >= ts])
+    dt2_90 = sum([A[i] * (T[i]-ts)**2 for i in range(n) if T[i] >= ts])
+    dt2_180 = sum([A[i] * (T[i]-ts)**2 for i in range(n)])
+    # offset_90 = sqrt(2) * inv_D * (scv * dt_90 + .5 * accel * dt2_90)
+    accel_90 = 2. * (target_smoothing / (math.sqrt(2.) * inv_D)
+                     - scv * dt_90) / dt2_90
+    # offset_180 = inv_D * .5 * accel * dt2_180
+    accel_180 = 2. * target_smoothing / (inv_D * dt2_180)
+    return max(0., min(accel_90, accel_180))
+
 # min_freq for each shaper is chosen to have projected max_accel ~= 1500
 INPUT_SHAPERS = [
     InputShaperCfg('zv', get_zv_shaper, min_freq=21.),
@@ -165,6 +189,129 @@ class CalibrationData:
         return self._psd_map[axis]
 
 
+def get_window_size(rate):
+    # Round up to the nearest power of 2 for faster FFT
+    return 1 << int(rate * WINDOW_T_SEC - 1).bit_length()
+
+# Welch PSD accumulated over consecutive blocks of samples
+class IncrementalPSD:
+    def __init__(self, numpy, rate, nfft=None):
+        self.numpy = np = numpy
+        # Same window size as ShaperCalibrate.calc_freq_response()
+        self.nfft = nfft = nfft or get_window_size(rate)
+        self.overlap = nfft // 2
+        self.window = np.kaiser(nfft, 6.)
+        self.pending = np.zeros((0, 3))
+        self.psd_sum = np.zeros((nfft // 2 + 1, 3))
+        self.window_count = self.sample_count = 0
+    def add_samples(self, samples):
+        # Process an (N, 3) array of samples; returns the power of each
+        # completed window as an (n_windows, nfft // 2 + 1, 3) array
+        np = self.numpy
+        self.sample_count += samples.shape[0]
+        x = np.concatenate([self.pending, samples])
+        step = self.nfft - self.overlap
+        n_windows = max(0, (x.shape[0] - self.overlap) // step)
+        if not n_windows:
+            self.pending = x
+            return np.zeros((0, self.nfft // 2 + 1, 3))
+        strides = (step * x.strides[0], x.strides[0], x.strides[1])
+        windows = np.lib.stride_tricks.as_strided(
+            x, shape=(n_windows, self.nfft, 3), strides=strides,
+            writeable=False)
+        # Detrend, apply the window, and sum the power of each window
+        w = self.window[None, :, None] * (
+            windows - windows.mean(axis=1)[:, None, :])
+        result = np.fft.rfft(w, n=self.nfft, axis=1)
+        power = result.real**2 + result.imag**2
+        self.psd_sum += power.sum(axis=0)
+        self.window_count += n_windows
+        self.pending = np.array(x[n_windows * step:])
+        return power
+    def get_window_scale(self):
+        return 1. / (self.window**2).sum()
+    def get_calibration_data(self, fs):
+        if not self.window_count or not fs:
+            return None
+        np = self.numpy
+        psd = self.psd_sum * (self.get_window_scale()
+                              / (self.window_count * fs))
+        # Double the one-sided response (except 'DC' and Nyquist terms)
+        psd[1:-1,:] *= 2.
+        freqs = np.fft.rfftfreq(self.nfft, 1. / fs)
+        px, py, pz = psd[:,0], psd[:,1], psd[:,2]
+        return CalibrationData(freqs, px+py+pz, px, py, pz)
+
+# Incremental Welch PSD of accelerometer data as it arrives from the mcu.
+# The calculation runs in a background process (as the calculation of
+# stored measurements does), so it doesn't compete with the host code
+# for the GIL.
+class StreamingPSD:
+    def __init__(self, helper, axes_map, rate):
+        np = helper.numpy
+        self.helper = helper
+        axes_matrix = np.zeros((3, 3))
+        for i, (pos, scale) in enumerate(axes_map):
+            axes_matrix[pos, i] = scale
+        self.queue = multiprocessing.Queue()
+        self.is_ended = False
+        self.handle = helper.background_process_start(
+            self._calc_psd, (np, self.queue, axes_matrix,
+                             get_window_size(rate)))
+    def add_data(self, data):
+        # Called from the serial thread - pass the data to the process
+        if not self.is_ended:
+            self.queue.put_nowait(data[:len(data)//6*6])
+    def end(self, time_per_sample=0.):
+        # Signal the end of the data (a time_per_sample of zero discards
+        # the calculation)
+        if self.is_ended:
+            return
+        self.is_ended = True
+        fs = 1. / time_per_sample if time_per_sample else 0.
+        self.queue.put_nowait(fs)
+        self.queue.close()
+    def wait(self):
+        # Wait for the result of the calculation
+        self.end()
+        calibration_data = self.helper.background_process_wait(
+                [self.handle])[0]
+        if calibration_data is not None:
+            calibration_data.set_numpy(self.helper.numpy)
+        return calibration_data
+    @staticmethod
+    def _calc_psd(np, data_queue, axes_matrix, nfft):
+        # The window size depends on the measured sampling rate, which is
+        # only known at the end - use the size of the configured rate and
+        # keep the raw samples in case the measured rate needs another
+        psd = IncrementalPSD(np, 0., nfft)
+        raw_chunks = []
+        while 1:
+            chunks = [data_queue.get()]
+            # Process all available messages together
+            while not isinstance(chunks[-1], float):
+                try:
+                    chunks.append(data_queue.get_nowait())
+                except queue.Empty:
+                    break
+            fs = None
+            if isinstance(chunks[-1], float):
+                fs = chunks.pop()
+            if chunks:
+                raw_chunks.append(b''.join(chunks))
+                samples = np.frombuffer(raw_chunks[-1], dtype='<i2')
+                psd.add_samples(samples.reshape(-1, 3).dot(axes_matrix))
+            if fs is not None:
+                break
+        if not fs:
+            return None
+        if get_window_size(fs) != nfft:
+            # Recalculate from the stored samples
+            psd = IncrementalPSD(np, fs)
+            samples = np.frombuffer(b''.join(raw_chunks), dtype='<i2')
+            psd.add_samples(samples.reshape(-1, 3).dot(axes_matrix))
+        return psd.get_calibration_data(fs)
+
 CalibrationResult = collections.namedtuple(
         'CalibrationResult',
         ('name', 'freq', 'vals', 'vibrs', 'smoothing', 'score', 'max_accel'))
@@ -182,8 +329,20 @@ class ShaperCalibrate:
                     "docs/Measuring_Resonances.md for more details).")
 
     def background_process_exec(self, method, args):
+        return self.background_process_exec_all([(method, args)])[0]
+
+    def background_process_exec_all(self, calls):
+        # Run each (method, args) call in its own process and wait for
+        # all of them to finish
+        return self.background_process_wait(
+                [self.background_process_start(method, args)
+                 for method, args in calls])
+
+    def background_process_start(self, method, args):
+        # Start a process to perform the calculation; returns a handle
+        # to pass to background_process_wait()
         if self.printer is None:
-            return method(*args)
+            return (None, method(*args))
         import queuelogger
         parent_conn, child_conn = multiprocessing.Pipe()
         def wrapper():
@@ -196,26 +355,54 @@ class ShaperCalibrate:
                 return
             child_conn.send((False, res))
             child_conn.close()
-        # Start a process to perform the calculation
         calc_proc = multiprocessing.Process(target=wrapper)
         calc_proc.daemon = True
         calc_proc.start()
-        # Wait for the process to finish
-        reactor = self.printer.get_reactor()
-        gcode = self.printer.lookup_object("gcode")
-        eventtime = last_report_time = reactor.monotonic()
-        while calc_proc.is_alive():
-            if eventtime > last_report_time + 5.:
-                last_report_time = eventtime
-                gcode.respond_info("Wait for calculations..", log=False)
-            eventtime = reactor.pause(eventtime + .1)
+        child_conn.close()
+        return (calc_proc, parent_conn)
+
+    def background_process_wait(self, handles):
+        procs = [(calc_proc, parent_conn) for calc_proc, parent_conn in handles
+                 if calc_proc is not None]
+        # Wait for the processes to finish (or to send their results,
+        # which may not fit into the pipe buffer)
+        def is_running(calc_proc, parent_conn):
+            return calc_proc.is_alive() and not parent_conn.poll()
+        if any([is_running(*proc) for proc in procs]):
+            reactor = self.printer.get_reactor()
+            gcode = self.printer.lookup_object("gcode")
+            eventtime = last_report_time = reactor.monotonic()
+            while any([is_running(*proc) for proc in procs]):
+                if eventtime > last_report_time + 5.:
+                    last_report_time = eventtime
+                    gcode.respond_info("Wait for calculations..", log=False)
+                eventtime = reactor.pause(eventtime + .1)
         # Return results
-        is_err, res = parent_conn.recv()
-        if is_err:
-            raise self.error("Error in remote calculation: %s" % (res,))
-        calc_proc.join()
-        parent_conn.close()
-        return res
+        results = []
+        for calc_proc, res in handles:
+            if calc_proc is not None:
+                parent_conn = res
+                try:
+                    is_err, res = parent_conn.recv()
+                except EOFError:
+                    is_err, res = True, "process exited without a result"
+                if is_err:
+                    raise self.error("Error in remote calculation: %s" % (
+                        res,))
+                calc_proc.join()
+                parent_conn.close()
+            results.append(res)
+        return results
+
+    def background_process_discard(self, handles):
+        # Stop the processes of calculations whose results are not needed
+        for calc_proc, parent_conn in handles:
+            if calc_proc is None:
+                continue
+            if calc_proc.is_alive():
+                calc_proc.terminate()
+            calc_proc.join()
+            parent_conn.close()
 
     def _split_into_windows(self, x, window_size, overlap):
         # Memory-efficient algorithm to split an input 'x' into a series
@@ -264,13 +451,12 @@ class ShaperCalibrate:
         if isinstance(raw_values, np.ndarray):
             data = raw_values
         else:
-            data = np.array(raw_values.decode_samples())
+            data = raw_values.decode_samples_array(np)
 
         N = data.shape[0]
         T = data[-1,0] - data[0,0]
         SAMPLING_FREQ = N / T
-        # Round up to the nearest power of 2 for faster FFT
-        M = 1 << int(SAMPLING_FREQ * WINDOW_T_SEC - 1).bit_length()
+        M = get_window_size(SAMPLING_FREQ)
         if N <= M:
             return None
 
@@ -281,119 +467,201 @@ class ShaperCalibrate:
         fz, pz = self._psd(data[:,3], SAMPLING_FREQ, M)
         return CalibrationData(fx, px+py+pz, px, py, pz)
 
-    def process_accelerometer_data(self, data):
-        calibration_data = self.background_process_exec(
-                self.calc_freq_response, (data,))
+    def start_streaming(self, axes_map, rate):
+        # The calculation needs a background process (ie, a printer)
+        return StreamingPSD(self, axes_map, rate)
+
+    def finish_streaming(self, stream, results):
+        stream.end(results.time_per_sample)
+        calibration_data = stream.wait()
         if calibration_data is None:
             raise self.error(
-                    "Internal error processing accelerometer data %s" % (data,))
-        calibration_data.set_numpy(self.numpy)
+                    "Internal error processing accelerometer data %s" % (
+                        results.get_stats(),))
         return calibration_data
 
-    def _estimate_shaper(self, shaper, test_damping_ratio, test_freqs):
+    def process_accelerometer_data(self, data):
+        return self.process_accelerometer_data_all([data])[0]
+
+    def process_accelerometer_data_all(self, datas):
+        # Process the data of several accelerometers in parallel
+        return self.process_accelerometer_data_wait(
+                [self.process_accelerometer_data_start(data)
+                 for data in datas])
+
+    def process_accelerometer_data_start(self, data):
+        # Start processing the data in the background; returns a handle
+        # to pass to process_accelerometer_data_wait()
+        return (data, self.background_process_start(
+            self.calc_freq_response, (data,)))
+
+    def process_accelerometer_data_wait(self, pending):
+        datas = [data for data, handle in pending]
+        results = self.background_process_wait(
+                [handle for data, handle in pending])
+        for data, calibration_data in zip(datas, results):
+            if calibration_data is None:
+                raise self.error(
+                        "Internal error processing accelerometer data %s" % (
+                            data,))
+            calibration_data.set_numpy(self.numpy)
+        return results
+
+    def _get_shapers(self, shaper_cfg, test_freqs):
+        # Return the pulse amplitudes and times of the shaper at each of
+        # the test frequencies as (len(test_freqs), pulses) arrays
+        np = self.numpy
+        shapers = [shaper_cfg.init_func(test_freq, SHAPER_DAMPING_RATIO)
+                   for test_freq in test_freqs]
+        return (np.array([A for A, T in shapers]),
+                np.array([T for A, T in shapers]))
+
+    def _estimate_shapers(self, A, T, test_damping_ratio, test_freqs):
         np = self.numpy
 
-        A, T = np.array(shaper[0]), np.array(shaper[1])
-        inv_D = 1. / A.sum()
+        inv_D = 1. / A.sum(axis=-1)
 
         omega = 2. * math.pi * test_freqs
         damping = test_damping_ratio * omega
         omega_d = omega * math.sqrt(1. - test_damping_ratio**2)
-        W = A * np.exp(np.outer(-damping, (T[-1] - T)))
-        S = W * np.sin(np.outer(omega_d, T))
-        C = W * np.cos(np.outer(omega_d, T))
-        return np.sqrt(S.sum(axis=1)**2 + C.sum(axis=1)**2) * inv_D
-
-    def _estimate_remaining_vibrations(self, shaper, test_damping_ratio,
+        # Evaluate all shapers at all frequencies at once, the arrays
+        # have (shapers, test_freqs, pulses) dimensions
+        W = A[:,None,:] * np.exp(-damping[None,:,None]
+                                 * (T[:,-1:] - T)[:,None,:])
+        S = W * np.sin(omega_d[None,:,None] * T[:,None,:])
+        C = W * np.cos(omega_d[None,:,None] * T[:,None,:])
+        return (np.sqrt(S.sum(axis=-1)**2 + C.sum(axis=-1)**2)
+                * inv_D[:,None])
+
+    def _estimate_remaining_vibrations(self, A, T, test_damping_ratio,
                                        freq_bins, psd):
-        vals = self._estimate_shaper(shaper, test_damping_ratio, freq_bins)
+        np = self.numpy
+        vals = self._estimate_shapers(A, T, test_damping_ratio, freq_bins)
         # The input shaper can only reduce the amplitude of vibrations by
         # SHAPER_VIBRATION_REDUCTION times, so all vibrations below that
         # threshold can be igonred
         vibrations_threshold = psd.max() / SHAPER_VIBRATION_REDUCTION
-        remaining_vibrations = self.numpy.maximum(
-                vals * psd - vibrations_threshold, 0).sum()
-        all_vibrations = self.numpy.maximum(psd - vibrations_threshold, 0).sum()
+        remaining_vibrations = np.maximum(
+                vals * psd - vibrations_threshold, 0).sum(axis=-1)
+        all_vibrations = np.maximum(psd - vibrations_threshold, 0).sum()
         return (remaining_vibrations / all_vibrations, vals)
 
+    def _get_smoothing_coeffs(self, A, T):
+        # Coefficients of the smoothing offsets (see get_shaper_max_accel())
+        inv_D = 1. / A.sum(axis=-1)
+        # Calculate input shaper shift
+        ts = (A * T).sum(axis=-1) * inv_D
+        dT = T - ts[..., None]
+        A_90 = A * (dT >= 0.)
+        return (inv_D, (A_90 * dT).sum(axis=-1), (A_90 * dT**2).sum(axis=-1),
+                (A * dT**2).sum(axis=-1))
+
+    def pack_shapers(self, shapers):
+        # Convert a list of (A, T) shapers to (len(shapers), pulses) arrays,
+        # padding the shapers having less pulses with empty ones
+        np = self.numpy
+        n = max([len(T) for A, T in shapers])
+        A = np.zeros((len(shapers), n))
+        T = np.zeros((len(shapers), n))
+        for i, (sA, sT) in enumerate(shapers):
+            A[i,:len(sA)] = sA
+            T[i,:len(sT)] = sT
+            T[i,len(sT):] = sT[-1]
+        return A, T
+
+    def get_shapers_smoothing(self, A, T, accel=5000, scv=5.):
+        # Same as get_shaper_smoothing(), but for arrays of shapers A and
+        # T (see pack_shapers()). 'accel' may be an array of accelerations
+        # that is broadcast with the shapers.
+        np = self.numpy
+        inv_D, dt_90, dt2_90, dt2_180 = self._get_smoothing_coeffs(A, T)
+        half_accel = .5 * np.asarray(accel, dtype=float)
+        offset_90 = (scv * dt_90 + half_accel * dt2_90) * inv_D * math.sqrt(2.)
+        offset_180 = half_accel * dt2_180 * inv_D
+        return np.maximum(offset_90, offset_180)
+
+    def find_shapers_max_accel(self, A, T, target_smoothing=TARGET_SMOOTHING,
+                               scv=5.):
+        # Same as get_shaper_max_accel(), but for arrays of shapers
+        np = self.numpy
+        inv_D, dt_90, dt2_90, dt2_180 = self._get_smoothing_coeffs(A, T)
+        accel_90 = 2. * (target_smoothing / (math.sqrt(2.) * inv_D)
+                         - scv * dt_90) / dt2_90
+        accel_180 = 2. * target_smoothing / (inv_D * dt2_180)
+        return np.maximum(0., np.minimum(accel_90, accel_180))
+
     def fit_shaper(self, shaper_cfg, calibration_data, max_smoothing):
         np = self.numpy
 
-        test_freqs = np.arange(shaper_cfg.min_freq, MAX_SHAPER_FREQ, .2)
+        # Test frequencies are evaluated from the highest one down
+        test_freqs = np.arange(shaper_cfg.min_freq, MAX_SHAPER_FREQ, .2)[::-1]
 
         freq_bins = calibration_data.freq_bins
         psd = calibration_data.psd_sum[freq_bins <= MAX_FREQ]
         freq_bins = freq_bins[freq_bins <= MAX_FREQ]
 
-        best_res = None
-        results = []
-        for test_freq in test_freqs[::-1]:
-            shaper_vibrations = 0.
-            shaper_vals = np.zeros(shape=freq_bins.shape)
-            shaper = shaper_cfg.init_func(test_freq, SHAPER_DAMPING_RATIO)
-            shaper_smoothing = get_shaper_smoothing(shaper)
-            if max_smoothing and shaper_smoothing > max_smoothing and best_res:
-                return best_res
-            # Exact damping ratio of the printer is unknown, pessimizing
-            # remaining vibrations over possible damping values
-            for dr in TEST_DAMPING_RATIOS:
-                vibrations, vals = self._estimate_remaining_vibrations(
-                        shaper, dr, freq_bins, psd)
-                shaper_vals = np.maximum(shaper_vals, vals)
-                if vibrations > shaper_vibrations:
-                    shaper_vibrations = vibrations
-            max_accel = self.find_shaper_max_accel(shaper)
-            # The score trying to minimize vibrations, but also accounting
-            # the growth of smoothing. The formula itself does not have any
-            # special meaning, it simply shows good results on real user data
-            shaper_score = shaper_smoothing * (shaper_vibrations**1.5 +
-                                               shaper_vibrations * .2 + .01)
-            results.append(
-                    CalibrationResult(
-                        name=shaper_cfg.name, freq=test_freq, vals=shaper_vals,
-                        vibrs=shaper_vibrations, smoothing=shaper_smoothing,
-                        score=shaper_score, max_accel=max_accel))
-            if best_res is None or best_res.vibrs > results[-1].vibrs:
-                # The current frequency is better for the shaper.
-                best_res = results[-1]
+        A, T = self._get_shapers(shaper_cfg, test_freqs)
+        shaper_smoothing = self.get_shapers_smoothing(A, T)
+        too_smooth = []
+        if max_smoothing:
+            # Stop at the first (after the highest) frequency with too
+            # much smoothing
+            too_smooth = np.nonzero(shaper_smoothing[1:] > max_smoothing)[0]
+        if len(too_smooth):
+            count = too_smooth[0] + 1
+            test_freqs, A, T = test_freqs[:count], A[:count], T[:count]
+            shaper_smoothing = shaper_smoothing[:count]
+
+        # Exact damping ratio of the printer is unknown, pessimizing
+        # remaining vibrations over possible damping values
+        shaper_vibrations = np.zeros(shape=test_freqs.shape)
+        shaper_vals = np.zeros(shape=(test_freqs.shape[0],
+                                      freq_bins.shape[0]))
+        for dr in TEST_DAMPING_RATIOS:
+            vibrations, vals = self._estimate_remaining_vibrations(
+                    A, T, dr, freq_bins, psd)
+            shaper_vals = np.maximum(shaper_vals, vals)
+            shaper_vibrations = np.maximum(shaper_vibrations, vibrations)
+        max_accel = self.find_shapers_max_accel(A, T)
+        # The score trying to minimize vibrations, but also accounting
+        # the growth of smoothing. The formula itself does not have any
+        # special meaning, it simply shows good results on real user data
+        shaper_score = shaper_smoothing * (shaper_vibrations**1.5 +
+                                           shaper_vibrations * .2 + .01)
+        def get_result(i):
+            return CalibrationResult(
+                    name=shaper_cfg.name, freq=float(test_freqs[i]),
+                    vals=shaper_vals[i], vibrs=float(shaper_vibrations[i]),
+                    smoothing=float(shaper_smoothing[i]),
+                    score=float(shaper_score[i]),
+                    max_accel=float(max_accel[i]))
+        # The frequency with the least vibrations is the best for the shaper
+        best = int(np.argmin(shaper_vibrations))
+        if len(too_smooth):
+            return get_result(best)
         # Try to find an 'optimal' shapper configuration: the one that is not
         # much worse than the 'best' one, but gives much less smoothing
-        selected = best_res
-        for res in results[::-1]:
-            if res.vibrs < best_res.vibrs * 1.1 and res.score < selected.score:
-                selected = res
-        return selected
-
-    def _bisect(self, func):
-        left = right = 1.
-        while not func(left):
-            right = left
-            left *= .5
-        if right == left:
-            while func(right):
-                right *= 2.
-        while right - left > 1e-8:
-            middle = (left + right) * .5
-            if func(middle):
-                left = middle
-            else:
-                right = middle
-        return left
+        selected = best
+        for i in range(len(test_freqs)-1, -1, -1):
+            if (shaper_vibrations[i] < shaper_vibrations[best] * 1.1
+                    and shaper_score[i] < shaper_score[selected]):
+                selected = i
+        return get_result(selected)
 
     def find_shaper_max_accel(self, shaper):
-        # Just some empirically chosen value which produces good projections
-        # for max_accel without much smoothing
-        TARGET_SMOOTHING = 0.12
-        max_accel = self._bisect(lambda test_accel: get_shaper_smoothing(
-            shaper, test_accel) <= TARGET_SMOOTHING)
-        return max_accel
+        return get_shaper_max_accel(shaper)
+
+    def _fit_shapers(self, calibration_data, max_smoothing):
+        return [self.fit_shaper(shaper_cfg, calibration_data, max_smoothing)
+                for shaper_cfg in INPUT_SHAPERS]
 
     def find_best_shaper(self, calibration_data, max_smoothing, logger=None):
         best_shaper = None
         all_shapers = []
-        for shaper_cfg in INPUT_SHAPERS:
-            shaper = self.background_process_exec(self.fit_shaper, (
-                shaper_cfg, calibration_data, max_smoothing))
+        # Fit all shapers in a single background process
+        shapers = self.background_process_exec(self._fit_shapers, (
+            calibration_data, max_smoothing))
+        for shaper in shapers:
             if logger is not None:
                 logger("Fitted shaper '%s' frequency = %.1f Hz "
                        "(vibrations = %.1f%%, smoothing ~= %.3f)" % (
@@ -444,3 +712,55 @@ class ShaperCalibrate:
                     csvfile.write("\n")
         except IOError as e:
             raise self.error("Error writing to file '%s': %s", output, str(e))
+
+    def save_dataset(self, output, header, calibration_data, shapers):
+        # Store the (normalized) frequency response and the fitted shapers
+        # in a compressed numpy archive
+        np = self.numpy
+        header = dict(header)
+        header['version'] = DATASET_VERSION
+        header['data_sets'] = calibration_data.data_sets
+        header['shapers'] = [
+                {'name': s.name, 'freq': s.freq, 'vibrs': s.vibrs,
+                 'smoothing': s.smoothing, 'score': s.score,
+                 'max_accel': s.max_accel} for s in shapers]
+        hdata = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+        shaper_vals = np.array([s.vals for s in shapers])
+        temp_output = output + ".tmp"
+        try:
+            with open(temp_output, "wb") as f:
+                np.savez_compressed(
+                        f, header=hdata,
+                        freq_bins=calibration_data.freq_bins,
+                        psd_sum=calibration_data.psd_sum,
+                        psd_x=calibration_data.psd_x,
+                        psd_y=calibration_data.psd_y,
+                        psd_z=calibration_data.psd_z,
+                        shaper_vals=shaper_vals)
+            os.rename(temp_output, output)
+        except (IOError, OSError) as e:
+            raise self.error("Error writing to file '%s': %s" % (
+                output, str(e)))
+
+    def load_dataset(self, filename):
+        # Returns the header, frequency response, and fitted shapers of a
+        # dataset written by save_dataset()
+        np = self.numpy
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                header = json.loads(data['header'].tobytes().decode())
+                calibration_data = CalibrationData(
+                        data['freq_bins'], data['psd_sum'], data['psd_x'],
+                        data['psd_y'], data['psd_z'])
+                shaper_vals = data['shaper_vals']
+        except (IOError, OSError, KeyError, ValueError) as e:
+            raise self.error("Unable to read dataset '%s': %s" % (
+                filename, str(e)))
+        if header.get('version') != DATASET_VERSION:
+            raise self.error("Unsupported dataset version in '%s'" % (
+                filename,))
+        calibration_data.set_numpy(np)
+        calibration_data.data_sets = header['data_sets']
+        shapers = [CalibrationResult(vals=vals, **s)
+                   for s, vals in zip(header['shapers'], shaper_vals)]
+        return header, calibration_data, shapers
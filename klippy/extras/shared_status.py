@@ -0,0 +1,109 @@
+# Export a status snapshot to a shared memory file for local clients
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import os, mmap, struct, json, logging
+
+# Layout of the shared region: a fixed header followed by a json
+# encoded snapshot.  The 'seq' field implements a seqlock - it is odd
+# while the snapshot is being updated and is incremented again when
+# the update is complete.  See scripts/shmstatus.py for a reader.
+HEADER_MAGIC = b'KSTS'
+HEADER_VERSION = 1
+HEADER_FORMAT = '<4sIIId'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SEQ_OFFSET = 8
+
+class SharedStatus:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        self.filename = os.path.expanduser(
+            config.get('filename', '/dev/shm/klippy_status'))
+        self.size = config.getint('size', 65536, minval=4096)
+        self.refresh_time = config.getfloat('refresh_time', .250, above=0.)
+        self.objects = self._parse_objects(config.get('objects'), config)
+        self.mm = None
+        self.seq = 0
+        self.is_overflow = False
+        self.is_encode_error = False
+        self.update_timer = self.reactor.register_timer(self._update_status)
+        self.printer.register_event_handler("klippy:ready", self._handle_ready)
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self._handle_disconnect)
+    def _parse_objects(self, value, config):
+        objects = []
+        for line in value.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            name, sep, fields = line.partition(':')
+            fields = [f.strip() for f in fields.split(',') if f.strip()]
+            if sep and not fields:
+                raise config.error("Invalid shared_status object '%s'"
+                                   % (line,))
+            objects.append((name.strip(), fields or None))
+        if not objects:
+            raise config.error("No objects specified in shared_status")
+        return objects
+    def _handle_ready(self):
+        try:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, self.size)
+                self.mm = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+        except (OSError, mmap.error):
+            logging.exception("shared_status: Unable to open '%s'",
+                              self.filename)
+            return
+        self.seq = struct.unpack_from('<I', self.mm, SEQ_OFFSET)[0] & ~1
+        self.reactor.update_timer(self.update_timer, self.reactor.NOW)
+    def _handle_disconnect(self):
+        self.reactor.update_timer(self.update_timer, self.reactor.NEVER)
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+    def _build_snapshot(self, eventtime):
+        status = {}
+        for name, fields in self.objects:
+            obj = self.printer.lookup_object(name, None)
+            if obj is None or not hasattr(obj, 'get_status'):
+                continue
+            res = obj.get_status(eventtime)
+            if fields is not None:
+                res = {f: res[f] for f in fields if f in res}
+            status[name] = res
+        return status
+    def _update_status(self, eventtime):
+        status = self._build_snapshot(eventtime)
+        try:
+            data = json.dumps(status, separators=(',', ':')).encode()
+        except (TypeError, ValueError):
+            # Skip this update - a status value can not be json encoded
+            if not self.is_encode_error:
+                logging.exception("shared_status: Unable to encode snapshot")
+                self.is_encode_error = True
+            return eventtime + self.refresh_time
+        self.is_encode_error = False
+        if HEADER_SIZE + len(data) > self.size:
+            if not self.is_overflow:
+                logging.warning("shared_status: Snapshot size %d exceeds"
+                                " region size %d", len(data), self.size)
+                self.is_overflow = True
+            return eventtime + self.refresh_time
+        self.is_overflow = False
+        mm = self.mm
+        self.seq = (self.seq + 1) & 0xffffffff
+        struct.pack_into('<4sII', mm, 0, HEADER_MAGIC, HEADER_VERSION,
+                         self.seq)
+        mm[HEADER_SIZE:HEADER_SIZE+len(data)] = data
+        struct.pack_into('<Id', mm, SEQ_OFFSET + 4, len(data), eventtime)
+        self.seq = (self.seq + 1) & 0xffffffff
+        struct.pack_into('<I', mm, SEQ_OFFSET, self.seq)
+        return eventtime + self.refresh_time
+
+def load_config(config):
+    return SharedStatus(config)
@@ -3,7 +3,8 @@
 # Copyright (C) 2018-2021  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, time, logging
+import os, time, struct, threading, logging
+import util, queuelogger
 
 class PrinterSysStats:
     def __init__(self, config):
@@ -11,6 +12,8 @@ class PrinterSysStats:
         self.last_process_time = self.total_process_time = 0.
         self.last_load_avg = 0.
         self.last_mem_avail = 0
+        self.last_thread_stats = {}
+        self.clock_ticks = float(os.sysconf('SC_CLK_TCK'))
         self.mem_file = None
         try:
             self.mem_file = open("/proc/meminfo", "rb")
@@ -29,25 +32,181 @@ class PrinterSysStats:
         if pdiff > 0.:
             self.total_process_time += pdiff
         self.last_load_avg = os.getloadavg()[0]
-        msg = "sysload=%.2f cputime=%.3f" % (self.last_load_avg,
-                                             self.total_process_time)
+        msg = {'sysload': self.last_load_avg,
+               'cputime': self.total_process_time}
         # Get available system memory
         if self.mem_file is not None:
             try:
                 self.mem_file.seek(0)
-                data = self.mem_file.read()
+                data = self.mem_file.read().decode()
                 for line in data.split('\n'):
                     if line.startswith("MemAvailable:"):
                         self.last_mem_avail = int(line.split()[1])
-                        msg = "%s memavail=%d" % (msg, self.last_mem_avail)
+                        msg['memavail'] = self.last_mem_avail
                         break
             except:
                 pass
+        # Get per-thread cpu usage
+        self.last_thread_stats = self._get_thread_stats()
+        for label, tstats in self.last_thread_stats.items():
+            msg['thread_' + label] = tstats
         return (False, msg)
+    def _get_thread_labels(self):
+        # The reactor runs in the main thread; other threads are labeled
+        # by their Python thread name or (for C threads) their OS name
+        labels = {os.getpid(): 'reactor'}
+        for t in threading.enumerate():
+            native_id = getattr(t, 'native_id', None)
+            if native_id is not None and native_id not in labels:
+                labels[native_id] = t.name
+        return labels
+    def _get_thread_stats(self):
+        try:
+            tids = os.listdir("/proc/self/task")
+        except OSError:
+            return {}
+        labels = self._get_thread_labels()
+        out = {}
+        for tid in tids:
+            try:
+                with open("/proc/self/task/%s/stat" % (tid,), "r") as f:
+                    stat = f.read()
+                with open("/proc/self/task/%s/status" % (tid,), "r") as f:
+                    status = f.read()
+            except IOError:
+                # Thread exited
+                continue
+            comm = stat[stat.find('(')+1:stat.rfind(')')]
+            parts = stat[stat.rfind(')')+2:].split()
+            tstats = {'cpu': (int(parts[11]) + int(parts[12]))
+                      / self.clock_ticks}
+            for line in status.split('\n'):
+                if line.startswith("voluntary_ctxt_switches:"):
+                    tstats['vcsw'] = int(line.split()[1])
+                elif line.startswith("nonvoluntary_ctxt_switches:"):
+                    tstats['ivcsw'] = int(line.split()[1])
+            label = labels.get(int(tid), comm).replace(' ', '_')
+            if label in out:
+                label = "%s_%s" % (label, tid)
+            out[label] = tstats
+        return out
     def get_status(self, eventtime):
         return {'sysload': self.last_load_avg,
                 'cputime': self.total_process_time,
-                'memavail': self.last_mem_avail}
+                'memavail': self.last_mem_avail,
+                'threads': self.last_thread_stats}
+
+# Binary time-series file of the periodic statistics. The file starts
+# with STATS_FILE_MAGIC followed by one or more segments. Each segment
+# has a header (b'S', row count, column count, wall clock offset, then
+# the length prefixed column names) followed by fixed size rows (the
+# eventtime and then one double per column - NaN if the field was not
+# reported). A new segment is started on each session and whenever a
+# new field is reported. The file is rotated at midnight along with
+# the log file. See scripts/graphstats.py for a reader. The file is
+# written from the background logging thread.
+STATS_FILE_MAGIC = b'KLSTATS2'
+STATS_SEGMENT_HEADER = struct.Struct('<cIId')
+STATS_FILE_BACKUPS = 5
+
+class StatsFile:
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = None
+        self.columns = []
+        self.column_index = {}
+        self.row_format = None
+        self.segment_pos = self.segment_rows = 0
+        self.rollover_time = 0.
+        self._open()
+    def _open(self):
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        self.fd = os.fdopen(fd, 'r+b')
+        self.fd.seek(0, os.SEEK_END)
+        if not self.fd.tell():
+            self.fd.write(STATS_FILE_MAGIC)
+        self.columns = []
+        self.column_index = {}
+        self.row_format = None
+        # Rotate at the next local midnight (same schedule as the log)
+        t = time.localtime()
+        self.rollover_time = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1,
+                                          0, 0, 0, 0, 0, -1))
+    def _rollover(self):
+        self.fd.close()
+        suffix = time.strftime(".%Y-%m-%d",
+                               time.localtime(self.rollover_time - 3600.))
+        os.rename(self.filename, self.filename + suffix)
+        dirname, basename = os.path.split(os.path.abspath(self.filename))
+        backups = sorted(
+            [fn for fn in os.listdir(dirname)
+             if fn.startswith(basename + '.')
+             and len(fn) == len(basename) + len(suffix)])
+        for fn in backups[:-STATS_FILE_BACKUPS]:
+            os.remove(os.path.join(dirname, fn))
+        self._open()
+    def _start_segment(self, eventtime, wall_time):
+        self.segment_pos = self.fd.tell()
+        self.segment_rows = 0
+        out = [STATS_SEGMENT_HEADER.pack(b'S', 0, len(self.columns),
+                                         wall_time - eventtime)]
+        for name in self.columns:
+            name = name.encode()
+            out.append(struct.pack('<H', len(name)))
+            out.append(name)
+        self.fd.write(b''.join(out))
+        self.row_format = struct.Struct('<d%dd' % (len(self.columns),))
+    def write(self, eventtime, fields):
+        wall_time = time.time()
+        queuelogger.run_in_bg_thread(
+            lambda: self._write(eventtime, wall_time, fields))
+    def _write(self, eventtime, wall_time, fields):
+        if self.fd is None:
+            return
+        try:
+            self._write_row(eventtime, wall_time, fields)
+        except (IOError, OSError, ValueError) as e:
+            logging.warning("Unable to write stats file %s: %s",
+                            self.filename, e)
+            self._close()
+    def _write_row(self, eventtime, wall_time, fields):
+        if wall_time >= self.rollover_time:
+            self._rollover()
+        new_columns = [n for n in fields if n not in self.column_index]
+        if new_columns or self.row_format is None:
+            # Field list changed - start a new segment
+            for name in sorted(new_columns):
+                self.column_index[name] = len(self.columns)
+                self.columns.append(name)
+            self._start_segment(eventtime, wall_time)
+        row = [float('nan')] * len(self.columns)
+        for name, value in fields.items():
+            row[self.column_index[name]] = value
+        # Update the row count in the segment header (before the row is
+        # written, so readers can bound a truncated segment by file size)
+        self.segment_rows += 1
+        row_pos = self.fd.tell()
+        self.fd.seek(self.segment_pos + 1)
+        self.fd.write(struct.pack('<I', self.segment_rows))
+        self.fd.seek(row_pos)
+        self.fd.write(self.row_format.pack(eventtime, *row))
+        self.fd.flush()
+    def _close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+    def close(self):
+        queuelogger.run_in_bg_thread(self._close)
+
+# Flatten a stats dictionary to "field" and "group:field" names
+def flatten_stats(fields, prefix=""):
+    out = {}
+    for name, value in fields.items():
+        if isinstance(value, dict):
+            out.update(flatten_stats(value, prefix + name + ':'))
+        elif isinstance(value, (int, float)):
+            out[prefix + name] = float(value)
+    return out
 
 class PrinterStats:
     def __init__(self, config):
@@ -55,19 +214,45 @@ class PrinterStats:
         reactor = self.printer.get_reactor()
         self.stats_timer = reactor.register_timer(self.generate_stats)
         self.stats_cb = []
+        self.last_stats = {}
+        self.stats_file = None
+        self.stats_filename = config.get('stats_file', None)
         self.printer.register_event_handler("klippy:ready", self.handle_ready)
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self.handle_disconnect)
     def handle_ready(self):
         self.stats_cb = [o.stats for n, o in self.printer.lookup_objects()
                          if hasattr(o, 'stats')]
         if self.printer.get_start_args().get('debugoutput') is None:
+            if self.stats_filename is not None:
+                try:
+                    self.stats_file = StatsFile(self.stats_filename)
+                except OSError as e:
+                    logging.warning("Unable to open stats file %s: %s",
+                                    self.stats_filename, e)
             reactor = self.printer.get_reactor()
             reactor.update_timer(self.stats_timer, reactor.NOW)
+    def handle_disconnect(self):
+        if self.stats_file is not None:
+            self.stats_file.close()
+            self.stats_file = None
     def generate_stats(self, eventtime):
         stats = [cb(eventtime) for cb in self.stats_cb]
+        last_stats = {}
+        for is_active, fields in stats:
+            if isinstance(fields, dict):
+                last_stats.update(fields)
+        self.last_stats = last_stats
         if max([s[0] for s in stats]):
+            msgs = [s[1] if isinstance(s[1], str) else util.format_stats(s[1])
+                    for s in stats]
             logging.info("Stats %.1f: %s", eventtime,
-                         ' '.join([s[1] for s in stats]))
+                         ' '.join([m for m in msgs if m]))
+            if self.stats_file is not None:
+                self.stats_file.write(eventtime, flatten_stats(last_stats))
         return eventtime + 1.
+    def get_status(self, eventtime):
+        return {'last_stats': self.last_stats}
 
 def load_config(config):
     config.get_printer().add_object('system_stats', PrinterSysStats(config))
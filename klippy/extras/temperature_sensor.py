@@ -30,7 +30,7 @@ class PrinterSensorGeneric:
     def get_temp(self, eventtime):
         return self.last_temp, 0.
     def stats(self, eventtime):
-        return False, '%s: temp=%.1f' % (self.name, self.last_temp)
+        return False, {self.name: {'temp': self.last_temp}}
     def get_status(self, eventtime):
         return {
             'temperature': self.last_temp,
@@ -50,8 +50,8 @@ class VirtualSD:
                          self.file_position, repr(data[readcount:]))
     def stats(self, eventtime):
         if self.work_timer is None:
-            return False, ""
-        return True, "sd_pos=%d" % (self.file_position,)
+            return False, {}
+        return True, {'sd_pos': self.file_position}
     def get_file_list(self, check_subdirs=False):
         if check_subdirs:
             flist = []
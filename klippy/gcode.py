@@ -428,7 +428,7 @@ class GCodeIO:
                 logging.exception("Write g-code response")
                 self.pipe_is_active = False
     def stats(self, eventtime):
-        return False, "gcodein=%d" % (self.bytes_read,)
+        return False, {'gcodein': self.bytes_read}
 
 def add_early_printer_objects(printer):
     printer.add_object('gcode', GCodeDispatch(printer))
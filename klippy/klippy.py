@@ -65,6 +65,8 @@ class Printer:
         return self.start_args
     def get_reactor(self):
         return self.reactor
+    def get_run_result(self):
+        return self.run_result
     def get_state_message(self):
         if self.state_message == message_ready:
             category = "ready"
@@ -129,12 +131,15 @@ class Printer:
         return self.objects[section]
     def _read_config(self):
         self.objects['configfile'] = pconfig = configfile.PrinterConfig(self)
-        config = pconfig.read_main_config()
-        if self.bglogger is not None:
-            pconfig.log_config(config)
-        # Create printer components
-        for m in [pins, mcu]:
-            m.add_printer_objects(config)
+        try:
+            config = pconfig.read_main_config()
+            if self.bglogger is not None:
+                pconfig.log_config(config)
+            # Create printer components
+            for m in [pins, mcu]:
+                m.add_printer_objects(config)
+        finally:
+            mcu.close_warm_sessions()
         for section_config in config.get_prefix_sections(''):
             self.load_object(config, section_config.get_name(), None)
         for m in [toolhead]:
@@ -264,6 +269,10 @@ def main():
                     help="api server unix domain socket filename")
     opts.add_option("-l", "--logfile", dest="logfile",
                     help="write log to file instead of stderr")
+    opts.add_option("--log-rate-limit", dest="lograte", type="int", default=0,
+                    help="limit the info/debug messages logged per minute"
+                    " from each log statement and suppress repeated"
+                    " messages")
     opts.add_option("-v", action="store_true", dest="verbose",
                     help="enable debug messages")
     opts.add_option("-o", "--debugoutput", dest="debugoutput",
@@ -293,6 +302,8 @@ def main():
     if options.logfile:
         start_args['log_file'] = options.logfile
         bglogger = queuelogger.setup_bg_logging(options.logfile, debuglevel)
+        if options.lograte:
+            queuelogger.set_rate_limit(options.lograte)
     else:
         logging.basicConfig(level=debuglevel)
     logging.info("Starting Klippy...")
@@ -457,7 +457,7 @@ class CommandWrapper:
 
 class MCU:
     error = error
-    def __init__(self, config, clocksync):
+    def __init__(self, config, clocksync, warm_session=None):
         self._printer = printer = config.get_printer()
         self._clocksync = clocksync
         self._reactor = printer.get_reactor()
@@ -465,7 +465,11 @@ class MCU:
         if self._name.startswith('mcu '):
             self._name = self._name[4:]
         # Serial port
-        self._serial = serialhdl.SerialReader(self._reactor)
+        self._warm_session = warm_session
+        if warm_session is not None:
+            self._serial = warm_session.serial
+        else:
+            self._serial = serialhdl.SerialReader(self._reactor, self._name)
         self._baud = 0
         self._canbus_iface = None
         canbus_uuid = config.get('canbus_uuid', None)
@@ -479,6 +483,7 @@ class MCU:
             if not (self._serialport.startswith("/dev/rpmsg_")
                     or self._serialport.startswith("/tmp/klipper_host_")):
                 self._baud = config.getint('baud', 250000, minval=2400)
+        self._connection_key = connection_key(config)
         # Restarts
         restart_methods = [None, 'arduino', 'cheetah', 'command', 'rpi_usb']
         self._restart_method = 'command'
@@ -513,11 +518,12 @@ class MCU:
         self._mcu_tick_stddev = 0.
         self._mcu_tick_awake = 0.
         # Register handlers
-        printer.register_event_handler("klippy:connect", self._connect)
-        printer.register_event_handler("klippy:mcu_identify",
-                                       self._mcu_identify)
         printer.register_event_handler("klippy:shutdown", self._shutdown)
-        printer.register_event_handler("klippy:disconnect", self._disconnect)
+        printer.register_event_handler("klippy:disconnect",
+                                       self._handle_disconnect)
+        if warm_session is not None:
+            self._serial.attach(self._reactor)
+            clocksync.attach(self._reactor)
     # Serial callbacks
     def _handle_mcu_stats(self, params):
         count = params['count']
@@ -667,7 +673,23 @@ class MCU:
         logging.info(move_msg)
         log_info = self._log_info() + "\n" + move_msg
         self._printer.set_rollover_info(self._name, log_info, log=False)
-    def _mcu_identify(self):
+    def _reattach_session(self):
+        try:
+            self._clocksync.resume()
+        except serialhdl.error as e:
+            logging.info("Unable to reuse MCU '%s' session (%s)",
+                         self._name, str(e))
+            self._drop_warm_session()
+    def _drop_warm_session(self):
+        # Fall back to a full connect
+        if self._warm_session is not None:
+            self._warm_session = None
+            self._serial.disconnect()
+    def _connect_serial(self):
+        if self._warm_session is not None:
+            logging.info("Reusing MCU '%s' session (warm restart)",
+                         self._name)
+            return
         if self.is_fileoutput():
             self._connect_file()
         else:
@@ -688,9 +710,16 @@ class MCU:
                     self._serial.connect_uart(self._serialport, self._baud, rts)
                 else:
                     self._serial.connect_pipe(self._serialport)
-                self._clocksync.connect(self._serial)
             except serialhdl.error as e:
                 raise error(str(e))
+    def _connect_clock(self):
+        if self.is_fileoutput() or self._warm_session is not None:
+            return
+        try:
+            self._clocksync.connect(self._serial)
+        except serialhdl.error as e:
+            raise error(str(e))
+    def _mcu_identify(self):
         logging.info(self._log_info())
         ppins = self._printer.lookup_object('pins')
         pin_resolver = ppins.get_pin_resolver(self._name)
@@ -751,6 +780,8 @@ class MCU:
         return self._printer
     def get_name(self):
         return self._name
+    def get_handler_times(self):
+        return self._serial.get_handler_times()
     def register_response(self, cb, msg, oid=None):
         self._serial.register_response(cb, msg, oid)
     def alloc_command_queue(self):
@@ -787,6 +818,17 @@ class MCU:
     def _disconnect(self):
         self._serial.disconnect()
         self._steppersync = None
+    def _handle_disconnect(self):
+        # Retain a fully connected session across a plain RESTART
+        if (self._printer.get_run_result() == 'restart'
+            and self._steppersync is not None and not self._is_shutdown
+            and not self._printer.is_shutdown() and not self.is_fileoutput()):
+            self._serial.detach()
+            self._steppersync = None
+            warm_sessions[self._name] = WarmSession(
+                self._serial, self._clocksync, self._connection_key)
+            return
+        self._disconnect()
     def _shutdown(self, force=False):
         if (self._emergency_stop_cmd is None
             or (self._is_shutdown and not force)):
@@ -865,14 +907,13 @@ class MCU:
     def get_status(self, eventtime):
         return dict(self._get_status_info)
     def stats(self, eventtime):
-        load = "mcu_awake=%.03f mcu_task_avg=%.06f mcu_task_stddev=%.06f" % (
-            self._mcu_tick_awake, self._mcu_tick_avg, self._mcu_tick_stddev)
-        stats = ' '.join([load, self._serial.stats(eventtime),
-                          self._clocksync.stats(eventtime)])
-        parts = [s.split('=', 1) for s in stats.split()]
-        last_stats = {k:(float(v) if '.' in v else int(v)) for k, v in parts}
+        last_stats = {'mcu_awake': self._mcu_tick_awake,
+                      'mcu_task_avg': self._mcu_tick_avg,
+                      'mcu_task_stddev': self._mcu_tick_stddev}
+        last_stats.update(self._serial.stats(eventtime))
+        last_stats.update(self._clocksync.stats(eventtime))
         self._get_status_info['last_stats'] = last_stats
-        return False, '%s: %s' % (self._name, stats)
+        return False, {self._name: last_stats}
 
 Common_MCU_errors = {
     ("Timer too close", "No next step"): """
@@ -902,14 +943,138 @@ def error_help(msg):
                 return help_msg
     return ""
 
+
+######################################################################
+# Startup of all micro-controllers
+######################################################################
+
+# Identify and configure independent micro-controllers concurrently
+class MCUStartup:
+    def __init__(self, printer, mcus):
+        self._printer = printer
+        self._reactor = printer.get_reactor()
+        self._mcus = mcus
+        self._timing = {m: [] for m in mcus}
+        printer.register_event_handler("klippy:mcu_identify",
+                                       self._mcu_identify)
+        printer.register_event_handler("klippy:connect", self._connect)
+    def _run_one(self, mcu, phase, method):
+        start_time = self._reactor.monotonic()
+        try:
+            method(mcu)
+        except Exception as e:
+            return e
+        finally:
+            self._timing[mcu].append(
+                (phase, self._reactor.monotonic() - start_time))
+        return None
+    def _run_phase(self, mcus, phase, method):
+        completions = [self._reactor.register_callback(
+            (lambda e, m=m: self._run_one(m, phase, method)))
+                       for m in mcus]
+        # Wait for all the mcus, then report the first error in config
+        # order (regardless of completion order)
+        errors = [completion.wait() for completion in completions]
+        for exc in errors:
+            if exc is not None:
+                raise exc
+    def _mcu_identify(self):
+        # Reattach the sessions retained across a warm restart.  The
+        # secondary clocks are only valid with the retained primary clock.
+        warm_mcus = [m for m in self._mcus if m._warm_session is not None]
+        self._run_phase(warm_mcus[:1], "reattach", MCU._reattach_session)
+        if self._mcus[0]._warm_session is None:
+            for m in warm_mcus[1:]:
+                m._drop_warm_session()
+        warm_mcus = [m for m in warm_mcus[1:] if m._warm_session is not None]
+        self._run_phase(warm_mcus, "reattach", MCU._reattach_session)
+        self._run_phase(self._mcus, "identify", MCU._connect_serial)
+        # Secondary clocks are synchronized to the primary mcu clock
+        self._run_phase(self._mcus[:1], "clocksync", MCU._connect_clock)
+        self._run_phase(self._mcus[1:], "clocksync", MCU._connect_clock)
+        for m in self._mcus:
+            m._mcu_identify()
+    def _connect(self):
+        self._run_phase(self._mcus, "config", MCU._connect)
+        for m in self._mcus:
+            timing = self._timing[m]
+            logging.info("MCU '%s' startup: %s total=%.3fs", m.get_name(),
+                         " ".join(["%s=%.3fs" % t for t in timing]),
+                         sum([t[1] for t in timing]))
+
+
+######################################################################
+# Warm restart
+######################################################################
+
+# Sessions retained across a warm restart (keyed by mcu name)
+warm_sessions = {}
+
+class WarmSession:
+    def __init__(self, serial, clocksync, connection_key):
+        self.serial = serial
+        self.clocksync = clocksync
+        self.connection_key = connection_key
+
+def connection_key(config):
+    return tuple([config.get(o, None, note_valid=False) for o in [
+        'serial', 'baud', 'canbus_uuid', 'canbus_interface',
+        'restart_method']])
+
+def claim_warm_sessions(config):
+    # Sessions are only reusable if the primary mcu clock is retained
+    main_session = warm_sessions.get('mcu')
+    is_warm = (main_session is not None and main_session.connection_key
+               == connection_key(config.getsection('mcu')))
+    claimed = {}
+    for name, session in list(warm_sessions.items()):
+        section = 'mcu' if name == 'mcu' else 'mcu ' + name
+        if (is_warm and config.has_section(section)
+            and session.connection_key == connection_key(
+                config.getsection(section))):
+            claimed[section] = session
+        else:
+            del warm_sessions[name]
+            logging.info("Closing retained MCU '%s' session", name)
+            session.serial.disconnect()
+    return claimed
+
+def close_warm_sessions():
+    # Close any sessions not taken over by an MCU object (eg, on a config
+    # error before or during the creation of the mcu objects)
+    sessions = list(warm_sessions.items())
+    warm_sessions.clear()
+    for name, session in sessions:
+        logging.info("Closing retained MCU '%s' session", name)
+        session.serial.disconnect()
+
 def add_printer_objects(config):
     printer = config.get_printer()
     reactor = printer.get_reactor()
-    mainsync = clocksync.ClockSync(reactor)
-    printer.add_object('mcu', MCU(config.getsection('mcu'), mainsync))
+    sessions = claim_warm_sessions(config)
+    session = sessions.get('mcu')
+    if session is not None:
+        mainsync = session.clocksync
+    else:
+        mainsync = clocksync.ClockSync(reactor)
+    mcus = [MCU(config.getsection('mcu'), mainsync, session)]
+    warm_sessions.pop('mcu', None)
+    printer.add_object('mcu', mcus[0])
     for s in config.get_prefix_sections('mcu '):
-        printer.add_object(s.section, MCU(
-            s, clocksync.SecondarySync(reactor, mainsync)))
+        session = sessions.get(s.section)
+        if session is not None:
+            sync = session.clocksync
+        else:
+            sync = clocksync.SecondarySync(reactor, mainsync)
+        m = MCU(s, sync, session)
+        warm_sessions.pop(m.get_name(), None)
+        printer.add_object(s.section, m)
+        mcus.append(m)
+    MCUStartup(printer, mcus)
+    webhooks = printer.lookup_object('webhooks')
+    webhooks.register_endpoint("mcu/handler_times", (
+        lambda web_request: web_request.send(
+            {m.get_name(): m.get_handler_times() for m in mcus})))
 
 def get_printer_mcu(printer, name):
     if name == 'mcu':
@@ -21,19 +21,24 @@ MESSAGE_TRAILER_SYNC = 1
 MESSAGE_PAYLOAD_MAX = MESSAGE_MAX - MESSAGE_MIN
 MESSAGE_SEQ_MASK = 0x0f
 MESSAGE_DEST = 0x10
-MESSAGE_SYNC = '\x7E'
+MESSAGE_SYNC = 0x7E
 
 class error(Exception):
     pass
 
+def _crc16_table():
+    table = []
+    for data in range(256):
+        data ^= (data & 0x0f) << 4
+        table.append((data << 8) ^ (data >> 4) ^ (data << 3))
+    return table
+CRC16_TABLE = _crc16_table()
+
 def crc16_ccitt(buf):
     crc = 0xffff
+    table = CRC16_TABLE
     for data in buf:
-        data = ord(data)
-        data ^= crc & 0xff
-        data ^= (data & 0x0f) << 4
-        crc = ((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)
-    crc = chr(crc >> 8) + chr(crc & 0xff)
+        crc = (crc >> 8) ^ table[(crc ^ data) & 0xff]
     return crc
 
 class PT_uint32:
@@ -50,6 +55,8 @@ class PT_uint32:
     def parse(self, s, pos):
         c = s[pos]
         pos += 1
+        if c < 0x60:
+            return c, pos
         v = c & 0x7f
         if (c & 0x60) == 0x60:
             v |= -0x20
@@ -147,6 +154,98 @@ def lookup_output_params(msgformat):
         args = args[pos+1:]
     return param_types
 
+# Generate specialized python code to encode and decode a message.
+# This avoids a per-parameter method call (and per-byte loop) during
+# the high frequency parsing of messages from the micro-controller.
+def _gen_encode(param_names, get_param, env):
+    lines = []
+    for i, (name, t) in enumerate(param_names):
+        lines.append("    v = %s" % (get_param(i, name),))
+        if isinstance(t, Enumeration):
+            env['enum%d' % (i,)] = t.enums
+            env['enum_name%d' % (i,)] = t.enum_name
+            lines += [
+                "    tv = enum%d.get(v)" % (i,),
+                "    if tv is None:",
+                "        raise error(\"Unknown value '%%s' in enumeration"
+                " '%%s'\" %% (v, enum_name%d))" % (i,),
+                "    v = tv"]
+            t = t.pt
+        if t.is_dynamic_string:
+            lines += ["    out.append(len(v))",
+                      "    out.extend(bytearray(v))"]
+        else:
+            lines += [
+                "    if v >= 0xc000000 or v < -0x4000000:"
+                " out.append((v>>28) & 0x7f | 0x80)",
+                "    if v >= 0x180000 or v < -0x80000:"
+                " out.append((v>>21) & 0x7f | 0x80)",
+                "    if v >= 0x3000 or v < -0x1000:"
+                " out.append((v>>14) & 0x7f | 0x80)",
+                "    if v >= 0x60 or v < -0x20:"
+                " out.append((v>>7) & 0x7f | 0x80)",
+                "    out.append(v & 0x7f)"]
+    return lines
+
+def _gen_parse(param_names, env):
+    lines = ["def parse(s, pos):", "    pos += 1"]
+    for i, (name, t) in enumerate(param_names):
+        var = "v%d" % (i,)
+        enum = None
+        if isinstance(t, Enumeration):
+            enum, t = t, t.pt
+        if t.is_dynamic_string:
+            # Bulk copy of buffer (no-op conversion if s is bytes)
+            lines += [
+                "    l = s[pos]",
+                "    %s = s[pos+1:pos+l+1]" % (var,),
+                "    if type(%s) is not bytes:" % (var,),
+                "        %s = bytes(bytearray(%s))" % (var, var),
+                "    pos += l + 1"]
+        else:
+            lines += [
+                "    c = s[pos]",
+                "    pos += 1",
+                "    if c < 0x60:",
+                "        %s = c" % (var,),
+                "    else:",
+                "        v = c & 0x7f",
+                "        if (c & 0x60) == 0x60:",
+                "            v |= -0x20",
+                "        while c & 0x80:",
+                "            c = s[pos]",
+                "            pos += 1",
+                "            v = (v<<7) | (c & 0x7f)"]
+            if t.signed:
+                lines.append("        %s = v" % (var,))
+            else:
+                lines.append("        %s = v & 0xffffffff" % (var,))
+        if enum is not None:
+            env['rev%d' % (i,)] = enum.reverse_enums
+            lines += [
+                "    tv = rev%d.get(%s)" % (i, var),
+                "    if tv is None:",
+                "        tv = \"?%%d\" %% (%s,)" % (var,),
+                "    %s = tv" % (var,)]
+    items = ["%s: v%d" % (repr(name), i)
+             for i, (name, t) in enumerate(param_names)]
+    lines.append("    return {%s}, pos" % (', '.join(items),))
+    return lines
+
+def compile_message(msgid, param_names):
+    env = {'error': error}
+    lines = _gen_parse(param_names, env)
+    lines += ["def encode(params):", "    out = [%d]" % (msgid,)]
+    lines += _gen_encode(param_names, (lambda i, name: "params[%d]" % (i,)),
+                         env)
+    lines += ["    return out", "def encode_by_name(**params):",
+              "    out = [%d]" % (msgid,)]
+    lines += _gen_encode(param_names,
+                         (lambda i, name: "params[%s]" % (repr(name),)), env)
+    lines += ["    return out", ""]
+    exec(compile('\n'.join(lines), '<msgproto>', 'exec'), env)
+    return env['parse'], env['encode'], env['encode_by_name']
+
 # Update the message format to be compatible with python's % operator
 def convert_msg_format(msgformat):
     for c in ['%u', '%i', '%hu', '%hi', '%c', '%.*s', '%*s']:
@@ -162,25 +261,8 @@ class MessageFormat:
         self.param_names = lookup_params(msgformat, enumerations)
         self.param_types = [t for name, t in self.param_names]
         self.name_to_type = dict(self.param_names)
-    def encode(self, params):
-        out = []
-        out.append(self.msgid)
-        for i, t in enumerate(self.param_types):
-            t.encode(out, params[i])
-        return out
-    def encode_by_name(self, **params):
-        out = []
-        out.append(self.msgid)
-        for name, t in self.param_names:
-            t.encode(out, params[name])
-        return out
-    def parse(self, s, pos):
-        pos += 1
-        out = {}
-        for name, t in self.param_names:
-            v, pos = t.parse(s, pos)
-            out[name] = v
-        return out, pos
+        self.parse, self.encode, self.encode_by_name = compile_message(
+            msgid, self.param_names)
     def format_params(self, params):
         out = []
         for name, t in self.param_names:
@@ -231,26 +313,53 @@ class MessageParser:
         self.version = self.build_versions = ""
         self.raw_identify_data = ""
         self._init_messages(DefaultMessages)
+    def _find_sync(self, s):
+        # Return the (negative) number of bytes to discard to resync
+        pos = bytearray(s[:MESSAGE_MAX]).find(bytearray([MESSAGE_SYNC]))
+        if pos < 0:
+            return -min(len(s), MESSAGE_MAX)
+        return -(pos + 1)
     def check_packet(self, s):
+        # Returns the length of the packet at the start of 's' (which
+        # may be bytes, bytearray, or memoryview), 0 if more data is
+        # needed, or the negative number of bytes to discard on error
         if len(s) < MESSAGE_MIN:
             return 0
-        msglen = ord(s[MESSAGE_POS_LEN])
+        msglen = s[MESSAGE_POS_LEN]
         if msglen < MESSAGE_MIN or msglen > MESSAGE_MAX:
-            return -1
-        msgseq = ord(s[MESSAGE_POS_SEQ])
+            return self._find_sync(s)
+        msgseq = s[MESSAGE_POS_SEQ]
         if (msgseq & ~MESSAGE_SEQ_MASK) != MESSAGE_DEST:
-            return -1
+            return self._find_sync(s)
         if len(s) < msglen:
             # Need more data
             return 0
         if s[msglen-MESSAGE_TRAILER_SYNC] != MESSAGE_SYNC:
-            return -1
-        msgcrc = s[msglen-MESSAGE_TRAILER_CRC:msglen-MESSAGE_TRAILER_CRC+2]
+            return self._find_sync(s)
+        msgcrc = ((s[msglen-MESSAGE_TRAILER_CRC] << 8)
+                  | s[msglen-MESSAGE_TRAILER_CRC+1])
         crc = crc16_ccitt(s[:msglen-MESSAGE_TRAILER_SIZE])
         if crc != msgcrc:
-            #logging.debug("got crc %s vs %s", repr(crc), repr(msgcrc))
-            return -1
+            #logging.debug("got crc %04x vs %04x", crc, msgcrc)
+            return self._find_sync(s)
         return msglen
+    def split_packets(self, data):
+        # Split a buffer holding many packets into memoryview slices.
+        # Returns (packets, consumed_length, discarded_length)
+        mv = memoryview(data)
+        packets = []
+        pos = discarded = 0
+        while 1:
+            l = self.check_packet(mv[pos:])
+            if not l:
+                break
+            if l < 0:
+                pos -= l
+                discarded -= l
+                continue
+            packets.append(mv[pos:pos+l])
+            pos += l
+        return packets, pos, discarded
     def dump(self, s):
         msgseq = s[MESSAGE_POS_SEQ]
         out = ["seq: %02x" % (msgseq,)]
@@ -283,10 +392,11 @@ class MessageParser:
     def encode(self, seq, cmd):
         msglen = MESSAGE_MIN + len(cmd)
         seq = (seq & MESSAGE_SEQ_MASK) | MESSAGE_DEST
-        out = [chr(msglen), chr(seq), cmd]
-        out.append(crc16_ccitt(''.join(out)))
-        out.append(MESSAGE_SYNC)
-        return ''.join(out)
+        out = bytearray([msglen, seq])
+        out.extend(cmd)
+        crc = crc16_ccitt(out)
+        out.extend([crc >> 8, crc & 0xff, MESSAGE_SYNC])
+        return bytes(out)
     def _parse_buffer(self, value):
         if not value:
             return []
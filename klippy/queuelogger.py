@@ -3,39 +3,160 @@
 # Copyright (C) 2016-2019  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, logging.handlers, threading, queue, time
+import logging, logging.handlers, threading, queue, time, re
+
+# Argument types that may be formatted later from the background thread
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, type(None))
+FORMAT_SPEC_RE = re.compile(
+    r'%[-#0 +]*(?:\d+)?(?:\.\d+)?[hlL]?([diouxXeEfFgGcrsa%])')
+
+# Wrapper for a '%r' argument that was converted on the caller's thread
+class ReprSnapshot:
+    def __init__(self, text):
+        self.text = text
+    def __repr__(self):
+        return self.text
+    def __eq__(self, other):
+        return isinstance(other, ReprSnapshot) and self.text == other.text
+    def __hash__(self):
+        return hash(self.text)
+
+# Take a snapshot of the record arguments so that the message can be
+# formatted in the background thread. Returns False if the message
+# must be formatted immediately.
+def snapshot_args(record):
+    args = record.args
+    if not args:
+        return isinstance(record.msg, str)
+    if not isinstance(args, tuple) or not isinstance(record.msg, str):
+        return False
+    if all([isinstance(a, IMMUTABLE_TYPES) for a in args]):
+        return True
+    convs = [c for c in FORMAT_SPEC_RE.findall(record.msg) if c != '%']
+    if len(convs) != len(args) or '%*' in record.msg or '.*' in record.msg:
+        return False
+    out = []
+    for conv, arg in zip(convs, args):
+        if isinstance(arg, IMMUTABLE_TYPES):
+            out.append(arg)
+        elif conv == 's':
+            out.append(str(arg))
+        elif conv == 'r':
+            out.append(ReprSnapshot(repr(arg)))
+        else:
+            return False
+    record.args = tuple(out)
+    return True
 
 # Class to forward all messages through a queue to a background thread
 class QueueHandler(logging.Handler):
     def __init__(self, queue):
         logging.Handler.__init__(self)
         self.queue = queue
+        # Rate limiting and duplicate suppression
+        self.rate_limit = 0
+        self.rate_window = 60.
+        self.window_end = 0.
+        self.site_counts = {}
+        self.last_key = None
+        self.repeat_count = 0
+    def set_rate_limit(self, rate_limit, rate_window=60.):
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+    def _queue_note(self, msg):
+        self.queue.put_nowait(logging.makeLogRecord(
+            {'msg': msg, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+    def _flush_repeats(self):
+        if self.repeat_count:
+            self._queue_note("Last message repeated %d times"
+                             % (self.repeat_count,))
+            self.repeat_count = 0
+    def _flush_sites(self):
+        for (pathname, lineno), count in sorted(self.site_counts.items()):
+            if count > self.rate_limit:
+                self._queue_note("Suppressed %d messages from %s:%d" % (
+                    count - self.rate_limit, pathname, lineno))
+                self.site_counts[pathname, lineno] = self.rate_limit
+    def flush_suppressed(self):
+        # Report the messages suppressed so far (called from the
+        # background thread when it is idle and when logging stops)
+        self.acquire()
+        try:
+            self._flush_repeats()
+            self._flush_sites()
+        finally:
+            self.release()
+    def _is_suppressed(self, record):
+        if record.levelno >= logging.WARNING:
+            # Never hide warnings, errors, or exception tracebacks
+            self._flush_repeats()
+            self.last_key = None
+            return False
+        # Suppress consecutive identical messages
+        key = (record.msg, record.args, record.levelno)
+        if record.exc_info is None and key == self.last_key:
+            self.repeat_count += 1
+            return True
+        self._flush_repeats()
+        self.last_key = key
+        # Limit the number of messages from each logging call site
+        curtime = time.time()
+        if (curtime >= self.window_end
+            or curtime < self.window_end - self.rate_window):
+            self._flush_sites()
+            self.site_counts.clear()
+            self.window_end = curtime + self.rate_window
+        site = (record.pathname, record.lineno)
+        count = self.site_counts.get(site, 0) + 1
+        self.site_counts[site] = count
+        return count > self.rate_limit
     def emit(self, record):
         try:
-            self.format(record)
-            record.msg = record.message
-            record.args = None
-            record.exc_info = None
+            if not snapshot_args(record):
+                # Format now (the message may reference mutable data)
+                record.msg = record.getMessage()
+                record.args = None
+            if self.rate_limit and self._is_suppressed(record):
+                return
             self.queue.put_nowait(record)
         except Exception:
             self.handleError(record)
 
+# Idle time before suppressed message counts are reported
+FLUSH_TIME = 1.
+
 # Class to poll a queue in a background thread and log each message
 class QueueListener(logging.handlers.TimedRotatingFileHandler):
     def __init__(self, filename):
         logging.handlers.TimedRotatingFileHandler.__init__(
             self, filename, when='midnight', backupCount=5)
         self.bg_queue = queue.Queue()
-        self.bg_thread = threading.Thread(target=self._bg_thread)
+        self.bg_thread = threading.Thread(target=self._bg_thread,
+                                          name="logger")
+        self.flush_callback = None
         self.bg_thread.start()
         self.rollover_info = {}
     def _bg_thread(self):
         while 1:
-            record = self.bg_queue.get(True)
+            try:
+                record = self.bg_queue.get(True, FLUSH_TIME)
+            except queue.Empty:
+                if self.flush_callback is not None:
+                    self.flush_callback()
+                continue
             if record is None:
                 break
+            if callable(record):
+                # Work queued with run_in_bg_thread()
+                try:
+                    record()
+                except Exception:
+                    logging.exception("Error in background logging task")
+                continue
             self.handle(record)
     def stop(self):
+        if self.flush_callback is not None:
+            self.flush_callback()
         self.bg_queue.put_nowait(None)
         self.bg_thread.join()
     def set_rollover_info(self, name, info):
@@ -57,10 +178,23 @@ class QueueListener(logging.handlers.TimedRotatingFileHandler):
 
 MainQueueHandler = None
 
+def set_rate_limit(rate_limit, rate_window=60.):
+    if MainQueueHandler is not None:
+        MainQueueHandler.set_rate_limit(rate_limit, rate_window)
+
+# Run a callback (eg, a blocking file write) from the background thread.
+# Callbacks and log messages are processed in the order they are queued.
+def run_in_bg_thread(callback):
+    if MainQueueHandler is None:
+        callback()
+        return
+    MainQueueHandler.queue.put_nowait(callback)
+
 def setup_bg_logging(filename, debuglevel):
     global MainQueueHandler
     ql = QueueListener(filename)
     MainQueueHandler = QueueHandler(ql.bg_queue)
+    ql.flush_callback = MainQueueHandler.flush_suppressed
     root = logging.getLogger()
     root.addHandler(MainQueueHandler)
     root.setLevel(debuglevel)
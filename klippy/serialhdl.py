@@ -11,10 +11,19 @@ import msgproto, chelper, util
 class error(Exception):
     pass
 
+PULL_BATCH_SIZE = 64
+IDENTIFY_CHUNK = 40
+
+# Data dictionaries seen since startup (keyed by first identify chunk)
+identify_cache = {}
+# Parsed data dictionaries (keyed by the full identify data)
+msgparser_cache = {}
+
 class SerialReader:
     BITS_PER_BYTE = 10.
-    def __init__(self, reactor):
+    def __init__(self, reactor, name=""):
         self.reactor = reactor
+        self.name = name
         # Serial port
         self.serial_dev = None
         self.msgparser = msgproto.MessageParser()
@@ -22,7 +31,7 @@ class SerialReader:
         self.ffi_main, self.ffi_lib = chelper.get_ffi()
         self.serialqueue = None
         self.default_cmd_queue = self.alloc_command_queue()
-        self.stats_buf = self.ffi_main.new('char[4096]')
+        self.stats_buf = self.ffi_main.new('struct serialqueue_stats *')
         # Threading
         self.lock = threading.Lock()
         self.background_thread = None
@@ -33,52 +42,109 @@ class SerialReader:
         # Sent message notification tracking
         self.last_notify_id = 0
         self.pending_notifications = {}
+        # Response processing statistics
+        self.pull_batches = self.pull_messages = self.pull_max_batch = 0
+        self.handler_times = {}
     def _bg_thread(self):
-        response = self.ffi_main.new('struct pull_queue_message *')
+        ffi_main, ffi_lib = self.ffi_main, self.ffi_lib
+        responses = ffi_main.new('struct pull_queue_message[%d]'
+                                 % (PULL_BATCH_SIZE,))
+        handler_times = self.handler_times
+        monotonic = ffi_lib.get_monotonic
         while 1:
-            self.ffi_lib.serialqueue_pull(self.serialqueue, response)
-            count = response.len
+            count = ffi_lib.serialqueue_pull_batch(
+                self.serialqueue, responses, PULL_BATCH_SIZE)
             if count < 0:
                 break
-            if response.notify_id:
-                params = {'#sent_time': response.sent_time,
-                          '#receive_time': response.receive_time}
-                completion = self.pending_notifications.pop(response.notify_id)
-                self.reactor.async_complete(completion, params)
-                continue
-            params = self.msgparser.parse(response.msg[0:count])
-            params['#sent_time'] = response.sent_time
-            params['#receive_time'] = response.receive_time
-            hdl = (params['#name'], params.get('oid'))
-            try:
+            self.pull_batches += 1
+            self.pull_messages += count
+            self.pull_max_batch = max(self.pull_max_batch, count)
+            for i in range(count):
+                response = responses[i]
+                # Take the lock per message so that register_response()
+                # is not blocked for a whole batch
                 with self.lock:
-                    hdl = self.handlers.get(hdl, self.handle_default)
-                    hdl(params)
-            except:
-                logging.exception("Exception in serial callback")
-    def _get_identify_data(self, eventtime):
-        # Query the "data dictionary" from the micro-controller
-        identify_data = b""
+                    if response.notify_id:
+                        params = {'#sent_time': response.sent_time,
+                                  '#receive_time': response.receive_time}
+                        completion = self.pending_notifications.pop(
+                            response.notify_id)
+                        self.reactor.async_complete(completion, params)
+                        continue
+                    start_time = monotonic()
+                    try:
+                        params = self.msgparser.parse(
+                            ffi_main.buffer(response.msg, response.len)[:])
+                        params['#sent_time'] = response.sent_time
+                        params['#receive_time'] = response.receive_time
+                        name = params['#name']
+                        hdl = self.handlers.get((name, params.get('oid')),
+                                                self.handle_default)
+                        hdl(params)
+                    except:
+                        logging.exception("Exception in serial callback")
+                        continue
+                    handler_times[name] = (handler_times.get(name, 0.)
+                                           + monotonic() - start_time)
+    def _query_identify(self, offset):
+        msg = "identify offset=%d count=%d" % (offset, IDENTIFY_CHUNK)
         while 1:
-            msg = "identify offset=%d count=%d" % (len(identify_data), 40)
-            try:
-                params = self.send_with_response(msg, 'identify_response')
-            except error as e:
-                logging.exception("Wait for identify_response")
+            params = self.send_with_response(msg, 'identify_response')
+            if params['offset'] == offset:
+                return params['data']
+    def _check_identify_cache(self, first_chunk):
+        # Verify a previously seen dictionary still matches the firmware
+        identify_data = identify_cache.get(first_chunk)
+        if identify_data is None:
+            return None
+        tail_offset = max(len(first_chunk),
+                          len(identify_data) - IDENTIFY_CHUNK)
+        if tail_offset < len(identify_data):
+            # The tail contains the zlib checksum of the dictionary
+            tail = self._query_identify(tail_offset)
+            if tail != identify_data[tail_offset:]:
                 return None
-            if params['offset'] == len(identify_data):
-                msgdata = params['data']
+        if self._query_identify(len(identify_data)):
+            return None
+        return identify_data
+    def _get_identify_data(self, eventtime):
+        # Query the "data dictionary" from the micro-controller
+        try:
+            identify_data = self._query_identify(0)
+            if not identify_data:
+                return identify_data
+            cached_data = self._check_identify_cache(identify_data)
+            if cached_data is not None:
+                logging.info("Using cached data dictionary (%d bytes)",
+                             len(cached_data))
+                return cached_data
+            if identify_data in identify_cache:
+                logging.info("Cached data dictionary mismatch"
+                             " - performing full identify")
+            while 1:
+                msgdata = self._query_identify(len(identify_data))
                 if not msgdata:
                     # Done
-                    return identify_data
+                    break
                 identify_data += msgdata
+        except error as e:
+            logging.exception("Wait for identify_response")
+            return None
+        logging.info("Loaded data dictionary via full identify (%d bytes)",
+                     len(identify_data))
+        identify_cache[identify_data[:IDENTIFY_CHUNK]] = identify_data
+        return identify_data
+    def _thread_name(self, role):
+        return ("%s %s" % (role, self.name)).strip()
     def _start_session(self, serial_dev, serial_fd_type=b'u', client_id=0):
         self.serial_dev = serial_dev
+        sq_name = self._thread_name("serialq").encode()
         self.serialqueue = self.ffi_main.gc(
             self.ffi_lib.serialqueue_alloc(serial_dev.fileno(),
-                                           serial_fd_type, client_id),
+                                           serial_fd_type, client_id, sq_name),
             self.ffi_lib.serialqueue_free)
-        self.background_thread = threading.Thread(target=self._bg_thread)
+        self.background_thread = threading.Thread(
+            target=self._bg_thread, name=self._thread_name("serialhdl"))
         self.background_thread.start()
         # Obtain and load the data dictionary from the firmware
         completion = self.reactor.register_callback(self._get_identify_data)
@@ -87,8 +153,11 @@ class SerialReader:
             logging.info("Timeout on connect")
             self.disconnect()
             return False
-        msgparser = msgproto.MessageParser()
-        msgparser.process_identify(identify_data)
+        msgparser = msgparser_cache.get(identify_data)
+        if msgparser is None:
+            msgparser = msgproto.MessageParser()
+            msgparser.process_identify(identify_data)
+            msgparser_cache[identify_data] = msgparser
         self.msgparser = msgparser
         self.register_response(self.handle_unknown, '#unknown')
         # Setup baud adjust
@@ -188,8 +257,10 @@ class SerialReader:
     def connect_file(self, debugoutput, dictionary, pace=False):
         self.serial_dev = debugoutput
         self.msgparser.process_identify(dictionary, decompress=False)
+        sq_name = self._thread_name("serialq").encode()
         self.serialqueue = self.ffi_main.gc(
-            self.ffi_lib.serialqueue_alloc(self.serial_dev.fileno(), b'f', 0),
+            self.ffi_lib.serialqueue_alloc(self.serial_dev.fileno(), b'f', 0,
+                                           sq_name),
             self.ffi_lib.serialqueue_free)
     def set_clock_est(self, freq, last_time, last_clock):
         self.ffi_lib.serialqueue_set_clock_est(
@@ -206,12 +277,45 @@ class SerialReader:
         for pn in self.pending_notifications.values():
             pn.complete(None)
         self.pending_notifications.clear()
+    def detach(self):
+        # Retain the session for a warm restart - drop all queued
+        # messages and the handlers of the old printer objects
+        self.ffi_lib.serialqueue_discard_pending(self.serialqueue)
+        with self.lock:
+            self.handlers = {}
+            self.handlers['#unknown', None] = self.handle_unknown
+            self.handlers['#output', None] = self.handle_output
+            pending = list(self.pending_notifications.values())
+            self.pending_notifications.clear()
+        for pn in pending:
+            pn.complete(None)
+    def attach(self, reactor):
+        self.reactor = reactor
     def stats(self, eventtime):
         if self.serialqueue is None:
-            return ""
-        self.ffi_lib.serialqueue_get_stats(
-            self.serialqueue, self.stats_buf, len(self.stats_buf))
-        return self.ffi_main.string(self.stats_buf).decode()
+            return {}
+        sstats = self.stats_buf
+        self.ffi_lib.serialqueue_get_stats(self.serialqueue, sstats)
+        out = {'bytes_write': sstats.bytes_write,
+               'bytes_read': sstats.bytes_read,
+               'bytes_retransmit': sstats.bytes_retransmit,
+               'bytes_invalid': sstats.bytes_invalid,
+               'send_seq': sstats.send_seq,
+               'receive_seq': sstats.receive_seq,
+               'retransmit_seq': sstats.retransmit_seq,
+               'srtt': sstats.srtt, 'rttvar': sstats.rttvar,
+               'rto': sstats.rto,
+               'ready_bytes': sstats.ready_bytes,
+               'stalled_bytes': sstats.stalled_bytes,
+               'pull_batches': self.pull_batches,
+               'pull_messages': self.pull_messages,
+               'pull_max_batch': self.pull_max_batch}
+        with self.lock:
+            out['handler_time'] = sum(self.handler_times.values(), 0.)
+        return out
+    def get_handler_times(self):
+        with self.lock:
+            return dict(self.handler_times)
     def get_reactor(self):
         return self.reactor
     def get_msgparser(self):
@@ -254,7 +358,10 @@ class SerialReader:
     def dump_debug(self):
         out = []
         out.append("Dumping serial stats: %s" % (
-            self.stats(self.reactor.monotonic()),))
+            util.format_stats(self.stats(self.reactor.monotonic())),))
+        out.append("Dumping response handler times: %s" % (
+            " ".join(["%s=%.3f" % (name, htime) for name, htime
+                      in sorted(self.get_handler_times().items())]),))
         sdata = self.ffi_main.new('struct pull_queue_message[1024]')
         rdata = self.ffi_main.new('struct pull_queue_message[1024]')
         scount = self.ffi_lib.serialqueue_extract_old(self.serialqueue, 1,
@@ -242,7 +242,9 @@ class ToolHead:
         # Kinematic step generation scan window time tracking
         self.kin_flush_delay = SDS_CHECK_TIME
         self.kin_flush_times = []
+        self.kin_flush_removals = []
         self.last_kin_flush_time = self.last_kin_move_time = 0.
+        self.last_sg_flush_time = 0.
         # Setup iterative solver
         ffi_main, ffi_lib = chelper.get_ffi()
         self.trapq = ffi_main.gc(ffi_lib.trapq_alloc(), ffi_lib.trapq_free)
@@ -284,9 +286,13 @@ class ToolHead:
         lkft = self.last_kin_flush_time
         while 1:
             self.print_time = min(self.print_time + batch_time, next_print_time)
-            sg_flush_time = max(lkft, self.print_time - kin_flush_delay)
+            sg_flush_time = max(lkft, self.last_sg_flush_time,
+                                self.print_time - kin_flush_delay)
+            self.last_sg_flush_time = sg_flush_time
             for sg in self.step_generators:
                 sg(sg_flush_time)
+            if self.kin_flush_removals:
+                kin_flush_delay = self._check_scan_time_removals(sg_flush_time)
             free_time = max(lkft, sg_flush_time - kin_flush_delay)
             self.trapq_free_moves(self.trapq, free_time)
             self.extruder.update_move_time(free_time)
@@ -491,8 +497,9 @@ class ToolHead:
         is_active = buffer_time > -60. or not self.special_queuing_state
         if self.special_queuing_state == "Drip":
             buffer_time = 0.
-        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
-            self.print_time, max(buffer_time, 0.), self.print_stall)
+        return is_active, {'print_time': self.print_time,
+                           'buffer_time': max(buffer_time, 0.),
+                           'print_stall': self.print_stall}
     def check_busy(self, eventtime):
         est_print_time = self.mcu.estimated_print_time(eventtime)
         lookahead_empty = not self.move_queue.queue
@@ -529,6 +536,26 @@ class ToolHead:
             self.kin_flush_times.append(delay)
         new_delay = max(self.kin_flush_times + [SDS_CHECK_TIME])
         self.kin_flush_delay = new_delay
+    def schedule_step_generation_scan_time(self, end_time, delay,
+                                           old_delay=0.):
+        # Change a scan window without flushing - the new window is used
+        # immediately and the old window is retained until steps have
+        # been generated up to end_time
+        if delay:
+            self.kin_flush_times.append(delay)
+        if old_delay:
+            self.kin_flush_removals.append((end_time, old_delay))
+        self.kin_flush_delay = max(self.kin_flush_times + [SDS_CHECK_TIME])
+    def _check_scan_time_removals(self, sg_flush_time):
+        pending = []
+        for end_time, delay in self.kin_flush_removals:
+            if end_time <= sg_flush_time:
+                self.kin_flush_times.remove(delay)
+            else:
+                pending.append((end_time, delay))
+        self.kin_flush_removals = pending
+        self.kin_flush_delay = max(self.kin_flush_times + [SDS_CHECK_TIME])
+        return self.kin_flush_delay
     def register_lookahead_callback(self, callback):
         last_move = self.move_queue.get_last()
         if last_move is None:
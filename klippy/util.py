@@ -90,6 +90,33 @@ def dump_mcu_build():
     dump_file_stats(build_dir, 'out/klipper.elf')
 
 
+######################################################################
+# Statistics formatting
+######################################################################
+
+# Log formats of the stats fields that are not reported as '%.3f'
+STATS_FORMATS = {
+    'sysload': '%.2f', 'target': '%.0f', 'temp': '%.1f',
+    'mcu_task_avg': '%.6f', 'mcu_task_stddev': '%.6f',
+}
+
+def format_stat_value(name, value):
+    fmt = STATS_FORMATS.get(name)
+    if fmt is None:
+        fmt = '%.3f' if isinstance(value, float) else '%s'
+    return fmt % (value,)
+
+# Format the dictionary returned by a stats() method for the log
+def format_stats(fields):
+    out = []
+    for name, value in fields.items():
+        if isinstance(value, dict):
+            out.append('%s: %s' % (name, format_stats(value)))
+        else:
+            out.append('%s=%s' % (name, format_stat_value(name, value)))
+    return ' '.join(out)
+
+
 ######################################################################
 # General system and software information
 ######################################################################
@@ -3,7 +3,7 @@
 # Copyright (C) 2020 Eric Callahan <arksine.code@gmail.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license
-import logging, socket, os, sys, errno, json
+import logging, socket, os, sys, errno, json, collections
 import gcode
 
 # Json decodes strings as unicode types in Python 2.x.  This doesn't
@@ -162,6 +162,9 @@ class ClientConnection:
         self.sock = sock
         self.fd_handle = self.reactor.register_fd(
             self.sock.fileno(), self.process_received)
+        self.pending_requests = collections.deque()
+        self.dispatch_timer = self.reactor.register_timer(
+            self._process_pending)
         self.partial_data = self.send_buffer = b""
         self.is_sending_data = False
         self.set_client_info("?", "New connection")
@@ -183,6 +186,8 @@ class ClientConnection:
         self.set_client_info(None, "Disconnected")
         self.reactor.unregister_fd(self.fd_handle)
         self.fd_handle = None
+        self.reactor.unregister_timer(self.dispatch_timer)
+        self.pending_requests.clear()
         try:
             self.sock.close()
         except socket.error:
@@ -209,6 +214,7 @@ class ClientConnection:
         requests = data.split(b'\x03')
         requests[0] = self.partial_data + requests[0]
         self.partial_data = requests.pop()
+        pending = self.pending_requests
         for req in requests:
             try:
                 web_request = WebRequest(self, req)
@@ -216,10 +222,24 @@ class ClientConnection:
                 logging.exception("webhooks: Error decoding Server Request %s"
                                   % (req))
                 continue
-            self.reactor.register_callback(
-                lambda e, s=self, wr=web_request: s._process_request(wr))
-
-    def _process_request(self, web_request):
+            pending.append((eventtime, web_request))
+        if pending:
+            self.reactor.update_timer(self.dispatch_timer, self.reactor.NOW)
+
+    def _process_pending(self, eventtime):
+        # Dispatch all queued requests from a single timer callback.  If
+        # a request pauses, the timer is rearmed first so the remaining
+        # requests are dispatched (from a new greenlet) without waiting.
+        pending = self.pending_requests
+        while pending:
+            recv_time, web_request = pending.popleft()
+            if pending:
+                self.reactor.update_timer(self.dispatch_timer,
+                                          self.reactor.NOW)
+            self._process_request(web_request, recv_time)
+        return self.reactor.NEVER
+
+    def _process_request(self, web_request, recv_time):
         try:
             func = self.webhooks.get_callback(web_request.get_method())
             func(web_request)
@@ -231,6 +251,8 @@ class ClientConnection:
             logging.exception(msg)
             web_request.set_error(WebRequestError(str(e)))
             self.printer.invoke_shutdown(msg)
+        self.webhooks.note_request_latency(
+            web_request.get_method(), self.reactor.monotonic() - recv_time)
         result = web_request.finish()
         if result is None:
             return
@@ -266,12 +288,37 @@ class ClientConnection:
                 break
         self.is_sending_data = False
 
+# Upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [.001, .002, .005, .010, .020, .050, .100, .200, .500,
+                   1., 2., 5.]
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = self.max_time = 0.
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+    def note_latency(self, latency):
+        self.count += 1
+        self.total_time += latency
+        self.max_time = max(self.max_time, latency)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.histogram[i] += 1
+    def get_stats(self):
+        return {'count': self.count, 'total_time': self.total_time,
+                'max_time': self.max_time, 'histogram': list(self.histogram)}
+
 class WebHooks:
     def __init__(self, printer):
         self.printer = printer
         self._endpoints = {"list_endpoints": self._handle_list_endpoints}
+        self._endpoint_stats = {}
         self._remote_methods = {}
         self.register_endpoint("info", self._handle_info_request)
+        self.register_endpoint("endpoint_stats", self._handle_endpoint_stats)
         self.register_endpoint("emergency_stop", self._handle_estop_request)
         self.register_endpoint("register_remote_method",
                                self._handle_rpc_registration)
@@ -285,6 +332,20 @@ class WebHooks:
     def _handle_list_endpoints(self, web_request):
         web_request.send({'endpoints': list(self._endpoints.keys())})
 
+    def _handle_endpoint_stats(self, web_request):
+        stats = {path: es.get_stats()
+                 for path, es in self._endpoint_stats.items()}
+        web_request.send({'latency_buckets': LATENCY_BUCKETS,
+                          'endpoints': stats})
+
+    def note_request_latency(self, path, latency):
+        if path not in self._endpoints:
+            return
+        es = self._endpoint_stats.get(path)
+        if es is None:
+            es = self._endpoint_stats[path] = EndpointStats()
+        es.note_latency(latency)
+
     def _handle_info_request(self, web_request):
         client_info = web_request.get_dict('client_info', None)
         if client_info is not None:
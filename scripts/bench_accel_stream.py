@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Benchmark graph_accelerometer.py on a large accelerometer capture
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import json, optparse, os, sys, time, struct, subprocess, tempfile, shutil
+import numpy as np
+SCRIPTS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(SCRIPTS_DIR, '..', 'klippy', 'extras'))
+import accel_capture
+
+RATE = 3200.
+SCALE = 3.9
+CHUNK = 1 << 16
+
+# Generate a chunk of synthetic (N, 3) accelerometer samples (mm/s^2)
+def gen_samples(start, count):
+    t = np.arange(start, start + count) / RATE
+    samples = np.random.normal(0., 200., (count, 3))
+    samples[:, 0] += 3000. * np.sin(2. * np.pi * 42.5 * t)
+    samples[:, 1] += 2000. * np.sin(2. * np.pi * 61. * t)
+    samples[:, 2] += 9810.
+    return t, samples
+
+def gen_csv(filename, size):
+    f = open(filename, 'w')
+    f.write("#time,accel_x,accel_y,accel_z\n")
+    pos = 0
+    while f.tell() < size:
+        t, samples = gen_samples(pos, CHUNK)
+        np.savetxt(f, np.column_stack([t, samples]),
+                   fmt="%.6f,%.3f,%.3f,%.3f")
+        pos += CHUNK
+    f.close()
+
+def gen_capture(filename, size):
+    # Write the capture layout directly (write_capture() would need all
+    # the samples in memory)
+    messages = size // (6 * 8 + 5)
+    header = {'axes_map': [[0, SCALE], [1, SCALE], [2, SCALE]],
+              'start_time': 0., 'seq_to_time': 8. / RATE,
+              'time_per_sample': 1. / RATE,
+              'messages': messages, 'samples': messages * 8}
+    hdata = json.dumps(header).encode()
+    hdata += b'\x00' * (-len(hdata) % 8)
+    f = open(filename, 'wb')
+    f.write(accel_capture.CAPTURE_MAGIC + struct.pack('<I', len(hdata))
+            + hdata)
+    for pos in range(0, messages, CHUNK):
+        f.write(np.arange(pos, min(pos + CHUNK, messages),
+                          dtype='<u4').tobytes())
+    for pos in range(0, messages, CHUNK):
+        f.write(b'\x08' * min(CHUNK, messages - pos))
+    f.write(b'\x00' * (-messages % 8))
+    for pos in range(0, messages * 8, CHUNK):
+        t, samples = gen_samples(pos, min(CHUNK, messages * 8 - pos))
+        f.write(np.round(samples / SCALE).astype('<i2').tobytes())
+    f.close()
+
+# Note that the benchmark's own memory usage must stay low, as the
+# reported max rss of a child includes the memory of the forked parent
+def run(desc, args):
+    start_time = time.time()
+    proc = subprocess.Popen(args)
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.time() - start_time
+    if status:
+        sys.stdout.write("%-24s failed\n" % (desc,))
+        return
+    sys.stdout.write("%-24s %9.2f %9.2f %10d\n" % (
+        desc, wall_time, rusage.ru_utime + rusage.ru_stime,
+        rusage.ru_maxrss))
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-s", "--size", type="int", dest="size", default=1024,
+                    help="size of the generated capture (MiB)")
+    opts.add_option("-f", "--format", type="choice", dest="format",
+                    choices=['bin', 'csv'], default='bin',
+                    help="capture format ('bin' or 'csv')")
+    opts.add_option("-n", "--no-batch", action="store_true", dest="nobatch",
+                    help="do not run the (memory hungry) batch mode")
+    opts.add_option("-k", action="store_true", dest="keepfiles",
+                    help="do not remove temporary files")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    tempdir = tempfile.mkdtemp(prefix="bench_accel_")
+    capture = os.path.join(tempdir, "capture." + options.format)
+    size = options.size << 20
+    start_time = time.time()
+    if options.format == 'csv':
+        gen_csv(capture, size)
+    else:
+        gen_capture(capture, size)
+    sys.stdout.write("Generated %d MiB capture in %.1f seconds\n" % (
+        os.path.getsize(capture) >> 20, time.time() - start_time))
+    graph = [sys.executable, os.path.join(SCRIPTS_DIR,
+                                          'graph_accelerometer.py')]
+    output = os.path.join(tempdir, "out.csv")
+    sys.stdout.write("%-24s %9s %9s %10s\n" % (
+        "mode", "wall(s)", "cpu(s)", "rss(KB)"))
+    if not options.nobatch:
+        run("batch", graph + [capture, '-o', output])
+    run("stream", graph + ['--stream', capture, '-o', output])
+    run("stream (2 files)", graph + ['--stream', '-j', '2',
+                                     capture, capture, '-o', output])
+    run("stream specgram", graph + ['--stream', '-s', capture,
+                                    '-o', output])
+    if options.keepfiles:
+        sys.stdout.write("Temporary files are in %s\n" % (tempdir,))
+    else:
+        shutil.rmtree(tempdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Benchmark the host processing of standard g-code workloads
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, json, math, subprocess, tempfile, shutil
+
+KLIPPER_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+CONFIG_DIR = os.path.join(KLIPPER_DIR, 'config')
+
+
+######################################################################
+# G-Code generation
+######################################################################
+
+# Generate the (x, y) points of a dense spiral
+def spiral_points(count, center_x, center_y, max_radius, seg_len=.5):
+    out = []
+    angle = 0.
+    for i in range(count):
+        radius = 5. + (max_radius - 5.) * i / count
+        angle += seg_len / radius
+        out.append((center_x + radius * math.cos(angle),
+                    center_y + radius * math.sin(angle)))
+    return out
+
+def gen_spiral(count, center_x, center_y, max_radius):
+    out = ["G28", "M83", "G1 X%.3f Y%.3f Z1 F6000" % (
+        center_x + 5., center_y)]
+    for x, y in spiral_points(count, center_x, center_y, max_radius):
+        out.append("G1 X%.3f Y%.3f E0.015" % (x, y))
+    return out
+
+def gen_arcs(count, center_x, center_y, max_radius):
+    out = ["G28", "M83", "G1 Z1 F6000"]
+    for i in range(count):
+        radius = 5. + (max_radius - 5.) * (i % 16) / 16.
+        out.append("G1 X%.3f Y%.3f" % (center_x + radius, center_y))
+        out.append("G%d X%.3f Y%.3f I%.3f J0 E0.5" % (
+            2 + (i & 1), center_x - radius, center_y, -radius))
+    return out
+
+def gen_macros(count, center_x, center_y, max_radius):
+    out = ["G28", "M83", "G1 Z1 F6000"]
+    for x, y in spiral_points(count, center_x, center_y, max_radius):
+        out.append("BENCH_MOVE X=%.3f Y=%.3f" % (x, y))
+    return out
+
+MACRO_CONFIG = """
+[gcode_macro BENCH_MOVE]
+variable_moves: 0
+gcode:
+  {% set x = params.X|float %}
+  {% set y = params.Y|float %}
+  {% set e = (x - printer.gcode_move.position.x)|abs * 0.03 %}
+  G1 X{x} Y{y} E{e|round(4)}
+  SET_GCODE_VARIABLE MACRO=BENCH_MOVE VARIABLE=moves VALUE={moves + 1}
+"""
+
+
+######################################################################
+# Workloads
+######################################################################
+
+CARTESIAN = ('example-cartesian.cfg', 100., 100., 80.)
+COREXY = ('example-corexy.cfg', 100., 100., 80.)
+DELTA = ('example-delta.cfg', 0., 0., 50.)
+
+# name: (printer, extra config, gcode generator, moves per count)
+WORKLOADS = {
+    'cartesian_spiral': (CARTESIAN, "", gen_spiral, 1),
+    'corexy_spiral': (COREXY, "", gen_spiral, 1),
+    'delta_spiral': (DELTA, "", gen_spiral, 1),
+    'arcs': (CARTESIAN, "[gcode_arcs]\n", gen_arcs, 2),
+    'macros': (CARTESIAN, MACRO_CONFIG, gen_macros, 1),
+    'input_shaper': (CARTESIAN, "[input_shaper]\nshaper_freq_x: 50\n"
+                     "shaper_freq_y: 45\n", gen_spiral, 1),
+    'pressure_advance': (CARTESIAN, "[extruder]\npressure_advance: 0.05\n",
+                         gen_spiral, 1),
+}
+
+class Workload:
+    def __init__(self, name, count, dictionary, tempdir):
+        self.name = name
+        printer, extra_config, gen_gcode, moves_per_count = WORKLOADS[name]
+        cfg_name, center_x, center_y, max_radius = printer
+        self.moves = count * moves_per_count
+        self.config_fname = os.path.join(tempdir, name + '.cfg')
+        f = open(self.config_fname, 'w')
+        f.write("[include %s]\n[extruder]\nmin_extrude_temp: 0\n%s" % (
+            os.path.join(CONFIG_DIR, cfg_name), extra_config))
+        f.close()
+        self.gcode_fname = os.path.join(tempdir, name + '.gcode')
+        f = open(self.gcode_fname, 'w')
+        gcode = gen_gcode(count, center_x, center_y, max_radius)
+        f.write('\n'.join(gcode + ['']))
+        f.close()
+        self.output_fname = os.path.join(tempdir, name + '.serial')
+        self.log_fname = os.path.join(tempdir, name + '.log')
+        self.dictionary = dictionary
+    def run(self):
+        args = [sys.executable, os.path.join(KLIPPER_DIR, 'klippy/klippy.py'),
+                self.config_fname, '-i', self.gcode_fname,
+                '-o', self.output_fname, '-d', self.dictionary,
+                '-l', self.log_fname]
+        start_time = time.time()
+        proc = subprocess.Popen(args)
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        wall_time = time.time() - start_time
+        proc.returncode = status
+        if status:
+            sys.stderr.write("Workload %s failed - see %s\n" % (
+                self.name, self.log_fname))
+            return None
+        dirname, basename = os.path.split(self.output_fname)
+        output_bytes = sum([os.path.getsize(os.path.join(dirname, fn))
+                            for fn in os.listdir(dirname)
+                            if fn.startswith(basename)])
+        cpu_time = rusage.ru_utime + rusage.ru_stime
+        return {'moves': self.moves, 'cpu_time': cpu_time,
+                'cpu_per_move_us': cpu_time * 1000000. / self.moves,
+                'wall_time': wall_time, 'max_rss_kb': rusage.ru_maxrss,
+                'output_bytes': output_bytes}
+
+
+######################################################################
+# Reporting
+######################################################################
+
+REPORT_FIELDS = [
+    ('cpu_per_move_us', "%10.1f"), ('cpu_time', "%9.2f"),
+    ('wall_time', "%9.2f"), ('max_rss_kb', "%9d"), ('output_bytes', "%10d"),
+]
+
+def report(results, baseline):
+    sys.stdout.write("%-18s %10s %9s %9s %9s %10s\n" % (
+        "workload", "us/move", "cpu(s)", "wall(s)", "rss(KB)", "output"))
+    for name in sorted(results):
+        res = results[name]
+        line = "%-18s" % (name,)
+        for field, fmt in REPORT_FIELDS:
+            line += " " + fmt % (res[field],)
+        sys.stdout.write(line + "\n")
+        base = baseline.get(name)
+        if base is None:
+            continue
+        line = "%-18s" % ("  vs baseline",)
+        for field, fmt in REPORT_FIELDS:
+            if base[field]:
+                change = 100. * (res[field] - base[field]) / base[field]
+                line += " %+*.1f%%" % (len(fmt % (0,)) - 1, change)
+            else:
+                line += " " + " " * len(fmt % (0,))
+        sys.stdout.write(line + "\n")
+
+def get_git_version():
+    try:
+        return subprocess.check_output(
+            ['git', '-C', KLIPPER_DIR, 'describe', '--always', '--tags',
+             '--long', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "?"
+
+def main():
+    usage = "%prog [options] <atmega2560.dict>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--count", type="int", dest="count",
+                    default=5000, help="number of moves per workload")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=1,
+                    help="run each workload N times and report the fastest")
+    opts.add_option("-w", "--workloads", type="string", dest="workloads",
+                    default=None, help="comma separated list of workloads"
+                    " (default is all: %s)" % (", ".join(sorted(WORKLOADS)),))
+    opts.add_option("-o", "--output", type="string", dest="output",
+                    default=None, help="write results to a json file")
+    opts.add_option("-b", "--baseline", type="string", dest="baseline",
+                    default=None, help="compare to a previous json results"
+                    " file")
+    opts.add_option("-k", action="store_true", dest="keepfiles",
+                    help="do not remove temporary files")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    dictionary = os.path.abspath(args[0])
+    names = sorted(WORKLOADS)
+    if options.workloads is not None:
+        names = [n.strip() for n in options.workloads.split(',')]
+        for name in names:
+            if name not in WORKLOADS:
+                opts.error("Unknown workload '%s'" % (name,))
+    baseline = {}
+    if options.baseline is not None:
+        f = open(options.baseline, 'r')
+        baseline = json.load(f)['workloads']
+        f.close()
+    # Run workloads
+    tempdir = tempfile.mkdtemp(prefix="bench_host_")
+    results = {}
+    for name in names:
+        wl = Workload(name, options.count, dictionary, tempdir)
+        for i in range(options.repeat):
+            res = wl.run()
+            if res is None:
+                sys.exit(-1)
+            if name not in results or res['cpu_time'] < results[name][
+                    'cpu_time']:
+                results[name] = res
+    if options.keepfiles:
+        sys.stdout.write("Temporary files are in %s\n" % (tempdir,))
+    else:
+        shutil.rmtree(tempdir)
+    report(results, baseline)
+    if options.output is not None:
+        f = open(options.output, 'w')
+        json.dump({'version': get_git_version(), 'python': sys.version,
+                   'count': options.count, 'workloads': results}, f,
+                  indent=2, sort_keys=True)
+        f.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Benchmark the host message encoding and decoding code
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, json, random
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+
+# High volume responses (along with typical parameter values)
+TEST_RESPONSES = {
+    "adxl345_data oid=%c sequence=%hu data=%*s": 10,
+    "analog_in_state oid=%c next_clock=%u value=%hu": 11,
+    "stepper_position oid=%c pos=%i": 12,
+    "clock clock=%u": 13,
+}
+TEST_COMMANDS = {
+    "queue_step oid=%c interval=%u count=%hu add=%hi": 20,
+}
+
+def gen_params(mp, msgformat):
+    mf = mp.messages_by_name[msgformat.split()[0]]
+    params = []
+    for name, t in mf.param_names:
+        if t.is_dynamic_string:
+            params.append(bytes(bytearray(random.getrandbits(8)
+                                          for i in range(48))))
+        elif name == 'oid':
+            params.append(random.randrange(8))
+        else:
+            params.append(random.randrange(0x7fffffff))
+    return mf, params
+
+# The generic (per-parameter) parser that predates message compilation
+def generic_parse(mf, s, pos):
+    pos += 1
+    out = {}
+    for name, t in mf.param_names:
+        v, pos = t.parse(s, pos)
+        out[name] = v
+    return out, pos
+
+def generic_encode(mf, params):
+    out = [mf.msgid]
+    for i, t in enumerate(mf.param_types):
+        t.encode(out, params[i])
+    return out
+
+# The bit-wise crc16 implementation that predates the table lookup
+def bitwise_crc16(buf):
+    crc = 0xffff
+    for data in buf:
+        data ^= crc & 0xff
+        data ^= (data & 0x0f) << 4
+        crc = ((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)
+    return crc
+
+def run_test(desc, items, count):
+    start_time = time.process_time()
+    for i in range(count):
+        for func, args in items:
+            func(*args)
+    total = time.process_time() - start_time
+    msgs = len(items) * count
+    sys.stdout.write("%-32s %10.0f msgs/sec\n" % (desc, msgs / total))
+    return msgs / total
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--count", type="int", dest="count",
+                    default=20000, help="number of iterations per test")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    random.seed(0)
+    mp = msgproto.MessageParser()
+    mp.process_identify(json.dumps({
+        'commands': TEST_COMMANDS, 'responses': TEST_RESPONSES}),
+                        decompress=False)
+    # Generate test messages
+    parse_items = []
+    encode_items = []
+    for msgformat in list(TEST_RESPONSES) + list(TEST_COMMANDS):
+        mf, params = gen_params(mp, msgformat)
+        encode_items.append((mf, params))
+        data = bytes(bytearray(mf.encode(params)))
+        parse_items.append((mf, data))
+    # Run tests
+    count = options.count
+    old = run_test("generic parse", [(generic_parse, (mf, data, 0))
+                                     for mf, data in parse_items], count)
+    new = run_test("compiled parse", [(mf.parse, (data, 0))
+                                      for mf, data in parse_items], count)
+    sys.stdout.write("%-32s %10.2fx\n" % ("parse speedup", new / old))
+    old = run_test("generic encode", [(generic_encode, (mf, p))
+                                      for mf, p in encode_items], count)
+    new = run_test("compiled encode", [(mf.encode, (p,))
+                                       for mf, p in encode_items], count)
+    sys.stdout.write("%-32s %10.2fx\n" % ("encode speedup", new / old))
+    # Framing tests
+    packets = [mp.encode(i, mf.encode(p)) for i, (mf, p) in enumerate(
+        encode_items)]
+    crc_data = [bytes(p[:-msgproto.MESSAGE_TRAILER_SIZE]) for p in packets]
+    old = run_test("bitwise crc16", [(bitwise_crc16, (d,))
+                                     for d in crc_data], count)
+    new = run_test("table crc16", [(msgproto.crc16_ccitt, (d,))
+                                   for d in crc_data], count)
+    sys.stdout.write("%-32s %10.2fx\n" % ("crc16 speedup", new / old))
+    block = b''.join(packets) * 1000
+    start_time = time.process_time()
+    for i in range(max(1, count // 1000)):
+        res, pos, discarded = mp.split_packets(block)
+        for packet in res:
+            mp.dump(packet)
+    total = time.process_time() - start_time
+    sys.stdout.write("%-32s %10.0f msgs/sec (%.1f MB/sec)\n" % (
+        "split_packets and dump", len(packets) * 1000 * (i + 1) / total,
+        len(block) * (i + 1) / total / 1000000.))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Benchmark the host processing of responses from the micro-controller
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time, json, zlib, threading, tty, logging
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import reactor, serialhdl, msgproto, util
+
+TEST_DICTIONARY = {
+    'commands': {
+        "identify offset=%u count=%c": 1,
+        "bench_flood count=%u": 2,
+    },
+    'responses': {
+        "identify_response offset=%u data=%.*s": 0,
+        "analog_in_state oid=%c next_clock=%u value=%hu": 3,
+    },
+    'config': {'CLOCK_FREQ': 16000000, 'MCU': 'bench'},
+    'version': 'bench', 'build_versions': '',
+}
+
+######################################################################
+# Fake micro-controller
+######################################################################
+
+# Minimal mcu that answers identify requests and floods responses
+class FakeMCU:
+    def __init__(self, fd):
+        self.fd = fd
+        self.identify_data = zlib.compress(
+            json.dumps(TEST_DICTIONARY).encode())
+        self.mp = msgproto.MessageParser()
+        self.mp.process_identify(self.identify_data)
+        self.receive_seq = msgproto.MESSAGE_DEST
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+    def _send(self, cmds):
+        seq = self.receive_seq & msgproto.MESSAGE_SEQ_MASK
+        os.write(self.fd, self.mp.encode(seq, cmds))
+    def _flood(self, count):
+        # Responses are sent one per packet (as the real firmware does)
+        mf = self.mp.messages_by_name['analog_in_state']
+        seq = self.receive_seq & msgproto.MESSAGE_SEQ_MASK
+        out = []
+        for i in range(count):
+            out.append(self.mp.encode(seq, mf.encode(
+                [i & 0xff, i * 1000, i & 0xffff])))
+            if len(out) >= 64:
+                os.write(self.fd, b''.join(out))
+                out = []
+        os.write(self.fd, b''.join(out))
+    def _handle_packet(self, packet):
+        self.receive_seq = (packet[msgproto.MESSAGE_POS_SEQ] + 1) & 0x1f
+        msgs = []
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        while pos < len(packet) - msgproto.MESSAGE_TRAILER_SIZE:
+            mid = self.mp.messages_by_id[packet[pos]]
+            params, pos = mid.parse(packet, pos)
+            msgs.append((mid.name, params))
+        for name, params in msgs:
+            if name == 'identify':
+                offset, count = params['offset'], params['count']
+                data = self.identify_data[offset:offset+count]
+                mf = self.mp.messages_by_name['identify_response']
+                self._send(mf.encode([offset, data]))
+            elif name == 'bench_flood':
+                self._flood(params['count'])
+        # Send ack
+        self._send([])
+    def _run(self):
+        data = b""
+        while 1:
+            try:
+                newdata = os.read(self.fd, 4096)
+            except OSError:
+                break
+            if not newdata:
+                break
+            data += newdata
+            packets, pos, discarded = self.mp.split_packets(data)
+            for packet in packets:
+                self._handle_packet(bytes(packet))
+            data = data[pos:]
+
+######################################################################
+# Host side
+######################################################################
+
+# The response processing loop that predates batched pulling
+class PerMessageSerialReader(serialhdl.SerialReader):
+    def _bg_thread(self):
+        response = self.ffi_main.new('struct pull_queue_message *')
+        while 1:
+            self.ffi_lib.serialqueue_pull(self.serialqueue, response)
+            count = response.len
+            if count < 0:
+                break
+            if response.notify_id:
+                params = {'#sent_time': response.sent_time,
+                          '#receive_time': response.receive_time}
+                completion = self.pending_notifications.pop(response.notify_id)
+                self.reactor.async_complete(completion, params)
+                continue
+            params = self.msgparser.parse(
+                self.ffi_main.buffer(response.msg, count)[:])
+            params['#sent_time'] = response.sent_time
+            params['#receive_time'] = response.receive_time
+            hdl = (params['#name'], params.get('oid'))
+            try:
+                with self.lock:
+                    hdl = self.handlers.get(hdl, self.handle_default)
+                    hdl(params)
+            except:
+                logging.exception("Exception in serial callback")
+
+class BenchRunner:
+    def __init__(self, reader_class, count):
+        self.count = count
+        self.received = 0
+        self.reactor = reactor.Reactor()
+        self.ser = reader_class(self.reactor)
+        self.completion = self.reactor.completion()
+        self.result = None
+    def _handle_analog_in_state(self, params):
+        self.received += 1
+        if self.received == self.count:
+            self.reactor.async_complete(self.completion, time.time())
+    def _run(self, eventtime):
+        master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        FakeMCU(master_fd)
+        self.ser.connect_pipe(os.ttyname(slave_fd))
+        for oid in range(256):
+            self.ser.register_response(self._handle_analog_in_state,
+                                       'analog_in_state', oid)
+        start_time = time.time()
+        start_cpu = time.process_time()
+        self.ser.send("bench_flood count=%d" % (self.count,))
+        end_time = self.completion.wait(self.reactor.monotonic() + 60.)
+        end_cpu = time.process_time()
+        if end_time is None:
+            logging.error("Timeout (received %d of %d)",
+                          self.received, self.count)
+        else:
+            self.result = (end_time - start_time, end_cpu - start_cpu,
+                           self.ser.stats(eventtime))
+        self.ser.disconnect()
+        os.close(slave_fd)
+        os.close(master_fd)
+        self.reactor.end()
+    def run(self):
+        self.reactor.register_callback(self._run)
+        self.reactor.run()
+        self.reactor.finalize()
+        return self.result
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-c", "--count", type="int", dest="count",
+                    default=200000, help="number of messages to flood")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    logging.basicConfig(level=logging.WARNING)
+    count = options.count
+    for desc, reader_class in [("per-message pull", PerMessageSerialReader),
+                               ("batched pull", serialhdl.SerialReader)]:
+        res = BenchRunner(reader_class, count).run()
+        if res is None:
+            sys.exit(-1)
+        wall_time, cpu_time, stats = res
+        sys.stdout.write("%-20s %10.0f msgs/sec (cpu %.3fs)\n" % (
+            desc, count / wall_time, cpu_time))
+        sys.stdout.write("    %s\n" % (util.format_stats(stats),))
+
+if __name__ == '__main__':
+    main()
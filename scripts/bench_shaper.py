@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Benchmark the input shaper smoothing and max_accel calculations
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy', 'extras'))
+import shaper_calibrate
+
+# The bisection search that predates the closed form solution
+def bisect(func):
+    left = right = 1.
+    while not func(left):
+        right = left
+        left *= .5
+    if right == left:
+        while func(right):
+            right *= 2.
+    while right - left > 1e-8:
+        middle = (left + right) * .5
+        if func(middle):
+            left = middle
+        else:
+            right = middle
+    return left
+
+def bisect_max_accel(shaper):
+    return bisect(lambda test_accel: shaper_calibrate.get_shaper_smoothing(
+        shaper, test_accel) <= shaper_calibrate.TARGET_SMOOTHING)
+
+def run_test(desc, func, count):
+    start_time = time.process_time()
+    res = func()
+    total = time.process_time() - start_time
+    sys.stdout.write("%-32s %10.0f shapers/sec\n" % (desc, count / total))
+    return res
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-s", "--step", type="float", dest="step", default=.2,
+                    help="test frequency step (Hz)")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    helper = shaper_calibrate.ShaperCalibrate(None)
+    # Generate the shapers tested by fit_shaper()
+    shapers = []
+    for shaper_cfg in shaper_calibrate.INPUT_SHAPERS:
+        test_freqs = np.arange(shaper_cfg.min_freq,
+                               shaper_calibrate.MAX_SHAPER_FREQ, options.step)
+        shapers.extend([
+            shaper_cfg.init_func(test_freq,
+                                 shaper_calibrate.SHAPER_DAMPING_RATIO)
+            for test_freq in test_freqs])
+    count = len(shapers)
+    A, T = helper.pack_shapers(shapers)
+    # Smoothing
+    ref = run_test("smoothing (per shaper)", lambda: [
+        shaper_calibrate.get_shaper_smoothing(shaper) for shaper in shapers],
+                   count)
+    res = run_test("smoothing (arrays)",
+                   lambda: helper.get_shapers_smoothing(A, T), count)
+    sys.stdout.write("    max difference %.3g\n" % (
+        np.max(np.abs(res - ref)),))
+    # Max accel
+    ref = run_test("max_accel (bisection)", lambda: [
+        bisect_max_accel(shaper) for shaper in shapers], count)
+    res = run_test("max_accel (closed form)", lambda: [
+        shaper_calibrate.get_shaper_max_accel(shaper) for shaper in shapers],
+                   count)
+    sys.stdout.write("    max difference %.3g mm/s^2\n" % (
+        np.max(np.abs(np.array(res) - ref)),))
+    res = run_test("max_accel (arrays)",
+                   lambda: helper.find_shapers_max_accel(A, T), count)
+    sys.stdout.write("    max difference %.3g mm/s^2\n" % (
+        np.max(np.abs(res - ref)),))
+
+if __name__ == '__main__':
+    main()
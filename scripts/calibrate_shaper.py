@@ -12,10 +12,20 @@ import numpy as np, matplotlib
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
                              '..', 'klippy', 'extras'))
 from shaper_calibrate import CalibrationData, ShaperCalibrate
+from shaper_calibrate import INPUT_SHAPERS, SHAPER_DAMPING_RATIO
+import accel_capture
 
 MAX_TITLE_LENGTH=65
 
 def parse_log(logname):
+    if logname.endswith('.npz'):
+        # Stored calibration dataset (already normalized)
+        header, calibration_data, shapers = ShaperCalibrate(
+                printer=None).load_dataset(logname)
+        return calibration_data
+    if accel_capture.is_capture_file(logname):
+        # Binary accelerometer capture
+        return accel_capture.load_capture(np, logname)
     with open(logname) as f:
         for header in f:
             if not header.startswith('#'):
@@ -40,7 +50,7 @@ def parse_log(logname):
 ######################################################################
 
 # Find the best shaper parameters
-def calibrate_shaper(datas, csv_output, max_smoothing):
+def calibrate_shaper(datas, csv_output, max_smoothing, accel=None):
     helper = ShaperCalibrate(printer=None)
     if isinstance(datas[0], CalibrationData):
         calibration_data = datas[0]
@@ -55,6 +65,16 @@ def calibrate_shaper(datas, csv_output, max_smoothing):
     shaper, all_shapers = helper.find_best_shaper(
             calibration_data, max_smoothing, print)
     print("Recommended shaper is %s @ %.1f Hz" % (shaper.name, shaper.freq))
+    if accel is not None:
+        # Report the smoothing of all fitted shapers at the given accel
+        shaper_cfgs = {cfg.name: cfg for cfg in INPUT_SHAPERS}
+        A, T = helper.pack_shapers([
+            shaper_cfgs[s.name].init_func(s.freq, SHAPER_DAMPING_RATIO)
+            for s in all_shapers])
+        smoothings = helper.get_shapers_smoothing(A, T, accel)
+        for s, smoothing in zip(all_shapers, smoothings):
+            print("Shaper '%s' smoothing at %.0f mm/sec^2 ~= %.3f" % (
+                s.name, accel, smoothing))
     if csv_output is not None:
         helper.save_calibration_data(
                 csv_output, calibration_data, all_shapers)
@@ -143,6 +163,8 @@ def main():
                     help="maximum frequency to graph")
     opts.add_option("-s", "--max_smoothing", type="float", default=None,
                     help="maximum shaper smoothing to allow")
+    opts.add_option("-a", "--accel", type="float", default=None,
+                    help="report the shaper smoothing at this acceleration")
     options, args = opts.parse_args()
     if len(args) < 1:
         opts.error("Incorrect number of arguments")
@@ -154,7 +176,7 @@ def main():
 
     # Calibrate shaper and generate outputs
     selected_shaper, shapers, calibration_data = calibrate_shaper(
-            datas, options.csv, options.max_smoothing)
+            datas, options.csv, options.max_smoothing, options.accel)
 
     if not options.csv or options.output:
         # Draw graph
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Compare two stored input shaper calibration datasets
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import optparse, os, sys, time
+from textwrap import wrap
+import numpy as np, matplotlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy', 'extras'))
+from shaper_calibrate import ShaperCalibrate, MIN_FREQ, MAX_FREQ
+
+MAX_TITLE_LENGTH=65
+
+def find_peaks(freqs, psd, count=3):
+    # Find the largest local maxima of the frequency response
+    inner = psd[1:-1]
+    is_peak = (inner > psd[:-2]) & (inner >= psd[2:]) & (
+        inner > .1 * psd.max())
+    peaks = np.nonzero(is_peak)[0] + 1
+    peaks = peaks[np.argsort(psd[peaks])[::-1][:count]]
+    return [(freqs[i], psd[i]) for i in sorted(peaks)]
+
+def limit_freqs(calibration_data):
+    freqs = calibration_data.freq_bins
+    mask = (freqs >= MIN_FREQ) & (freqs <= MAX_FREQ)
+    return freqs[mask], calibration_data.psd_sum[mask]
+
+######################################################################
+# Text report
+######################################################################
+
+def format_header(header):
+    return "%s %s-axis '%s' (%s, max_smoothing=%s, selected %s)" % (
+        header['printer'], header['axis'], header['name'],
+        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header['time'])),
+        header['max_smoothing'], header['selected'])
+
+def report(datasets):
+    (header1, data1, shapers1), (header2, data2, shapers2) = datasets
+    print("Dataset 1: %s" % (format_header(header1),))
+    print("Dataset 2: %s" % (format_header(header2),))
+    # Frequency response changes
+    freqs1, psd1 = limit_freqs(data1)
+    freqs2, psd2 = limit_freqs(data2)
+    print("Total vibrations: %.3e -> %.3e (%+.1f%%)" % (
+        psd1.sum(), psd2.sum(), 100. * (psd2.sum() - psd1.sum()) / psd1.sum()))
+    for i, (freqs, psd) in enumerate([(freqs1, psd1), (freqs2, psd2)]):
+        print("Dataset %d resonance peaks: %s" % (i + 1, ", ".join([
+            "%.1f Hz (%.3e)" % (freq, val)
+            for freq, val in find_peaks(freqs, psd)])))
+    # Fitted shaper changes
+    print("%-10s %18s %18s %18s %20s" % (
+        "shaper", "freq (Hz)", "vibrations (%)", "smoothing",
+        "max_accel (mm/s^2)"))
+    shapers2 = {s.name: s for s in shapers2}
+    for s1 in shapers1:
+        s2 = shapers2.get(s1.name)
+        if s2 is None:
+            continue
+        print("%-10s %7.1f -> %7.1f %7.1f -> %7.1f %7.3f -> %7.3f"
+              " %8.0f -> %8.0f" % (
+                  s1.name, s1.freq, s2.freq, s1.vibrs * 100., s2.vibrs * 100.,
+                  s1.smoothing, s2.smoothing, s1.max_accel, s2.max_accel))
+
+######################################################################
+# Plotting
+######################################################################
+
+def plot_datasets(datasets, lognames):
+    fig, (ax1, ax2) = matplotlib.pyplot.subplots(nrows=2, sharex=True)
+    title = "Calibration datasets (%s)" % (', '.join(lognames),)
+    ax1.set_title("\n".join(wrap(title, MAX_TITLE_LENGTH)))
+    for (header, data, shapers), logname in zip(datasets, lognames):
+        freqs, psd = limit_freqs(data)
+        ax1.plot(freqs, psd, label="%s (%s)" % (header['name'],
+                                                 header['selected']))
+    ax1.set_ylabel('Power spectral density')
+    ax1.ticklabel_format(axis='y', style='scientific', scilimits=(0,0))
+    fontP = matplotlib.font_manager.FontProperties()
+    fontP.set_size('x-small')
+    ax1.legend(loc='best', prop=fontP)
+    ax1.grid(True)
+    # Ratio of the second frequency response to the first one
+    freqs1, psd1 = limit_freqs(datasets[0][1])
+    freqs2, psd2 = limit_freqs(datasets[1][1])
+    psd2 = np.interp(freqs1, freqs2, psd2)
+    ax2.plot(freqs1, psd2 / np.maximum(psd1, 1e-3 * psd1.max()))
+    ax2.set_yscale('log')
+    ax2.set_xlabel('Frequency, Hz')
+    ax2.set_ylabel('Ratio (2 / 1)')
+    ax2.grid(True)
+    fig.tight_layout()
+    return fig
+
+######################################################################
+# Startup
+######################################################################
+
+def setup_matplotlib(output_to_file):
+    global matplotlib
+    if output_to_file:
+        matplotlib.rcParams.update({'figure.autolayout': True})
+        matplotlib.use('Agg')
+    import matplotlib.pyplot, matplotlib.dates, matplotlib.font_manager
+    import matplotlib.ticker
+
+def main():
+    # Parse command-line arguments
+    usage = "%prog [options] <dataset1.npz> <dataset2.npz>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-o", "--output", type="string", dest="output",
+                    default=None, help="filename of output graph")
+    opts.add_option("-g", "--graph", action="store_true", dest="graph",
+                    help="show a graph of the frequency responses")
+    options, args = opts.parse_args()
+    if len(args) != 2:
+        opts.error("Incorrect number of arguments")
+
+    # Load and compare datasets
+    helper = ShaperCalibrate(printer=None)
+    datasets = [helper.load_dataset(fn) for fn in args]
+    report(datasets)
+
+    if options.graph or options.output:
+        # Draw graph
+        setup_matplotlib(options.output is not None)
+        fig = plot_datasets(datasets, args)
+
+        # Show graph
+        if options.output is None:
+            matplotlib.pyplot.show()
+        else:
+            fig.set_size_inches(8, 6)
+            fig.savefig(options.output)
+
+if __name__ == '__main__':
+    main()
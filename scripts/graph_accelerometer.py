@@ -5,28 +5,119 @@
 # Copyright (C) 2020  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import optparse, os, sys
+import itertools, multiprocessing, optparse, os, sys
 from textwrap import wrap
 import numpy as np, matplotlib
 sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
                              '..', 'klippy', 'extras'))
-from shaper_calibrate import ShaperCalibrate
+from shaper_calibrate import ShaperCalibrate, IncrementalPSD
+import accel_capture
 
 MAX_TITLE_LENGTH=65
+CHUNK_SAMPLES=250000
 
-def parse_log(logname, opts):
+def parse_log_header(logname, opts):
     with open(logname) as f:
         for header in f:
             if not header.startswith('#'):
                 break
         if not header.startswith('freq,psd_x,psd_y,psd_z,psd_xyz'):
             # Raw accelerometer data
-            return np.loadtxt(logname, comments='#', delimiter=',')
+            return
     # Power spectral density data or shaper calibration data
     opts.error("File %s does not contain raw accelerometer data and therefore "
                "is not supported by graph_accelerometer.py script. Please use "
                "calibrate_shaper.py script to process it instead." % (logname,))
 
+def parse_log(logname, opts):
+    if accel_capture.is_capture_file(logname):
+        # Binary accelerometer capture
+        return accel_capture.load_capture(np, logname)
+    parse_log_header(logname, opts)
+    return np.loadtxt(logname, comments='#', delimiter=',')
+
+######################################################################
+# Chunked processing of large files
+######################################################################
+
+# Read an accelerometer data file as a sequence of (N, 4) arrays
+def read_chunks(logname, chunk_size=CHUNK_SAMPLES):
+    if accel_capture.is_capture_file(logname):
+        for data in accel_capture.read_capture_chunks(
+                np, logname, max(1, chunk_size // 8)):
+            yield data
+        return
+    with open(logname) as f:
+        while 1:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            lines = [l for l in lines if not l.startswith('#')]
+            if lines:
+                yield np.loadtxt(lines, delimiter=',', ndmin=2)
+
+# Calculate the frequency response (and optionally the spectrogram) of
+# a file without loading all of its samples into memory
+def calc_stream(logname, chunk_size, max_freq=None, specgram_axis=None):
+    psd = None
+    first_time = last_time = None
+    columns = []
+    for data in read_chunks(logname, chunk_size):
+        if not data.shape[0]:
+            continue
+        if psd is None:
+            # The window size is chosen from the rate of the first chunk
+            first_time = data[0, 0]
+            rate = (data.shape[0] - 1) / max(data[-1, 0] - first_time, 1e-9)
+            psd = IncrementalPSD(np, rate)
+            if specgram_axis is not None:
+                # Only keep the bins up to max_freq (plus a margin as the
+                # final rate may differ slightly from the estimate)
+                max_bin = int(1.1 * max_freq * psd.nfft / rate) + 2
+                axes = {'all': [0, 1, 2], 'x': [0], 'y': [1], 'z': [2]}[
+                    specgram_axis]
+        last_time = data[-1, 0]
+        power = psd.add_samples(data[:, 1:])
+        if specgram_axis is not None and power.shape[0]:
+            # Each Welch window is also a column of the spectrogram
+            pdata = power[:, :, axes].sum(axis=2) * psd.get_window_scale()
+            pdata[:, 1:-1] *= 2.
+            columns.append(pdata[:, :max_bin].astype(np.float32))
+    if psd is None or last_time <= first_time:
+        return None, None
+    # Same sampling rate estimate as process_accelerometer_data()
+    fs = psd.sample_count / (last_time - first_time)
+    calibration_data = psd.get_calibration_data(fs)
+    if specgram_axis is None or not columns:
+        return calibration_data, None
+    pdata = np.concatenate(columns).T
+    bins = np.fft.rfftfreq(psd.nfft, 1. / fs)[:pdata.shape[0]]
+    step = psd.nfft - psd.overlap
+    t = (psd.nfft // 2 + step * np.arange(pdata.shape[1])) / fs
+    return calibration_data, (pdata, bins, t)
+
+def _calc_stream_freq_response(args):
+    logname, chunk_size = args
+    return calc_stream(logname, chunk_size)[0]
+
+# Calculate the frequency response of several files in parallel
+def calc_stream_freq_responses(lognames, chunk_size, jobs):
+    args = [(logname, chunk_size) for logname in lognames]
+    jobs = min(jobs, len(lognames))
+    if jobs <= 1:
+        res = list(map(_calc_stream_freq_response, args))
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            res = pool.map(_calc_stream_freq_response, args)
+        finally:
+            pool.close()
+            pool.join()
+    for calibration_data in res:
+        if calibration_data is not None:
+            calibration_data.set_numpy(np)
+    return res
+
 ######################################################################
 # Raw accelerometer graphing
 ######################################################################
@@ -79,10 +170,13 @@ def calc_specgram(data, axis):
             pdata += _specgram(d[ax])[0]
     return pdata, bins, t
 
-def plot_frequency(datas, lognames, max_freq):
-    calibration_data = calc_freq_response(datas[0], max_freq)
-    for data in datas[1:]:
-        calibration_data.add_data(calc_freq_response(data, max_freq))
+def calc_freq_responses(datas, max_freq):
+    return [calc_freq_response(data, max_freq) for data in datas]
+
+def plot_frequency(calibration_datas, lognames, max_freq):
+    calibration_data = calibration_datas[0]
+    for other in calibration_datas[1:]:
+        calibration_data.add_data(other)
     freqs = calibration_data.freq_bins
     psd = calibration_data.psd_sum[freqs <= max_freq]
     px = calibration_data.psd_x[freqs <= max_freq]
@@ -113,14 +207,13 @@ def plot_frequency(datas, lognames, max_freq):
     fig.tight_layout()
     return fig
 
-def plot_compare_frequency(datas, lognames, max_freq, axis):
+def plot_compare_frequency(calibration_datas, lognames, max_freq, axis):
     fig, ax = matplotlib.pyplot.subplots()
     ax.set_title('Frequency responses comparison')
     ax.set_xlabel('Frequency (Hz)')
     ax.set_ylabel('Power spectral density')
 
-    for data, logname in zip(datas, lognames):
-        calibration_data = calc_freq_response(data, max_freq)
+    for calibration_data, logname in zip(calibration_datas, lognames):
         freqs = calibration_data.freq_bins
         psd = calibration_data.get_psd(axis)[freqs <= max_freq]
         freqs = freqs[freqs <= max_freq]
@@ -137,8 +230,8 @@ def plot_compare_frequency(datas, lognames, max_freq, axis):
     return fig
 
 # Plot data in a "spectrogram colormap"
-def plot_specgram(data, logname, max_freq, axis):
-    pdata, bins, t = calc_specgram(data, axis)
+def plot_specgram(specgram, logname, max_freq, axis):
+    pdata, bins, t = specgram
 
     fig, ax = matplotlib.pyplot.subplots()
     ax.set_title("\n".join(wrap("Spectrogram %s (%s)" % (axis, logname),
@@ -154,11 +247,11 @@ def plot_specgram(data, logname, max_freq, axis):
 # CSV output
 ######################################################################
 
-def write_frequency_response(datas, output):
+def write_frequency_response(calibration_datas, output):
     helper = ShaperCalibrate(printer=None)
-    calibration_data = helper.process_accelerometer_data(datas[0])
-    for data in datas[1:]:
-        calibration_data.add_data(helper.process_accelerometer_data(data))
+    calibration_data = calibration_datas[0]
+    for other in calibration_datas[1:]:
+        calibration_data.add_data(other)
     helper.save_calibration_data(output, calibration_data)
 
 def write_specgram(psd, freq_bins, time, output):
@@ -181,8 +274,10 @@ def write_specgram(psd, freq_bins, time, output):
 def is_csv_output(output):
     return output and os.path.splitext(output)[1].lower() == '.csv'
 
-def setup_matplotlib(output):
+def setup_matplotlib(output, stream=False):
     global matplotlib
+    if is_csv_output(output) and stream:
+        return
     if is_csv_output(output):
         # Only mlab may be necessary with CSV output
         import matplotlib.mlab
@@ -210,43 +305,74 @@ def main():
                     help="graph spectrogram of accelerometer data")
     opts.add_option("-a", type="string", dest="axis", default="all",
                     help="axis to graph (one of 'all', 'x', 'y', or 'z')")
+    opts.add_option("--stream", action="store_true",
+                    help="process the files in chunks instead of loading"
+                         " them into memory (for very large files)")
+    opts.add_option("--chunk", type="int", dest="chunk",
+                    default=CHUNK_SAMPLES,
+                    help="number of samples per chunk in stream mode")
+    opts.add_option("-j", "--jobs", type="int", dest="jobs",
+                    default=multiprocessing.cpu_count(),
+                    help="number of files to process in parallel in stream"
+                         " mode")
     options, args = opts.parse_args()
     if len(args) < 1:
         opts.error("Incorrect number of arguments")
+    if options.raw and is_csv_output(options.output):
+        opts.error("raw mode is not supported with csv output")
+    if options.raw and options.stream:
+        opts.error("raw mode is not supported in stream mode")
+    if options.specgram and len(args) > 1:
+        opts.error("Only 1 input is supported in specgram mode")
+    if options.raw and len(args) > 1:
+        opts.error("Only 1 input is supported in raw mode")
+    if options.compare and is_csv_output(options.output):
+        opts.error("comparison mode is not supported with csv output")
+    if options.axis not in ['all', 'x', 'y', 'z']:
+        opts.error("Unsupported axis '%s'" % (options.axis,))
 
     # Parse data
-    datas = [parse_log(fn, opts) for fn in args]
-
-    setup_matplotlib(options.output)
+    setup_matplotlib(options.output, options.stream)
+    if options.stream:
+        for fn in args:
+            if not accel_capture.is_capture_file(fn):
+                parse_log_header(fn, opts)
+        if options.specgram:
+            calibration_data, specgram = calc_stream(
+                    args[0], options.chunk, options.max_freq, options.axis)
+            if specgram is None:
+                opts.error("Not enough accelerometer data in %s" % (args[0],))
+        else:
+            calibration_datas = calc_stream_freq_responses(
+                    args, options.chunk, options.jobs)
+            for calibration_data, fn in zip(calibration_datas, args):
+                if calibration_data is None:
+                    opts.error("Not enough accelerometer data in %s" % (fn,))
+    else:
+        datas = [parse_log(fn, opts) for fn in args]
+        if options.specgram:
+            specgram = calc_specgram(datas[0], options.axis)
+        elif not options.raw:
+            calibration_datas = calc_freq_responses(datas, options.max_freq)
 
     if is_csv_output(options.output):
-        if options.raw:
-            opts.error("raw mode is not supported with csv output")
-        if options.compare:
-            opts.error("comparison mode is not supported with csv output")
         if options.specgram:
-            if len(args) > 1:
-                opts.error("Only 1 input is supported in specgram mode")
-            pdata, bins, t = calc_specgram(datas[0], options.axis)
+            pdata, bins, t = specgram
             write_specgram(pdata, bins, t, options.output)
         else:
-            write_frequency_response(datas, options.output)
+            write_frequency_response(calibration_datas, options.output)
         return
 
     # Draw graph
     if options.raw:
-        if len(args) > 1:
-            opts.error("Only 1 input is supported in raw mode")
         fig = plot_accel(datas[0], args[0])
     elif options.specgram:
-        if len(args) > 1:
-            opts.error("Only 1 input is supported in specgram mode")
-        fig = plot_specgram(datas[0], args[0], options.max_freq, options.axis)
+        fig = plot_specgram(specgram, args[0], options.max_freq, options.axis)
     elif options.compare:
-        fig = plot_compare_frequency(datas, args, options.max_freq,
-                                     options.axis)
+        fig = plot_compare_frequency(calibration_datas, args,
+                                     options.max_freq, options.axis)
     else:
-        fig = plot_frequency(datas, args, options.max_freq)
+        fig = plot_frequency(calibration_datas, args, options.max_freq)
 
     # Show graph
     if options.output is None:
@@ -5,8 +5,11 @@
 # Copyright (C) 2020  Dmitry Butyugin <dmbutyugin@google.com>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import optparse, math
+import optparse, os, sys, math
 import matplotlib
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy', 'extras'))
+import shaper_calibrate
 
 # A set of damping ratios to calculate shaper response for
 DAMPING_RATIOS=[0.05, 0.1, 0.2]
@@ -220,14 +223,19 @@ def gen_shaped_step_function(shaper):
 
 
 def plot_shaper(shaper):
+    A, T, name = shaper
+    smoothing = shaper_calibrate.get_shaper_smoothing((A, T))
+    max_accel = shaper_calibrate.get_shaper_max_accel((A, T))
     shift_pulses(shaper)
     freqs, response, response_legend = gen_shaper_response(shaper)
     time, step_vals, step_legend = gen_shaped_step_function(shaper)
 
     fig, (ax1, ax2) = matplotlib.pyplot.subplots(nrows=2, figsize=(10,9))
     ax1.set_title("Vibration response simulation for shaper '%s',\n"
-                  "shaper_freq=%.1f Hz, damping_ratio=%.3f"
-                  % (shaper[-1], SHAPER_FREQ, SHAPER_DAMPING_RATIO))
+                  "shaper_freq=%.1f Hz, damping_ratio=%.3f,\n"
+                  "smoothing~=%.3f, max_accel<=%.0f"
+                  % (shaper[-1], SHAPER_FREQ, SHAPER_DAMPING_RATIO,
+                     smoothing, round(max_accel / 100.) * 100.))
     ax1.plot(freqs, response)
     ax1.set_ylim(bottom=0.)
     fontP = matplotlib.font_manager.FontProperties()
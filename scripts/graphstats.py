@@ -4,7 +4,7 @@
 # Copyright (C) 2016-2019  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import optparse, datetime
+import optparse, struct, time
 import matplotlib
 
 MAXBANDWIDTH=25000.
@@ -15,7 +15,7 @@ TASK_MAX=0.0025
 APPLY_PREFIX = [
     'mcu_awake', 'mcu_task_avg', 'mcu_task_stddev', 'bytes_write',
     'bytes_read', 'bytes_retransmit', 'freq', 'adj',
-    'target', 'temp', 'pwm'
+    'target', 'temp', 'pwm', 'cpu', 'vcsw', 'ivcsw'
 ]
 
 def parse_log(logname, mcu):
@@ -50,6 +50,155 @@ def parse_log(logname, mcu):
     f.close()
     return out
 
+# Binary statistics file (see klippy/extras/statistics.py)
+STATS_FILE_MAGIC = b'KLSTATS2'
+STATS_SEGMENT_HEADER = struct.Struct('<cIId')
+
+def is_stats_file(filename):
+    f = open(filename, 'rb')
+    magic = f.read(len(STATS_FILE_MAGIC))
+    f.close()
+    return magic == STATS_FILE_MAGIC
+
+# Map a stats file into a list of (wall_offset, columns, rows) segments
+def read_stats_segments(filename):
+    import numpy
+    data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+    segments = []
+    pos = len(STATS_FILE_MAGIC)
+    while pos + STATS_SEGMENT_HEADER.size <= len(data):
+        tag, count, col_count, wall_offset = STATS_SEGMENT_HEADER.unpack(
+            data[pos:pos+STATS_SEGMENT_HEADER.size].tobytes())
+        if tag != b'S':
+            raise ValueError("Invalid segment in stats file %s" % (filename,))
+        pos += STATS_SEGMENT_HEADER.size
+        columns = []
+        for i in range(col_count):
+            nlen, = struct.unpack('<H', data[pos:pos+2].tobytes())
+            columns.append(data[pos+2:pos+2+nlen].tobytes().decode())
+            pos += 2 + nlen
+        # The last segment may be truncated if the writer was interrupted
+        row_size = 8 * (col_count + 1)
+        count = min(count, (len(data) - pos) // row_size)
+        rows = numpy.ndarray((count, col_count + 1), dtype='<f8',
+                             buffer=data, offset=pos)
+        segments.append((wall_offset, columns, rows))
+        pos += count * row_size
+    return segments
+
+# Binary search for the first row at or after the given wall time
+def find_stats_row(rows, wall_offset, wall_time):
+    low, high = 0, len(rows)
+    while low < high:
+        mid = (low + high) // 2
+        if rows[mid, 0] + wall_offset < wall_time:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+# Load the columns of one or more stats files (optionally limited to a
+# time range) as numpy arrays
+def load_stats_files(filenames, start_time=None, end_time=None):
+    import numpy
+    out = []
+    for filename in filenames:
+        for wall_offset, columns, rows in read_stats_segments(filename):
+            low, high = 0, len(rows)
+            if start_time is not None:
+                low = find_stats_row(rows, wall_offset, start_time)
+            if end_time is not None:
+                high = find_stats_row(rows, wall_offset, end_time)
+            if low >= high:
+                continue
+            sel = numpy.array(rows[low:high])
+            seg = {name: sel[:, i+1] for i, name in enumerate(columns)}
+            seg['#sampletime'] = sel[:, 0] + wall_offset
+            out.append(seg)
+    out.sort(key=lambda seg: seg['#sampletime'][0])
+    return out
+
+def parse_stats_files(filenames, mcu, start_time=None, end_time=None):
+    import numpy
+    if mcu is None:
+        mcu = "mcu"
+    apply_prefix = { p: 1 for p in APPLY_PREFIX }
+    segs = []
+    for seg in load_stats_files(filenames, start_time, end_time):
+        if 'print_time' not in seg:
+            continue
+        keep = ~numpy.isnan(seg['print_time'])
+        if keep.all():
+            keep = slice(None)
+        # Translate the column names to the keys used by parse_log()
+        cols = {}
+        for name, values in seg.items():
+            key = name
+            if ':' in name:
+                prefix, key = name.rsplit(':', 1)
+                if prefix != mcu and key in apply_prefix:
+                    key = name
+            cols[key] = values[keep]
+        segs.append(cols)
+    return join_columns(segs)
+
+# Join lists of columns (NaN where a field was not reported)
+def join_columns(segs):
+    import numpy
+    if len(segs) == 1:
+        return segs[0]
+    keys = set()
+    for cols in segs:
+        keys.update(cols)
+    out = {}
+    for key in keys:
+        out[key] = numpy.concatenate([
+            cols[key] if key in cols
+            else numpy.full(len(cols['#sampletime']), numpy.nan)
+            for cols in segs])
+    return out
+
+# Convert the per-sample dictionaries of parse_log() to columns
+def build_columns(data):
+    import numpy
+    keys = set()
+    for d in data:
+        keys.update(d)
+    out = {}
+    for key in keys:
+        values = numpy.full(len(data), numpy.nan)
+        try:
+            for i, d in enumerate(data):
+                if key in d:
+                    values[i] = float(d[key])
+        except ValueError:
+            # Not a numeric field
+            continue
+        out[key] = values
+    return out
+
+# Return a column with the missing values replaced by a default
+def get_column(data, key, default=0.):
+    import numpy
+    values = data.get(key)
+    if values is None:
+        return numpy.full(len(data['#sampletime']), default)
+    return numpy.where(numpy.isnan(values), default, values)
+
+def get_dates(sampletimes):
+    import numpy
+    return numpy.round(sampletimes * 1000000.).astype('datetime64[us]')
+
+def parse_time(value):
+    if value is None:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError("Invalid time '%s'" % (value,))
+
 def setup_matplotlib(output_to_file):
     global matplotlib
     if output_to_file:
@@ -61,10 +210,12 @@ def find_print_restarts(data):
     runoff_samples = {}
     last_runoff_start = last_buffer_time = last_sampletime = 0.
     last_print_stall = 0
-    for d in reversed(data):
+    sampletimes = data['#sampletime'].tolist()
+    buffer_times = get_column(data, 'buffer_time').tolist()
+    print_stalls = data['print_stall'].tolist()
+    for sampletime, buffer_time, print_stall in reversed(list(zip(
+            sampletimes, buffer_times, print_stalls))):
         # Check for buffer runoff
-        sampletime = d['#sampletime']
-        buffer_time = float(d.get('buffer_time', 0.))
         if (last_runoff_start and last_sampletime - sampletime < 5
             and buffer_time > last_buffer_time):
             runoff_samples[last_runoff_start][1].append(sampletime)
@@ -76,7 +227,6 @@ def find_print_restarts(data):
         last_buffer_time = buffer_time
         last_sampletime = sampletime
         # Check for print stall
-        print_stall = int(d['print_stall'])
         if print_stall < last_print_stall:
             if last_runoff_start:
                 runoff_samples[last_runoff_start][0] = True
@@ -86,40 +236,43 @@ def find_print_restarts(data):
     return sample_resets
 
 def plot_mcu(data, maxbw):
+    import numpy
     # Generate data for plot
-    basetime = lasttime = data[0]['#sampletime']
-    lastbw = float(data[0]['bytes_write']) + float(data[0]['bytes_retransmit'])
+    sampletimes = data['#sampletime'].tolist()
+    bws = (data['bytes_write'] + data['bytes_retransmit']).tolist()
+    task_loads = (data['mcu_task_avg'] + 3*data['mcu_task_stddev']).tolist()
+    buffer_times = data['buffer_time'].tolist()
+    awake_times = get_column(data, 'mcu_awake').tolist()
+    basetime = lasttime = sampletimes[0]
+    lastbw = bws[0]
     sample_resets = find_print_restarts(data)
     times = []
     bwdeltas = []
     loads = []
     awake = []
     hostbuffers = []
-    for d in data:
-        st = d['#sampletime']
+    for st, bw, load, hb, awake_time in zip(sampletimes, bws, task_loads,
+                                            buffer_times, awake_times):
         timedelta = st - lasttime
         if timedelta <= 0.:
             continue
-        bw = float(d['bytes_write']) + float(d['bytes_retransmit'])
         if bw < lastbw:
             lastbw = bw
             continue
-        load = float(d['mcu_task_avg']) + 3*float(d['mcu_task_stddev'])
         if st - basetime < 15.:
             load = 0.
-        pt = float(d['print_time'])
-        hb = float(d['buffer_time'])
         if hb >= MAXBUFFER or st in sample_resets:
             hb = 0.
         else:
             hb = 100. * (MAXBUFFER - hb) / MAXBUFFER
         hostbuffers.append(hb)
-        times.append(datetime.datetime.utcfromtimestamp(st))
+        times.append(st)
         bwdeltas.append(100. * (bw - lastbw) / (maxbw * timedelta))
         loads.append(100. * load / TASK_MAX)
-        awake.append(100. * float(d.get('mcu_awake', 0.)) / STATS_INTERVAL)
+        awake.append(100. * awake_time / STATS_INTERVAL)
         lasttime = st
         lastbw = bw
+    times = get_dates(numpy.array(times))
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -138,26 +291,32 @@ def plot_mcu(data, maxbw):
     return fig
 
 def plot_system(data):
+    import numpy
     # Generate data for plot
-    lasttime = data[0]['#sampletime']
-    lastcputime = float(data[0]['cputime'])
-    times = []
-    sysloads = []
-    cputimes = []
-    memavails = []
-    for d in data:
-        st = d['#sampletime']
-        timedelta = st - lasttime
-        if timedelta <= 0.:
-            continue
-        lasttime = st
-        times.append(datetime.datetime.utcfromtimestamp(st))
-        cputime = float(d['cputime'])
-        cpudelta = max(0., min(1.5, (cputime - lastcputime) / timedelta))
-        lastcputime = cputime
-        cputimes.append(cpudelta * 100.)
-        sysloads.append(float(d['sysload']) * 100.)
-        memavails.append(float(d['memavail']))
+    sampletimes = data['#sampletime']
+    # Only use the samples after a positive time step
+    keep = numpy.zeros(len(sampletimes), dtype=bool)
+    keep[1:] = sampletimes[1:] > numpy.maximum.accumulate(sampletimes)[:-1]
+    idx = numpy.concatenate([[0], numpy.flatnonzero(keep)])
+    timedeltas = numpy.diff(sampletimes[idx])
+    def deltas(values):
+        # Usage between the kept samples (in percent of a core)
+        rate = numpy.diff(values) / timedeltas
+        return numpy.clip(rate, 0., 1.5) * 100.
+    times = get_dates(sampletimes[keep])
+    cputimes = deltas(data['cputime'][idx])
+    sysloads = data['sysload'][keep] * 100.
+    memavails = data['memavail'][keep]
+    thread_keys = sorted([k for k in data if k.startswith('thread_')
+                          and k.endswith(':cpu')])
+    threadtimes = {}
+    for k in thread_keys:
+        # Keep the last value while a thread is not reported
+        values = data[k][idx]
+        if numpy.isnan(values[0]):
+            values[0] = 0.
+        valid = numpy.where(numpy.isnan(values), 0, numpy.arange(len(idx)))
+        threadtimes[k] = deltas(values[numpy.maximum.accumulate(valid)])
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -168,6 +327,9 @@ def plot_system(data):
                   color='cyan', alpha=0.8)
     ax1.plot_date(times, cputimes, '-', label='process time',
                   color='red', alpha=0.8)
+    for k in thread_keys:
+        ax1.plot_date(times, threadtimes[k], '-', alpha=0.5,
+                      label=k[len('thread_'):-len(':cpu')] + ' thread')
     ax2 = ax1.twinx()
     ax2.set_ylabel('Available memory (KB)')
     ax2.plot_date(times, memavails, '-', label='system memory',
@@ -180,20 +342,12 @@ def plot_system(data):
     return fig
 
 def plot_frequency(data, mcu):
-    all_keys = {}
-    for d in data:
-        all_keys.update(d)
+    import numpy
     one_mcu = mcu is not None
-    graph_keys = { key: ([], []) for key in all_keys
-                   if (key in ("freq", "adj") or (not one_mcu and (
-                           key.endswith(":freq") or key.endswith(":adj")))) }
-    for d in data:
-        st = datetime.datetime.utcfromtimestamp(d['#sampletime'])
-        for key, (times, values) in graph_keys.items():
-            val = d.get(key)
-            if val not in (None, '0', '1'):
-                times.append(st)
-                values.append(float(val))
+    graph_keys = [key for key in data
+                  if (key in ("freq", "adj") or (not one_mcu and (
+                      key.endswith(":freq") or key.endswith(":adj"))))]
+    dates = get_dates(data['#sampletime'])
 
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
@@ -204,8 +358,9 @@ def plot_frequency(data, mcu):
     ax1.set_xlabel('Time')
     ax1.set_ylabel('Frequency')
     for key in sorted(graph_keys):
-        times, values = graph_keys[key]
-        ax1.plot_date(times, values, '.', label=key)
+        values = data[key]
+        valid = ~numpy.isnan(values) & (values != 0.) & (values != 1.)
+        ax1.plot_date(dates[valid], values[valid], '.', label=key)
     fontP = matplotlib.font_manager.FontProperties()
     fontP.set_size('x-small')
     ax1.legend(loc='best', prop=fontP)
@@ -215,21 +370,16 @@ def plot_frequency(data, mcu):
     return fig
 
 def plot_temperature(data, heater):
+    import numpy
     temp_key = heater + ':' + 'temp'
     target_key = heater + ':' + 'target'
     pwm_key = heater + ':' + 'pwm'
-    times = []
-    temps = []
-    targets = []
-    pwm = []
-    for d in data:
-        temp = d.get(temp_key)
-        if temp is None:
-            continue
-        times.append(datetime.datetime.utcfromtimestamp(d['#sampletime']))
-        temps.append(float(temp))
-        pwm.append(float(d.get(pwm_key, 0.)))
-        targets.append(float(d.get(target_key, 0.)))
+    temps = get_column(data, temp_key, numpy.nan)
+    valid = ~numpy.isnan(temps)
+    times = get_dates(data['#sampletime'][valid])
+    temps = temps[valid]
+    pwm = get_column(data, pwm_key)[valid]
+    targets = get_column(data, target_key)[valid]
     # Build plot
     fig, ax1 = matplotlib.pyplot.subplots()
     ax1.set_title("Temperature of heater %s" % (heater,))
@@ -249,7 +399,7 @@ def plot_temperature(data, heater):
 
 def main():
     # Parse command-line arguments
-    usage = "%prog [options] <logfile>"
+    usage = "%prog [options] <logfile | statsfile...>"
     opts = optparse.OptionParser(usage)
     opts.add_option("-f", "--frequency", action="store_true",
                     help="graph mcu frequency")
@@ -261,14 +411,27 @@ def main():
                     default=None, help="graph heater temperature")
     opts.add_option("-m", "--mcu", type="string", dest="mcu", default=None,
                     help="limit stats to the given mcu")
+    opts.add_option("--start", type="string", dest="start", default=None,
+                    help="start time (YYYY-MM-DD HH:MM) for stats files")
+    opts.add_option("--end", type="string", dest="end", default=None,
+                    help="end time (YYYY-MM-DD HH:MM) for stats files")
     options, args = opts.parse_args()
-    if len(args) != 1:
+    if not args:
         opts.error("Incorrect number of arguments")
-    logname = args[0]
 
     # Parse data
-    data = parse_log(logname, options.mcu)
-    if not data:
+    if is_stats_file(args[0]):
+        try:
+            start_time = parse_time(options.start)
+            end_time = parse_time(options.end)
+        except ValueError as e:
+            opts.error(str(e))
+        data = parse_stats_files(args, options.mcu, start_time, end_time)
+    else:
+        if len(args) != 1:
+            opts.error("Incorrect number of arguments")
+        data = build_columns(parse_log(args[0], options.mcu))
+    if not data or not len(data['#sampletime']):
         return
 
     # Draw graph
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Reader for the Klippy shared memory status snapshot
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, optparse, mmap, struct, json, time
+
+# This must match the layout in klippy/extras/shared_status.py
+HEADER_MAGIC = b'KSTS'
+HEADER_VERSION = 1
+HEADER_FORMAT = '<4sIIId'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+class error(Exception):
+    pass
+
+class SharedStatusReader:
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+    def close(self):
+        self.mm.close()
+    def read_raw(self, retries=1000):
+        # Returns (seq, eventtime, json_data) from a consistent snapshot
+        mm = self.mm
+        for i in range(retries):
+            magic, version, seq, length, eventtime = struct.unpack_from(
+                HEADER_FORMAT, mm, 0)
+            if magic != HEADER_MAGIC:
+                if not seq and magic == b'\0\0\0\0':
+                    raise error("Status snapshot not yet available")
+                raise error("Invalid status file")
+            if version != HEADER_VERSION:
+                raise error("Unsupported status version %d" % (version,))
+            if seq & 1 or HEADER_SIZE + length > len(mm):
+                continue
+            data = mm[HEADER_SIZE:HEADER_SIZE+length]
+            if struct.unpack_from(HEADER_FORMAT, mm, 0)[2] == seq:
+                return seq, eventtime, data
+        raise error("Unable to obtain consistent status snapshot")
+    def read(self):
+        # Returns (seq, eventtime, status_dict)
+        seq, eventtime, data = self.read_raw()
+        return seq, eventtime, json.loads(data)
+
+def main():
+    usage = "%prog [options] <status file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-i", "--interval", type="float", dest="interval",
+                    default=0., help="poll interval (0 to read once)")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    reader = SharedStatusReader(args[0])
+    last_seq = None
+    while 1:
+        seq, eventtime, status = reader.read()
+        if seq != last_seq:
+            sys.stdout.write("%.3f: %s\n" % (eventtime, json.dumps(status)))
+            sys.stdout.flush()
+            last_seq = seq
+        if options.interval <= 0.:
+            break
+        time.sleep(options.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Test of input_shaper parameter changes during continuous motion
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, subprocess, tempfile, shutil, math
+import numpy as np
+KLIPPER_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.append(os.path.join(KLIPPER_DIR, 'klippy'))
+import msgproto
+
+CONFIG = """
+[input_shaper]
+shaper_freq_x: 50
+shaper_freq_y: 40
+
+[stepper_x]
+step_pin: ar54
+dir_pin: ar55
+enable_pin: !ar38
+step_distance: %.4f
+endstop_pin: ^ar3
+position_endstop: 0
+position_max: 200
+homing_speed: 50
+
+[stepper_y]
+step_pin: ar60
+dir_pin: !ar61
+enable_pin: !ar56
+step_distance: %.4f
+endstop_pin: ^ar14
+position_endstop: 0
+position_max: 200
+homing_speed: 50
+
+[stepper_z]
+step_pin: ar46
+dir_pin: ar48
+enable_pin: !ar62
+step_distance: .0025
+endstop_pin: ^ar18
+position_endstop: 0.5
+position_max: 200
+
+[mcu]
+serial: /dev/ttyACM0
+pin_map: arduino
+
+[printer]
+kinematics: cartesian
+max_velocity: 300
+max_accel: 3000
+max_z_velocity: 5
+max_z_accel: 100
+"""
+
+STEP_DISTANCE = .0125
+STEP_PINS = {'PF0': 0, 'PF6': 1}
+SPEED = 100.
+RADIUS = 40.
+SEGMENTS = 72
+LAPS = 3
+# A burst of changes larger than the mcu side limit of pending changes
+BURST = 12
+WINDOW = .020
+
+class error(Exception):
+    pass
+
+def gen_gcode():
+    cx = cy = 100.
+    out = ["G28", "G1 X%.3f Y%.3f Z5 F6000" % (cx + RADIUS, cy), "G4 P500"]
+    for i in range(1, LAPS * SEGMENTS + 1):
+        a = 2. * math.pi * i / SEGMENTS
+        out.append("G1 X%.3f Y%.3f F%d" % (
+            cx + RADIUS * math.cos(a), cy + RADIUS * math.sin(a),
+            SPEED * 60.))
+        if i % 20 == 5:
+            # Single changes while moving
+            out.append("SET_INPUT_SHAPER SHAPER_FREQ_X=%d SHAPER_FREQ_Y=%d"
+                       % (45 + i % 11, 35 + i % 13))
+        elif i == SEGMENTS + 10:
+            # Too many pending changes at once
+            for j in range(BURST):
+                out.append("SET_INPUT_SHAPER SHAPER_TYPE=%s SHAPER_FREQ_X=%d"
+                           % (('mzv', 'ei', 'zv')[j % 3], 40 + j))
+    out.append("M400")
+    return "\n".join(out) + "\n"
+
+# Rebuild the step times and positions of the x and y steppers
+def load_steps(dictionary, serial_fname):
+    mp = msgproto.MessageParser()
+    f = open(dictionary, 'rb')
+    mp.process_identify(f.read(), decompress=False)
+    f.close()
+    freq = mp.get_constant_float('CLOCK_FREQ')
+    f = open(serial_fname, 'rb')
+    data = f.read()
+    f.close()
+    packets, pos, discarded = mp.split_packets(data)
+    oids = {}
+    steps = [([], []) for axis in STEP_PINS]
+    state = {}
+    for packet in packets:
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        while pos < len(packet) - msgproto.MESSAGE_TRAILER_SIZE:
+            mid = mp.messages_by_id[packet[pos]]
+            params, pos = mid.parse(packet, pos)
+            if mid.name == 'config_stepper':
+                axis = STEP_PINS.get(params['step_pin'])
+                if axis is not None:
+                    oids[params['oid']] = axis
+                    state[params['oid']] = [0, 1]
+                continue
+            oid = params.get('oid')
+            if oid not in oids:
+                continue
+            st = state[oid]
+            if mid.name == 'reset_step_clock':
+                st[0] = params['clock']
+            elif mid.name == 'set_next_step_dir':
+                st[1] = 1 if params['dir'] else -1
+            elif mid.name == 'queue_step':
+                count, interval, add = (params['count'], params['interval'],
+                                        params['add'])
+                n = np.arange(count)
+                clocks = st[0] + interval * (n + 1) + add * n * (n + 1) // 2
+                times, dirs = steps[oids[oid]]
+                times.append(clocks)
+                dirs.append(np.full(count, st[1]))
+                st[0] = int(clocks[-1])
+    res = []
+    for times, dirs in steps:
+        if not times:
+            raise error("No steps found")
+        times = np.concatenate(times) / freq
+        pos = np.cumsum(np.concatenate(dirs)) * STEP_DISTANCE
+        res.append((times, pos))
+    return res
+
+def check_motion(steps):
+    start = min(t[0] for t, p in steps)
+    end = max(t[-1] for t, p in steps)
+    sample_times = np.arange(start, end, WINDOW / 4.)
+    def get_pos(times, pos, t):
+        idx = np.searchsorted(times, t, side='right')
+        return np.concatenate([[0.], pos])[idx]
+    pos = [get_pos(times, p, sample_times) for times, p in steps]
+    dt = int(round(WINDOW / (WINDOW / 4.)))
+    dx = [(p[dt:] - p[:-dt]) / WINDOW for p in pos]
+    speed = np.hypot(dx[0], dx[1])
+    mid_times = sample_times[:-dt] + .5 * WINDOW
+    # Any discontinuity of the positions shows up as a burst of steps
+    max_speed = np.max(speed)
+    if max_speed > 1.2 * SPEED:
+        raise error("Position discontinuity near %.3fs (%.1f mm/s)" % (
+            mid_times[np.argmax(speed)], max_speed))
+    # Find the circle - the final run of continuous xy motion
+    moving = speed > .5 * SPEED
+    stops = np.nonzero(~moving)[0]
+    last_stop = stops[stops < len(moving) - 1 - np.argmax(moving[::-1])]
+    circle_start = mid_times[last_stop[-1] + 1] if len(last_stop) else start
+    circle_end = mid_times[len(moving) - 1 - np.argmax(moving[::-1])]
+    # A flush of the lookahead queue would stop the toolhead
+    duration = LAPS * 2. * math.pi * RADIUS / SPEED
+    if circle_end - circle_start < .95 * duration:
+        raise error("Motion stopped at %.3fs (%.3fs of continuous motion"
+                    " instead of %.3fs)" % (circle_start,
+                                           circle_end - circle_start,
+                                           duration))
+
+def main():
+    usage = "%prog [options] <atmega2560.dict>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-v", action="store_true", dest="verbose",
+                    help="show all output from the host")
+    opts.add_option("-k", action="store_true", dest="keepfiles",
+                    help="do not remove temporary files")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    dictionary = os.path.abspath(args[0])
+    tempdir = tempfile.mkdtemp(prefix="input_shaper_")
+    config_fname = os.path.join(tempdir, 'printer.cfg')
+    gcode_fname = os.path.join(tempdir, 'moves.gcode')
+    serial_fname = os.path.join(tempdir, 'out.serial')
+    log_fname = os.path.join(tempdir, 'klippy.log')
+    f = open(config_fname, 'w')
+    f.write(CONFIG % (STEP_DISTANCE, STEP_DISTANCE))
+    f.close()
+    f = open(gcode_fname, 'w')
+    f.write(gen_gcode())
+    f.close()
+    out = None if options.verbose else subprocess.DEVNULL
+    res = subprocess.call(
+        [sys.executable, os.path.join(KLIPPER_DIR, 'klippy/klippy.py'),
+         config_fname, '-i', gcode_fname, '-o', serial_fname, '-v',
+         '-d', dictionary, '-l', log_fname], stdout=out, stderr=out)
+    try:
+        if res:
+            raise error("Host exited with code %d" % (res,))
+        check_motion(load_steps(dictionary, serial_fname))
+    except error as e:
+        sys.stderr.write("FAIL: %s\n" % (str(e),))
+        options.keepfiles = True
+        res = -1
+    else:
+        sys.stdout.write("Input shaper transition test passed\n")
+        res = 0
+    if options.keepfiles:
+        sys.stdout.write("Temporary files are in %s\n" % (tempdir,))
+    else:
+        shutil.rmtree(tempdir)
+    sys.exit(res)
+
+if __name__ == '__main__':
+    main()
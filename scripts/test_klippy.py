@@ -3,11 +3,13 @@
 # Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import sys, os, optparse, logging, subprocess
+import sys, os, optparse, logging, subprocess, multiprocessing, tempfile
+import shutil, time
 
 TEMP_GCODE_FILE = "_test_.gcode"
 TEMP_LOG_FILE = "_test_.log"
 TEMP_OUTPUT_FILE = "_test_output"
+TEMP_STDOUT_FILE = "_test_.out"
 
 
 ######################################################################
@@ -18,12 +20,14 @@ class error(Exception):
     pass
 
 class TestCase:
-    def __init__(self, fname, dictdir, tempdir, verbose, keepfiles):
+    def __init__(self, fname, dictdir, tempdir, verbose, keepfiles,
+                 quiet=False):
         self.fname = fname
         self.dictdir = dictdir
         self.tempdir = tempdir
         self.verbose = verbose
         self.keepfiles = keepfiles
+        self.quiet = quiet
     def relpath(self, fname, rel='test'):
         if rel == 'dict':
             reldir = self.dictdir
@@ -34,6 +38,11 @@ class TestCase:
         return os.path.join(reldir, fname)
     def parse_test(self):
         # Parse file into test cases
+        tests = []
+        def add_test(config_fname, dict_fnames, gcode_fname, gcode,
+                     should_fail):
+            tests.append((config_fname, dict_fnames, gcode_fname,
+                          list(gcode), should_fail))
         config_fname = gcode_fname = dict_fnames = None
         should_fail = multi_tests = False
         gcode = []
@@ -50,12 +59,12 @@ class TestCase:
                     # Multiple tests in same file
                     if not multi_tests:
                         multi_tests = True
-                        self.launch_test(config_fname, dict_fnames,
-                                         gcode_fname, gcode, should_fail)
+                        add_test(config_fname, dict_fnames,
+                                 gcode_fname, gcode, should_fail)
                 config_fname = self.relpath(parts[1])
                 if multi_tests:
-                    self.launch_test(config_fname, dict_fnames,
-                                     gcode_fname, gcode, should_fail)
+                    add_test(config_fname, dict_fnames,
+                             gcode_fname, gcode, should_fail)
             elif parts[0] == "DICTIONARY":
                 dict_fnames = [self.relpath(parts[1], 'dict')]
                 for mcu_dict in parts[2:]:
@@ -70,8 +79,9 @@ class TestCase:
                 gcode.append(line.strip())
         f.close()
         if not multi_tests:
-            self.launch_test(config_fname, dict_fnames,
-                             gcode_fname, gcode, should_fail)
+            add_test(config_fname, dict_fnames,
+                     gcode_fname, gcode, should_fail)
+        return tests
     def launch_test(self, config_fname, dict_fnames, gcode_fname, gcode,
                     should_fail):
         gcode_is_temp = False
@@ -88,18 +98,24 @@ class TestCase:
         if dict_fnames is None:
             raise error("data dictionary file not specified")
         # Call klippy
-        sys.stderr.write("    Starting %s (%s)\n" % (
-            self.fname, os.path.basename(config_fname)))
+        if not self.quiet:
+            sys.stderr.write("    Starting %s (%s)\n" % (
+                self.fname, os.path.basename(config_fname)))
+        output_fname = self.relpath(TEMP_OUTPUT_FILE, 'temp')
         args = [ sys.executable, './klippy/klippy.py', config_fname,
-                 '-i', gcode_fname, '-o', TEMP_OUTPUT_FILE, '-v' ]
+                 '-i', gcode_fname, '-o', output_fname, '-v' ]
         for df in dict_fnames:
             args += ['-d', df]
         if not self.verbose:
-            args += ['-l', TEMP_LOG_FILE]
-        res = subprocess.call(args)
+            args += ['-l', self.relpath(TEMP_LOG_FILE, 'temp')]
+        if self.quiet:
+            with open(self.relpath(TEMP_STDOUT_FILE, 'temp'), 'w') as f:
+                res = subprocess.call(args, stdout=f, stderr=subprocess.STDOUT)
+        else:
+            res = subprocess.call(args)
         is_fail = (should_fail and not res) or (not should_fail and res)
         if is_fail:
-            if not self.verbose:
+            if not self.verbose and not self.quiet:
                 self.show_log()
             if should_fail:
                 raise error("Test failed to raise an error")
@@ -109,16 +125,22 @@ class TestCase:
             return
         for fname in os.listdir(self.tempdir):
             if fname.startswith(TEMP_OUTPUT_FILE):
-                os.unlink(fname)
+                os.unlink(self.relpath(fname, 'temp'))
+        if self.quiet:
+            os.unlink(self.relpath(TEMP_STDOUT_FILE, 'temp'))
         if not self.verbose:
-            os.unlink(TEMP_LOG_FILE)
+            os.unlink(self.relpath(TEMP_LOG_FILE, 'temp'))
         else:
             sys.stderr.write('\n')
         if gcode_is_temp:
             os.unlink(gcode_fname)
-    def run(self):
+    def run(self, index=None):
         try:
-            self.parse_test()
+            tests = self.parse_test()
+            if index is not None:
+                tests = [tests[index]]
+            for test in tests:
+                self.launch_test(*test)
         except error as e:
             return str(e)
         except Exception:
@@ -126,12 +148,77 @@ class TestCase:
             return "internal error"
         return "success"
     def show_log(self):
-        f = open(TEMP_LOG_FILE, 'r')
+        f = open(self.relpath(TEMP_LOG_FILE, 'temp'), 'r')
         data = f.read()
         f.close()
         sys.stdout.write(data)
 
 
+######################################################################
+# Parallel test runner
+######################################################################
+
+# Run a single config of a test case in its own temporary directory
+def run_parallel_test(job):
+    fname, index, config_fname, options = job
+    dictdir, tempdir, keepfiles = options
+    casedir = tempfile.mkdtemp(prefix="test_klippy_", dir=tempdir)
+    tc = TestCase(fname, dictdir, casedir, False, True, quiet=True)
+    start_time = time.time()
+    res = tc.run(index)
+    duration = time.time() - start_time
+    if res == 'success' and not keepfiles:
+        shutil.rmtree(casedir)
+    return fname, config_fname, res, duration, casedir
+
+def run_parallel(args, options):
+    # Split each test file into its separate configs
+    jobs = []
+    for fname in args:
+        tc = TestCase(fname, options.dictdir, options.tempdir, False, False)
+        try:
+            tests = tc.parse_test()
+        except error as e:
+            sys.stderr.write("\n\nTest case %s FAILED (%s)!\n\n" % (
+                fname, str(e)))
+            sys.exit(-1)
+        job_options = (options.dictdir, options.tempdir, options.keepfiles)
+        for index, test in enumerate(tests):
+            jobs.append((fname, index, os.path.basename(test[0] or ""),
+                         job_options))
+    # Run the jobs
+    start_time = time.time()
+    results = []
+    pool = multiprocessing.Pool(options.jobs)
+    try:
+        for res in pool.imap_unordered(run_parallel_test, jobs):
+            fname, config_fname, status, duration, casedir = res
+            sys.stderr.write("    %s (%s): %s in %.1fs\n" % (
+                fname, config_fname, status, duration))
+            results.append(res)
+    finally:
+        pool.terminate()
+        pool.join()
+    total_time = time.time() - start_time
+    # Report a timing summary
+    sys.stderr.write("\n    Test timing summary:\n")
+    results.sort(key=lambda r: -r[3])
+    for fname, config_fname, status, duration, casedir in results:
+        sys.stderr.write("    %7.1fs %s (%s)\n" % (
+            duration, fname, config_fname))
+    failures = [r for r in results if r[2] != 'success']
+    for fname, config_fname, status, duration, casedir in failures:
+        sys.stderr.write("\n\nTest case %s (%s) FAILED (%s)!"
+                         " Logs are in %s\n" % (
+                             fname, config_fname, status, casedir))
+    if failures:
+        sys.exit(-1)
+    sys.stderr.write("\n    All %d test cases passed (%d configs in %.1fs,"
+                     " %.1fs of test time)\n" % (
+                         len(args), len(results), total_time,
+                         sum([r[3] for r in results])))
+
+
 ######################################################################
 # Startup
 ######################################################################
@@ -148,10 +235,15 @@ def main():
                     help="do not remove temporary files")
     opts.add_option("-v", action="store_true", dest="verbose",
                     help="show all output from tests")
+    opts.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                    help="number of tests to run in parallel")
     options, args = opts.parse_args()
     if len(args) < 1:
         opts.error("Incorrect number of arguments")
     logging.basicConfig(level=logging.DEBUG)
+    if options.jobs > 1:
+        run_parallel(args, options)
+        return
 
     # Run each test
     for fname in args:
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# Test of the micro-controller session reuse across a RESTART
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, socket, subprocess, tempfile, shutil, time, json
+
+KLIPPER_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+CONFIG = """
+[stepper_x]
+step_pin: ar54
+dir_pin: ar55
+enable_pin: !ar38
+step_distance: .0125
+endstop_pin: ^ar3
+position_endstop: 0
+position_max: 200
+homing_speed: 50
+
+[stepper_y]
+step_pin: ar60
+dir_pin: !ar61
+enable_pin: !ar56
+step_distance: .0125
+endstop_pin: ^ar14
+position_endstop: 0
+position_max: 200
+homing_speed: 50
+
+[stepper_z]
+step_pin: ar46
+dir_pin: ar48
+enable_pin: !ar62
+step_distance: .0025
+endstop_pin: ^ar18
+position_endstop: 0.5
+position_max: 200
+
+[mcu]
+serial: %s
+pin_map: arduino
+%s
+
+[printer]
+kinematics: cartesian
+max_velocity: 300
+max_accel: 3000
+max_z_velocity: 5
+max_z_accel: 100
+"""
+
+MOVES = "G28\nG1 X20 Y20 Z5 F6000\nG1 X10 Y30 F6000\nM400"
+
+class error(Exception):
+    pass
+
+class Tester:
+    def __init__(self, dictionary, tempdir, verbose):
+        self.tempdir = tempdir
+        self.verbose = verbose
+        self.pty = os.path.join(tempdir, 'vmcu')
+        self.config_fname = os.path.join(tempdir, 'printer.cfg')
+        self.log_fname = os.path.join(tempdir, 'klippy.log')
+        self.api_fname = os.path.join(tempdir, 'api')
+        self.write_config(False)
+        self.procs = []
+        self.start([sys.executable,
+                    os.path.join(KLIPPER_DIR, 'scripts/virtual_mcu.py'),
+                    '-p', self.pty, dictionary])
+        while not os.path.exists(self.pty):
+            time.sleep(.1)
+        self.start([sys.executable,
+                    os.path.join(KLIPPER_DIR, 'klippy/klippy.py'),
+                    self.config_fname, '-I', os.path.join(tempdir, 'printer'),
+                    '-a', self.api_fname, '-l', self.log_fname])
+        self.sock = None
+    def start(self, args):
+        out = None if self.verbose else subprocess.DEVNULL
+        self.procs.append(subprocess.Popen(args, stdout=out, stderr=out))
+    def stop(self):
+        for proc in reversed(self.procs):
+            proc.terminate()
+            proc.wait()
+    def write_config(self, broken):
+        f = open(self.config_fname, 'w')
+        # An invalid [mcu] option is reported while creating the mcu
+        extra = "max_stepper_error: -1" if broken else ""
+        f.write(CONFIG % (self.pty, extra))
+        f.close()
+    # Webhooks api access
+    def request(self, method, params={}, timeout=20., retry=True):
+        end_time = time.time() + timeout
+        while 1:
+            if self.sock is None:
+                try:
+                    self.sock = socket.socket(socket.AF_UNIX,
+                                              socket.SOCK_STREAM)
+                    self.sock.settimeout(timeout)
+                    self.sock.connect(self.api_fname)
+                except socket.error:
+                    self.sock = None
+                    if time.time() > end_time:
+                        raise error("Unable to connect to %s" % (
+                            self.api_fname,))
+                    time.sleep(.1)
+                    continue
+            req = json.dumps({'id': 1, 'method': method, 'params': params})
+            try:
+                self.sock.sendall(req.encode() + b'\x03')
+                data = b""
+                while not data.endswith(b'\x03'):
+                    d = self.sock.recv(4096)
+                    if not d:
+                        raise socket.error("Socket closed")
+                    data += d
+            except socket.error:
+                # Host restarted - reconnect and retry
+                self.sock.close()
+                self.sock = None
+                if not retry:
+                    return {}
+                continue
+            return json.loads(data[:-1].decode())
+    def gcode(self, script):
+        res = self.request('gcode/script', {'script': script})
+        if 'error' in res:
+            raise error("G-Code %r failed: %s" % (script, res['error']))
+    def wait_state(self, state, timeout=30.):
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            res = self.request('info')
+            if res.get('result', {}).get('state') == state:
+                return
+            time.sleep(.2)
+        raise error("Printer did not reach state '%s'" % (state,))
+    def restart(self):
+        self.request('gcode/script', {'script': "RESTART"}, retry=False)
+        # Wait for the old host instance to close the api socket
+        time.sleep(1.)
+    def count_log(self, msg):
+        f = open(self.log_fname, 'r')
+        count = len([l for l in f if msg in l])
+        f.close()
+        return count
+    def check_log(self, msg, count):
+        actual = self.count_log(msg)
+        if actual != count:
+            raise error("Found %d (not %d) log lines with %r" % (
+                actual, count, msg))
+    def run(self):
+        self.wait_state('ready')
+        self.gcode(MOVES)
+        # Two warm restarts
+        for i in range(2):
+            self.restart()
+            self.wait_state('ready')
+            self.check_log("Reusing MCU 'mcu' session", i + 1)
+            self.gcode(MOVES)
+        # A config error must close the retained session
+        self.write_config(True)
+        self.restart()
+        self.wait_state('error')
+        self.check_log("Closing retained MCU 'mcu' session", 1)
+        # The next start is a full connect
+        self.write_config(False)
+        self.restart()
+        self.wait_state('ready')
+        self.check_log("Reusing MCU 'mcu' session", 2)
+        self.gcode(MOVES)
+        self.check_log("Transition to shutdown state", 0)
+
+def main():
+    usage = "%prog [options] <atmega2560.dict>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-v", action="store_true", dest="verbose",
+                    help="show all output from the host and virtual mcu")
+    opts.add_option("-k", action="store_true", dest="keepfiles",
+                    help="do not remove temporary files")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    tempdir = tempfile.mkdtemp(prefix="warm_restart_")
+    tester = Tester(os.path.abspath(args[0]), tempdir, options.verbose)
+    try:
+        tester.run()
+    except error as e:
+        sys.stderr.write("FAIL: %s (see %s)\n" % (str(e), tester.log_fname))
+        options.keepfiles = True
+        res = -1
+    else:
+        sys.stdout.write("Warm restart test passed\n")
+        res = 0
+    finally:
+        tester.stop()
+    if options.keepfiles:
+        sys.stdout.write("Temporary files are in %s\n" % (tempdir,))
+    else:
+        shutil.rmtree(tempdir)
+    sys.exit(res)
+
+if __name__ == '__main__':
+    main()
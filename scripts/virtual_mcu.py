@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# Virtual micro-controller that speaks the Klipper protocol over a pty
+#
+# Copyright (C) 2026  agent <agent@local>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, json, zlib, select, heapq, tty, logging
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             '..', 'klippy'))
+import msgproto
+
+STATS_TIME = 5.
+
+######################################################################
+# Simulated peripherals
+######################################################################
+
+class VirtualStepper:
+    def __init__(self, oid):
+        self.oid = oid
+        self.next_clock = 0
+        self.dir = 0
+        self.position = 0
+        self.moves = []
+    def reset_step_clock(self, clock):
+        self.next_clock = clock
+    def queue_step(self, interval, count, add):
+        start_clock = self.next_clock
+        end_clock = (start_clock + interval * count
+                     + add * count * (count - 1) // 2)
+        self.next_clock = end_clock
+        steps = -count if self.dir else count
+        self.moves.append((end_clock, steps))
+        return start_clock + interval, end_clock
+    def update(self, clock):
+        # Apply all moves that completed by the given clock
+        moves = self.moves
+        while moves and moves[0][0] <= clock:
+            self.position += moves.pop(0)[1]
+    def stop(self):
+        # Discard all pending moves (eg, on an endstop trigger)
+        count = len(self.moves)
+        self.moves = []
+        return count
+
+class VirtualEndstop:
+    def __init__(self, oid, stepper_count):
+        self.oid = oid
+        self.steppers = [None] * stepper_count
+        self.homing = False
+        self.pin_value = 0
+        self.trigger_time = 0.
+
+######################################################################
+# Virtual micro-controller
+######################################################################
+
+class VirtualMCU:
+    def __init__(self, fd, dictionary, baud, move_count, home_time,
+                 adc_fraction):
+        self.fd = fd
+        self.move_count = move_count
+        self.home_time = home_time
+        self.adc_fraction = adc_fraction
+        if baud is None:
+            baud = dictionary.get('config', {}).get('SERIAL_BAUD', 0)
+        self.baud = baud
+        if baud:
+            dictionary.setdefault('config', {})['SERIAL_BAUD'] = baud
+        self.identify_data = zlib.compress(json.dumps(dictionary).encode())
+        self.mp = mp = msgproto.MessageParser()
+        mp.process_identify(self.identify_data)
+        self.clock_freq = mp.get_constant_float('CLOCK_FREQ')
+        self.adc_max = mp.get_constant_int('ADC_MAX', 4095)
+        self.static_strings = mp.get_enumerations().get(
+            'static_string_id', {})
+        self.responses = {}
+        self.handlers = {}
+        for attr in dir(self):
+            if attr.startswith('cmd_'):
+                self.handlers[attr[4:]] = getattr(self, attr)
+        # Serial transport state
+        self.start_time = time.monotonic()
+        self.next_sequence = msgproto.MESSAGE_DEST
+        self.input_data = b""
+        self.rx_end_time = self.tx_end_time = 0.
+        self.tx_queue = []
+        self.timers = []
+        self.timer_seq = 0
+        # Config state
+        self.is_config = self.crc = 0
+        self.shutdown_reason = None
+        self.steppers = {}
+        self.endstops = {}
+        self.adcs = {}
+        self.move_queue = []
+        # Statistics
+        self.counts = {'packets': 0, 'bytes': 0, 'commands': 0, 'naks': 0,
+                       'steps': 0, 'moves': 0, 'late_moves': 0,
+                       'max_moves': 0}
+        self.register_timer(self._send_stats, self.start_time + STATS_TIME)
+    # Clock handling
+    def get_clock(self, eventtime=None):
+        if eventtime is None:
+            eventtime = time.monotonic()
+        return int((eventtime - self.start_time) * self.clock_freq)
+    def clock_to_time(self, clock):
+        # Convert a 32bit clock from the host to a system time
+        cur_clock = self.get_clock()
+        diff = ((clock - cur_clock + 0x80000000) & 0xffffffff) - 0x80000000
+        return self.start_time + (cur_clock + diff) / self.clock_freq
+    def extend_clock(self, clock):
+        cur_clock = self.get_clock()
+        diff = ((clock - cur_clock + 0x80000000) & 0xffffffff) - 0x80000000
+        return cur_clock + diff
+    # Timers
+    def register_timer(self, callback, waketime):
+        self.timer_seq += 1
+        heapq.heappush(self.timers, (waketime, self.timer_seq, callback))
+    def _run_timers(self, eventtime):
+        timers = self.timers
+        while timers and timers[0][0] <= eventtime:
+            waketime, seq, callback = heapq.heappop(timers)
+            waketime = callback(waketime)
+            if waketime is not None:
+                self.register_timer(callback, waketime)
+    # Response transmission (paced to the configured baud rate)
+    def _queue_packet(self, data):
+        eventtime = time.monotonic()
+        if self.baud:
+            self.tx_end_time = (max(self.tx_end_time, eventtime)
+                                + len(data) * 10. / self.baud)
+        else:
+            self.tx_end_time = eventtime
+        self.tx_queue.append((self.tx_end_time, data))
+    def _flush_tx(self, eventtime):
+        out = []
+        while self.tx_queue and self.tx_queue[0][0] <= eventtime:
+            out.append(self.tx_queue.pop(0)[1])
+        if out:
+            os.write(self.fd, b''.join(out))
+    def send(self, msgformat, *args):
+        # Responses are sent one per packet (as the real firmware does)
+        mf = self.responses.get(msgformat)
+        if mf is None:
+            mf = self.responses[msgformat] = self.mp.messages_by_name[
+                msgformat]
+        seq = self.next_sequence & msgproto.MESSAGE_SEQ_MASK
+        self._queue_packet(self.mp.encode(seq, mf.encode(args)))
+    def _send_ack(self):
+        seq = self.next_sequence & msgproto.MESSAGE_SEQ_MASK
+        self._queue_packet(self.mp.encode(seq, []))
+    # Command reception
+    def _handle_packet(self, packet, eventtime):
+        seq = packet[msgproto.MESSAGE_POS_SEQ]
+        if seq != self.next_sequence:
+            # Out of order packet - send a nak
+            self.counts['naks'] += 1
+            self._send_ack()
+            return
+        self.next_sequence = ((seq + 1) & msgproto.MESSAGE_SEQ_MASK
+                              | msgproto.MESSAGE_DEST)
+        self.counts['packets'] += 1
+        self.counts['bytes'] += len(packet)
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        end = len(packet) - msgproto.MESSAGE_TRAILER_SIZE
+        msgs = []
+        while pos < end:
+            mid = self.mp.messages_by_id[packet[pos]]
+            params, pos = mid.parse(packet, pos)
+            msgs.append((mid.name, params))
+        self._send_ack()
+        for name, params in msgs:
+            self.counts['commands'] += 1
+            hdl = self.handlers.get(name)
+            if hdl is not None:
+                hdl(params)
+            elif self.shutdown_reason is not None:
+                self.send('is_shutdown', self.shutdown_reason)
+    def _process_input(self, eventtime):
+        try:
+            data = os.read(self.fd, 4096)
+        except OSError:
+            return False
+        if not data:
+            return False
+        self.input_data += data
+        packets, pos, discarded = self.mp.split_packets(self.input_data)
+        for packet in packets:
+            packet = bytes(packet)
+            if self.baud:
+                # Model the time needed to transmit the packet
+                self.rx_end_time = (max(self.rx_end_time, eventtime)
+                                    + len(packet) * 10. / self.baud)
+                self.register_timer(
+                    (lambda e, p=packet: self._handle_packet(p, e)),
+                    self.rx_end_time)
+            else:
+                self._handle_packet(packet, eventtime)
+        self.input_data = self.input_data[pos:]
+        return True
+    def run(self):
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN | select.POLLHUP)
+        while 1:
+            eventtime = time.monotonic()
+            self._run_timers(eventtime)
+            self._flush_tx(eventtime)
+            waketime = eventtime + 1.
+            if self.timers:
+                waketime = min(waketime, self.timers[0][0])
+            if self.tx_queue:
+                waketime = min(waketime, self.tx_queue[0][0])
+            timeout = max(0., waketime - time.monotonic())
+            for fd, event in poll.poll(int(timeout * 1000. + .999)):
+                if not self._process_input(time.monotonic()):
+                    return
+    # Shutdown handling
+    def shutdown(self, reason):
+        if self.shutdown_reason is not None:
+            return
+        if reason not in self.static_strings:
+            reason = "Command request"
+        logging.info("Shutdown: %s", reason)
+        self.shutdown_reason = reason
+        for s in self.steppers.values():
+            s.stop()
+        self.move_queue = []
+        self.adcs.clear()
+        self.send('shutdown', self.get_clock() & 0xffffffff, reason)
+    def _send_stats(self, eventtime):
+        if self.shutdown_reason is None:
+            self.send('stats', 1000, int(self.clock_freq * .001), 0)
+        logging.info("Stats %.1f: %s", eventtime, self.dump_stats())
+        return eventtime + STATS_TIME
+    def dump_stats(self):
+        return " ".join(["%s=%d" % (k, v)
+                         for k, v in sorted(self.counts.items())])
+    # Basic commands
+    def cmd_identify(self, params):
+        offset, count = params['offset'], params['count']
+        self.send('identify_response', offset,
+                  self.identify_data[offset:offset+count])
+    def cmd_get_uptime(self, params):
+        clock = self.get_clock()
+        self.send('uptime', clock >> 32, clock & 0xffffffff)
+    def cmd_get_clock(self, params):
+        self.send('clock', self.get_clock() & 0xffffffff)
+    def cmd_get_config(self, params):
+        self.send('config', self.is_config, self.crc, self.move_count,
+                  self.shutdown_reason is not None)
+    def cmd_finalize_config(self, params):
+        self.is_config = 1
+        self.crc = params['crc']
+    def cmd_config_reset(self, params):
+        self.is_config = self.crc = 0
+        self.shutdown_reason = None
+        self.steppers.clear()
+        self.endstops.clear()
+        self.adcs.clear()
+        self.move_queue = []
+        self.send('starting')
+    def cmd_emergency_stop(self, params):
+        self.shutdown("Command request")
+    def cmd_clear_shutdown(self, params):
+        self.shutdown_reason = None
+    # Steppers
+    def cmd_config_stepper(self, params):
+        oid = params['oid']
+        self.steppers[oid] = VirtualStepper(oid)
+    def cmd_reset_step_clock(self, params):
+        s = self.steppers[params['oid']]
+        s.reset_step_clock(self.extend_clock(params['clock']))
+    def cmd_set_next_step_dir(self, params):
+        self.steppers[params['oid']].dir = params['dir']
+    def cmd_queue_step(self, params):
+        if self.shutdown_reason is not None:
+            return
+        clock = self.get_clock()
+        move_queue = self.move_queue
+        while move_queue and move_queue[0] <= clock:
+            heapq.heappop(move_queue)
+        if len(move_queue) >= self.move_count:
+            self.shutdown("Move queue overflow")
+            return
+        s = self.steppers[params['oid']]
+        first_clock, end_clock = s.queue_step(
+            params['interval'], params['count'], params['add'])
+        if first_clock < clock:
+            self.counts['late_moves'] += 1
+        heapq.heappush(move_queue, end_clock)
+        self.counts['moves'] += 1
+        self.counts['steps'] += params['count']
+        self.counts['max_moves'] = max(self.counts['max_moves'],
+                                       len(move_queue))
+    def cmd_stepper_get_position(self, params):
+        s = self.steppers[params['oid']]
+        s.update(self.get_clock())
+        self.send('stepper_position', s.oid, s.position)
+    # Endstops
+    def cmd_config_endstop(self, params):
+        oid = params['oid']
+        self.endstops[oid] = VirtualEndstop(oid, params['stepper_count'])
+    def cmd_endstop_set_stepper(self, params):
+        e = self.endstops[params['oid']]
+        e.steppers[params['pos']] = self.steppers[params['stepper_oid']]
+    def _endstop_trigger(self, e, eventtime):
+        if not e.homing or e.trigger_time != eventtime:
+            return None
+        e.homing = False
+        clock = self.get_clock(eventtime)
+        for s in e.steppers:
+            if s is not None:
+                s.update(clock)
+                s.stop()
+        self.send('endstop_state', e.oid, 0, e.pin_value)
+        return None
+    def cmd_endstop_home(self, params):
+        e = self.endstops[params['oid']]
+        e.homing = params['sample_count'] != 0
+        e.pin_value = params['pin_value']
+        if not e.homing:
+            return
+        # Report a trigger a fixed time after the start of homing
+        e.trigger_time = self.clock_to_time(params['clock']) + self.home_time
+        self.register_timer((lambda ev, e=e: self._endstop_trigger(e, ev)),
+                            e.trigger_time)
+    def cmd_endstop_query_state(self, params):
+        e = self.endstops[params['oid']]
+        self.send('endstop_state', e.oid, e.homing,
+                  e.pin_value if not e.homing else not e.pin_value)
+    # Analog inputs
+    def _analog_in_event(self, oid, eventtime):
+        query = self.adcs.get(oid)
+        if query is None or query[0] != eventtime:
+            return None
+        waketime, rest_ticks, sample_count, min_value, max_value = query
+        value = int(min_value + (max_value - min_value) * self.adc_fraction)
+        if not max_value:
+            value = int(self.adc_max * sample_count * self.adc_fraction)
+        next_time = waketime + rest_ticks / self.clock_freq
+        next_clock = self.get_clock(next_time) & 0xffffffff
+        self.adcs[oid] = (next_time,) + query[1:]
+        self.send('analog_in_state', oid, next_clock, value)
+        return next_time
+    def cmd_query_analog_in(self, params):
+        oid = params['oid']
+        if not params['sample_count']:
+            self.adcs.pop(oid, None)
+            return
+        waketime = self.clock_to_time(params['clock'])
+        self.adcs[oid] = (waketime, params['rest_ticks'],
+                          params['sample_count'], params['min_value'],
+                          params['max_value'])
+        self.register_timer((lambda e, oid=oid: self._analog_in_event(oid, e)),
+                            waketime)
+
+def create_pty(ptyname):
+    mfd, sfd = os.openpty()
+    try:
+        os.unlink(ptyname)
+    except os.error:
+        pass
+    os.symlink(os.ttyname(sfd), ptyname)
+    tty.setraw(mfd)
+    tty.setraw(sfd)
+    return mfd, sfd
+
+def main():
+    usage = "%prog [options] <dictionary file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-p", "--pty", dest="pty",
+                    default="/tmp/klipper_host_virtual",
+                    help="pseudo-tty to create (default %default)")
+    opts.add_option("-b", "--baud", type="int", dest="baud",
+                    help="serial baud rate to model (0 for unlimited,"
+                    " default is the dictionary SERIAL_BAUD)")
+    opts.add_option("-m", "--move-count", type="int", dest="move_count",
+                    default=500, help="move queue size (default %default)")
+    opts.add_option("-t", "--home-time", type="float", dest="home_time",
+                    default=.500,
+                    help="endstop trigger time after homing starts")
+    opts.add_option("-a", "--adc", type="float", dest="adc", default=.5,
+                    help="reported analog input (fraction of range)")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    logging.basicConfig(level=logging.INFO)
+    f = open(args[0], 'rb')
+    dictionary = json.loads(f.read())
+    f.close()
+    mfd, sfd = create_pty(options.pty)
+    logging.info("Virtual mcu available at %s", options.pty)
+    vmcu = VirtualMCU(mfd, dictionary, options.baud, options.move_count,
+                      options.home_time, options.adc)
+    try:
+        vmcu.run()
+    except KeyboardInterrupt:
+        pass
+    logging.info("Stats: %s", vmcu.dump_stats())
+
+if __name__ == '__main__':
+    main()